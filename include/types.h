@@ -23,6 +23,8 @@
 
 #define NETPLAN_DEPRECATED __attribute__ ((deprecated))
 
+/* Returned by the string getters, if the given buffer is too small. Passing
+ * a NULL buffer to them returns the size needed, incl. the final NUL byte. */
 #define NETPLAN_BUFFER_TOO_SMALL -2
 
 
@@ -19,25 +19,32 @@
 
 '''netplan apply command line'''
 
+import concurrent.futures
+import json
 import logging
 import os
 import sys
 import glob
 import subprocess
 import shutil
-import netifaces
 import time
 
-from .. import utils
+from .. import profiling, utils
 from ...configmanager import ConfigManager, ConfigurationError
 from ..sriov import apply_sriov_config
 from ..ovs import OvsDbServerNotRunning, apply_ovs_cleanup
 
 
-OVS_CLEANUP_SERVICE = 'netplan-ovs-cleanup.service'
+OVS_CLEANUP_SERVICE = utils.OVS_CLEANUP_UNIT
 
 IF_NAMESIZE = 16
 
+# Maximum number of interfaces processed by 'udevadm test' in parallel
+UDEV_MAX_JOBS = min(16, os.cpu_count() or 1)
+
+# Digests of the configuration and generated files of the last successful apply
+APPLY_STAMP = '/run/netplan/netplan-apply.json'
+
 
 class NetplanApply(utils.NetplanCommand):
 
@@ -48,6 +55,8 @@ class NetplanApply(utils.NetplanCommand):
         self.sriov_only = False
         self.only_ovs_cleanup = False
         self.state = None  # to be filled by the '--state' argument
+        self.force = False
+        self.profile = None
 
     def run(self):  # pragma: nocover (covered in autopkgtest)
         self.parser.add_argument('--sriov-only', action='store_true',
@@ -56,6 +65,11 @@ class NetplanApply(utils.NetplanCommand):
                                  help='Only clean up old OpenVSwitch interfaces and exit')
         self.parser.add_argument('--state',
                                  help='Directory containing previous YAML configuration')
+        self.parser.add_argument('--force', action='store_true',
+                                 help='Apply the configuration, even if it did not change since the last apply, '
+                                 'e.g. to rename or configure SR-IOV on interfaces that appeared since')
+        self.parser.add_argument('--profile', nargs='?', const='text', choices=['text', 'json'],
+                                 help='Report the duration of each phase of the apply, as text or JSON')
 
         self.func = self.command_apply
 
@@ -63,6 +77,10 @@ class NetplanApply(utils.NetplanCommand):
         self.run_command()
 
     def command_apply(self, run_generate=True, sync=False, exit_on_error=True, state_dir=None):  # pragma: nocover
+        with profiling.Profiler('apply', self.profile) as profiler:
+            self._command_apply(profiler, run_generate, sync, exit_on_error, state_dir)
+
+    def _command_apply(self, profiler, run_generate, sync, exit_on_error, state_dir):  # pragma: nocover
         config_manager = ConfigManager()
         if state_dir:
             self.state = state_dir
@@ -70,15 +88,18 @@ class NetplanApply(utils.NetplanCommand):
         # For certain use-cases, we might want to only apply specific configuration.
         # If we only need SR-IOV configuration, do that and exit early.
         if self.sriov_only:
+            profiler.start('sriov')
             NetplanApply.process_sriov_config(config_manager, exit_on_error)
             return
         # If we only need OpenVSwitch cleanup, do that and exit early.
         elif self.only_ovs_cleanup:
+            profiler.start('ovs-cleanup')
             NetplanApply.process_ovs_cleanup(config_manager, False, False, exit_on_error)
             return
 
         # if we are inside a snap, then call dbus to run netplan apply instead
         if "SNAP" in os.environ:
+            profiler.start('dbus-apply')
             # TODO: maybe check if we are inside a classic snap and don't do
             # this if we are in a classic snap?
             busctl = shutil.which("busctl")
@@ -108,65 +129,78 @@ class NetplanApply(utils.NetplanCommand):
             else:
                 return
 
+        # Nothing to do if neither the configuration, nor the generated files
+        # changed since the last successful apply
+        profiler.start('prepare')
+        config_digest = utils.config_digest() if run_generate else None
+        stamp = NetplanApply.read_apply_stamp()
+        if config_digest and not self.force and NetplanApply.is_applied(config_digest, stamp):
+            logging.debug('netplan configuration is applied already, nothing to do (use --force to apply anyway)')
+            return
+        NetplanApply.clear_apply_stamp()
+
         ovs_cleanup_service = '/run/systemd/system/netplan-ovs-cleanup.service'
-        old_files_networkd = bool(glob.glob('/run/systemd/network/*netplan-*'))
         old_ovs_glob = glob.glob('/run/systemd/system/netplan-ovs-*')
         # Ignore netplan-ovs-cleanup.service, as it can always be there
         if ovs_cleanup_service in old_ovs_glob:
             old_ovs_glob.remove(ovs_cleanup_service)
         old_files_ovs = bool(old_ovs_glob)
         old_nm_glob = glob.glob('/run/NetworkManager/system-connections/netplan-*')
-        nm_ifaces = utils.nm_interfaces(old_nm_glob, netifaces.interfaces())
-        old_files_nm = bool(old_nm_glob)
-
-        generator_call = []
-        generate_out = None
-        if 'NETPLAN_PROFILE' in os.environ:
-            generator_call.extend(['valgrind', '--leak-check=full'])
-            generate_out = subprocess.STDOUT
-
-        generator_call.append(utils.get_generator_path())
-        if run_generate and subprocess.call(generator_call, stderr=generate_out) != 0:
+        # Snapshot of the system's interfaces, refreshed whenever the set of
+        # links might have changed
+        inventory = utils.InterfaceInventory()
+        nm_ifaces = utils.nm_interfaces(old_nm_glob, inventory.names)
+        pre_digests = utils.generated_files_digests()
+
+        profiler.start('generate')
+        if run_generate and not NetplanApply.generate(config_manager):
             if exit_on_error:
                 sys.exit(os.EX_CONFIG)
             else:
                 raise ConfigurationError("the configuration could not be generated")
 
-        devices = netifaces.interfaces()
-
-        # Re-start service when
-        # 1. We have configuration files for it
-        # 2. Previously we had config files for it but not anymore
-        # Ideally we should compare the content of the *netplan-* files before and
-        # after generation to minimize the number of re-starts, but the conditions
-        # above works too.
-        restart_networkd = bool(glob.glob('/run/systemd/network/*netplan-*'))
-        if not restart_networkd and old_files_networkd:
-            restart_networkd = True
+        devices = inventory.names
+
+        # Re-start a backend only if the content of its generated *netplan-*
+        # files changed (i.e. files were added, modified or removed) since the
+        # last successful apply. Those files might be up to date already, before
+        # generating (e.g. after 'netplan generate', or a 'systemctl daemon-reload',
+        # which re-runs the netplan systemd generator).
+        new_digests = utils.generated_files_digests()
+        if not run_generate:
+            stamp = None  # the backend files might have been restored by 'netplan try'
+        old_digests = NetplanApply.applied_digests(stamp, pre_digests, new_digests)
+        generated_changes = utils.generated_files_changes(old_digests, new_digests)
+        logging.debug('netplan generated file changes: %s', generated_changes)
+        restart_networkd = bool(generated_changes['networkd'])
         restart_ovs_glob = glob.glob('/run/systemd/system/netplan-ovs-*')
         # Ignore netplan-ovs-cleanup.service, as it can always be there
         if ovs_cleanup_service in restart_ovs_glob:
             restart_ovs_glob.remove(ovs_cleanup_service)
         restart_ovs = bool(restart_ovs_glob)
-        if not restart_ovs and old_files_ovs:
+        if generated_changes['OpenVSwitch']:
             # OVS is managed via systemd units
             restart_networkd = True
 
         restart_nm_glob = glob.glob('/run/NetworkManager/system-connections/netplan-*')
         nm_ifaces.update(utils.nm_interfaces(restart_nm_glob, devices))
-        restart_nm = bool(restart_nm_glob)
-        if not restart_nm and old_files_nm:
-            restart_nm = True
+        restart_nm = bool(generated_changes['NetworkManager'])
+        # If the last applied files are unknown, we cannot tell which .link
+        # files or udev rules changed, so consider all interfaces as affected.
+        udev_changed_ids = utils.generated_udev_changes(old_digests, new_digests) if stamp else None
 
         # Running 'systemctl daemon-reload' will re-run the netplan systemd generator,
         # so let's make sure we only run it iff we're willing to run 'netplan generate'
         if run_generate:
+            profiler.start('daemon-reload')
             utils.systemctl_daemon_reload()
         # stop backends
         if restart_networkd:
             logging.debug('netplan generated networkd configuration changed, reloading networkd')
             # Clean up any old netplan related OVS ports/bonds/bridges, if applicable
+            profiler.start('ovs-cleanup')
             NetplanApply.process_ovs_cleanup(config_manager, old_files_ovs, restart_ovs, exit_on_error)
+            profiler.start('networkd-stop')
             wpa_services = ['netplan-wpa-*.service']
             # Historically (up to v0.98) we had netplan-wpa@*.service files, in case of an
             # upgraded system, we need to make sure to stop those.
@@ -174,10 +208,11 @@ class NetplanApply(utils.NetplanCommand):
                 wpa_services.insert(0, 'netplan-wpa@*.service')
             utils.systemctl('stop', wpa_services, sync=sync)
         else:
-            logging.debug('no netplan generated networkd configuration exists')
+            logging.debug('netplan generated networkd configuration unchanged')
 
         if restart_nm:
             logging.debug('netplan generated NM configuration changed, restarting NM')
+            profiler.start('nm-stop')
             if utils.nm_running():
                 # restarting NM does not cause new config to be applied, need to shut down devices first
                 for device in devices:
@@ -191,15 +226,17 @@ class NetplanApply(utils.NetplanCommand):
 
                 utils.systemctl_network_manager('stop', sync=sync)
         else:
-            logging.debug('no netplan generated NM configuration exists')
+            logging.debug('netplan generated NM configuration unchanged')
 
         # Refresh devices now; restarting a backend might have made something appear.
-        devices = netifaces.interfaces()
+        profiler.start('link-changes')
+        inventory.refresh()
+        devices = inventory.names
 
         # evaluate config for extra steps we need to take (like renaming)
         # for now, only applies to non-virtual (real) devices.
         config_manager.parse()
-        changes = NetplanApply.process_link_changes(devices, config_manager)
+        changes = NetplanApply.process_link_changes(inventory, config_manager)
         # delete virtual interfaces that have been defined in a previous state
         # but are not configured anymore in the current YAML
         if self.state:
@@ -214,23 +251,26 @@ class NetplanApply(utils.NetplanCommand):
         # the interface name, if it was already renamed once (e.g. during boot),
         # because of the NamePolicy=keep default:
         # https://www.freedesktop.org/software/systemd/man/systemd.net-naming-scheme.html
-        devices = netifaces.interfaces()
-        for device in devices:
-            logging.debug('netplan triggering .link rules for %s', device)
-            try:
-                subprocess.check_call(['udevadm', 'test-builtin',
-                                       'net_setup_link',
-                                       '/sys/class/net/' + device],
-                                      stdout=subprocess.DEVNULL,
-                                      stderr=subprocess.DEVNULL)
-                subprocess.check_call(['udevadm', 'test',
-                                       '/sys/class/net/' + device],
-                                      stdout=subprocess.DEVNULL,
-                                      stderr=subprocess.DEVNULL)
-            except subprocess.CalledProcessError:
-                logging.debug('Ignoring device without syspath: %s', device)
-
-        devices_after_udev = netifaces.interfaces()
+        profiler.start('udev-test')
+        inventory.refresh()
+        devices = inventory.names
+        # Only re-evaluate the interfaces whose generated .link file or udev
+        # rules changed, all of them if we cannot map a change to its links.
+        udev_devices = None
+        if udev_changed_ids is not None:
+            udev_devices = NetplanApply.networkd_changed_links(udev_changed_ids, config_manager, inventory)
+        if udev_devices is None:
+            udev_devices = devices
+            trigger_ifindexes = None  # trigger all network interfaces
+        else:
+            udev_devices = [device for device in devices if device in udev_devices]
+            # Keep track of the interfaces by index, as they might get renamed
+            trigger_ifindexes = set(inventory[device].ifindex for device in udev_devices)
+        NetplanApply.udev_test_links(udev_devices)
+
+        profiler.start('link-rename')
+        inventory.refresh()
+        devices_after_udev = inventory.names
         # apply some more changes manually
         for iface, settings in changes.items():
             # rename non-critical network interfaces
@@ -242,6 +282,8 @@ class NetplanApply(utils.NetplanCommand):
                 if iface in devices and new_name in devices_after_udev:
                     logging.debug('Interface rename {} -> {} already happened.'.format(iface, new_name))
                     continue  # re-name already happened via 'udevadm test'
+                if trigger_ifindexes is not None and iface in inventory:
+                    trigger_ifindexes.add(inventory[iface].ifindex)
                 # bring down the interface, using its current (matched) interface name
                 subprocess.check_call(['ip', 'link', 'set', 'dev', iface, 'down'],
                                       stdout=subprocess.DEVNULL,
@@ -255,13 +297,28 @@ class NetplanApply(utils.NetplanCommand):
 
         # Reloading of udev rules happens during 'netplan generate' already
         # subprocess.check_call(['udevadm', 'control', '--reload-rules'])
-        subprocess.check_call(['udevadm', 'trigger', '--attr-match=subsystem=net'])
-        subprocess.check_call(['udevadm', 'settle'])
+        profiler.start('udev-trigger')
+        if trigger_ifindexes is None:
+            subprocess.check_call(['udevadm', 'trigger', '--attr-match=subsystem=net'])
+            subprocess.check_call(['udevadm', 'settle'])
+        elif trigger_ifindexes:
+            inventory.refresh()
+            syspaths = ['/sys/class/net/' + inventory.by_ifindex(ifindex).name
+                        for ifindex in sorted(trigger_ifindexes - {None}) if inventory.by_ifindex(ifindex)]
+            if syspaths:
+                subprocess.check_call(['udevadm', 'trigger'] + syspaths)
+                subprocess.check_call(['udevadm', 'settle'])
+        else:
+            logging.debug('netplan generated .link files and udev rules unchanged')
 
         # apply any SR-IOV related changes, if applicable
-        NetplanApply.process_sriov_config(config_manager, exit_on_error)
+        # (interfaces might have been renamed, in the meantime)
+        profiler.start('sriov')
+        inventory.refresh()
+        NetplanApply.process_sriov_config(config_manager, exit_on_error, inventory)
 
         # (re)set global regulatory domain
+        profiler.start('backend-start')
         if os.path.exists('/run/systemd/system/netplan-regdom.service'):
             utils.systemctl('start', ['netplan-regdom.service'])
         # (re)start backends
@@ -274,7 +331,18 @@ class NetplanApply(utils.NetplanCommand):
             # with 'oneshot' systemd service units, e.g. netplan-ovs-*.service.
             try:
                 utils.networkctl_reload()
-                utils.networkctl_reconfigure(utils.networkd_interfaces())
+                reconfigure_links = utils.networkd_interfaces()
+                # Only reconfigure the links whose configuration changed, to
+                # avoid disrupting (e.g. DHCP renewal) all the others.
+                # If the last applied files are unknown, all files are
+                # considered as changed, so reconfigure all links.
+                changed_links = None
+                if stamp:
+                    changed_ids = set(generated_changes['networkd']) | set(generated_changes['OpenVSwitch'])
+                    changed_links = NetplanApply.networkd_changed_links(changed_ids, config_manager, inventory)
+                if changed_links is not None:
+                    reconfigure_links &= utils.interface_indexes(changed_links)
+                utils.networkctl_reconfigure(reconfigure_links)
             except subprocess.CalledProcessError:
                 # (re-)start systemd-networkd if it is not running, yet
                 logging.warning('Falling back to a hard restart of systemd-networkd.service')
@@ -284,6 +352,7 @@ class NetplanApply(utils.NetplanCommand):
             # 2nd: start all other services
             utils.systemctl('start', netplan_wpa + netplan_ovs, sync=True)
         if restart_nm:
+            profiler.start('nm-start')
             # Flush all IP addresses of NM managed interfaces, to avoid NM creating
             # new, non netplan-* connection profiles, using the existing IPs.
             for iface in utils.nm_interfaces(restart_nm_glob, devices):
@@ -309,6 +378,67 @@ class NetplanApply(utils.NetplanCommand):
                         break
                     time.sleep(0.5)
 
+        if config_digest:
+            NetplanApply.write_apply_stamp(config_digest, new_digests)
+
+    @staticmethod
+    def read_apply_stamp():
+        """
+        Return the stamp written by the last successful apply, or None if it
+        is missing or unreadable.
+        """
+        try:
+            with open(APPLY_STAMP, 'r') as f:
+                stamp = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(stamp, dict) or not isinstance(stamp.get('generated'), dict):
+            return None
+        return stamp
+
+    @staticmethod
+    def is_applied(config_digest, stamp=None):
+        """
+        Check if the configuration of the given digest was applied by the last
+        successful apply and its generated files did not change since. The
+        stamp of the last apply is read, if not given.
+        """
+        stamp = stamp or NetplanApply.read_apply_stamp()
+        if not stamp:
+            return False
+        return (stamp.get('config') == config_digest
+                and stamp.get('generated') == utils.generated_files_digests())
+
+    @staticmethod
+    def applied_digests(stamp, pre_digests, new_digests):
+        """
+        Return the digests of the generated files, as applied by the last
+        successful apply of the given stamp, to compare new_digests against.
+        If those are unknown (no stamp, e.g. without a generator run, as the
+        backend files might have been restored by 'netplan try'), all files
+        that existed before generating (pre_digests) or exist now are
+        considered as changed.
+        """
+        if stamp:
+            return stamp['generated']
+        return utils.unknown_files_digests(pre_digests, new_digests)
+
+    @staticmethod
+    def write_apply_stamp(config_digest, generated_digests):
+        try:
+            os.makedirs(os.path.dirname(APPLY_STAMP), mode=0o700, exist_ok=True)
+            with open(APPLY_STAMP, 'w') as f:
+                json.dump({'config': config_digest, 'generated': generated_digests}, f)
+        except OSError as e:  # pragma: nocover (only relevant to filesystem failures)
+            logging.warning('Cannot write {}: {}'.format(APPLY_STAMP, e))
+
+    @staticmethod
+    def clear_apply_stamp():
+        try:
+            os.remove(APPLY_STAMP)
+        except FileNotFoundError:
+            pass
+
     @staticmethod
     def is_composite_member(composites, phy):
         """
@@ -352,6 +482,66 @@ class NetplanApply(utils.NetplanCommand):
 
         return dropped_interfaces
 
+    @staticmethod
+    def generate(config_manager: ConfigManager) -> bool:
+        """
+        Generate the backend configuration from the parsed configuration,
+        in-process. The generator binary is run instead, if asked for via
+        NETPLAN_GENERATE_SUBPROCESS, for debugging, e.g. through valgrind
+        (NETPLAN_PROFILE).
+        Returns True on success.
+        """
+        rootdir = config_manager.prefix
+        if os.environ.get('NETPLAN_GENERATE_SUBPROCESS'):
+            generator_call = []
+            generate_out = None
+            if 'NETPLAN_PROFILE' in os.environ:
+                generator_call.extend(['valgrind', '--leak-check=full'])
+                generate_out = subprocess.STDOUT
+            generator_call.append(utils.get_generator_path())
+            if rootdir != '/':
+                generator_call.extend(['--root-dir', rootdir])
+            return subprocess.call(generator_call, stderr=generate_out) == 0
+
+        try:
+            np_state = config_manager.parse()
+            np_state.generate(rootdir=rootdir)
+        except utils.config_errors as e:
+            logging.error(str(e))
+            return False
+        if len(np_state):
+            # We may have written .rules & .link files, so udevd needs to
+            # reload its configuration (it does so at most every 3 seconds).
+            subprocess.call(['udevadm', 'control', '--reload'], stderr=subprocess.DEVNULL)
+        return True
+
+    @staticmethod
+    def udev_test_links(devices, max_jobs=UDEV_MAX_JOBS):
+        '''
+        Re-evaluate the .link files and udev rules of the given interfaces,
+        processing up to max_jobs interfaces in parallel.
+        '''
+        def _udev_test(device):
+            logging.debug('netplan triggering .link rules for %s', device)
+            try:
+                subprocess.check_call(['udevadm', 'test-builtin',
+                                       'net_setup_link',
+                                       '/sys/class/net/' + device],
+                                      stdout=subprocess.DEVNULL,
+                                      stderr=subprocess.DEVNULL)
+                subprocess.check_call(['udevadm', 'test',
+                                       '/sys/class/net/' + device],
+                                      stdout=subprocess.DEVNULL,
+                                      stderr=subprocess.DEVNULL)
+            except subprocess.CalledProcessError:
+                logging.debug('Ignoring device without syspath: %s', device)
+
+        if not devices:
+            return
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_jobs) as executor:
+            # Consume the results, to raise any unexpected exception
+            list(executor.map(_udev_test, devices))
+
     @staticmethod
     def process_link_changes(interfaces, config_manager: ConfigManager):  # pragma: nocover (covered in autopkgtest)
         """
@@ -397,9 +587,36 @@ class NetplanApply(utils.NetplanCommand):
         return changes
 
     @staticmethod
-    def process_sriov_config(config_manager, exit_on_error=True):  # pragma: nocover (covered in autopkgtest)
+    def networkd_changed_links(changed_ids, config_manager: ConfigManager, devices):
+        """
+        Map the netdef IDs whose generated networkd configuration changed to
+        the names of the links they apply to.
+        Returns None if a changed netdef cannot be mapped to its links, in
+        which case all the networkd managed links should be reconfigured.
+        """
+        links = set()
+        netdefs = config_manager.netdefs
+        for netdef_id in changed_ids:
+            netdef = netdefs.get(netdef_id)
+            if netdef and netdef._has_match:
+                if netdef.set_name and netdef.set_name in devices:
+                    links.add(netdef.set_name)
+                else:
+                    links.update(utils.find_matching_ifaces(devices, netdef))
+            elif netdef_id in devices:
+                # The netdef ID equals the interface name, if there is no match
+                links.add(netdef_id)
+            elif not netdef:
+                # The netdef was dropped, we cannot tell which link it used to match
+                logging.debug('Cannot find link of dropped netdef {}'.format(netdef_id))
+                return None
+        logging.debug('Changed networkd links: {}'.format(links))
+        return links
+
+    @staticmethod
+    def process_sriov_config(config_manager, exit_on_error=True, inventory=None):  # pragma: nocover (autopkgtest)
         try:
-            apply_sriov_config(config_manager)
+            apply_sriov_config(config_manager, inventory=inventory)
         except utils.config_errors as e:
             logging.error(str(e))
             if exit_on_error:
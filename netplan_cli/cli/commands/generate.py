@@ -39,6 +39,11 @@ class NetplanGenerate(utils.NetplanCommand):
                                  help='Search for and generate configuration files in this root directory instead of /')
         self.parser.add_argument('--mapping',
                                  help='Display the netplan device ID/backend/interface name mapping and exit.')
+        self.parser.add_argument('--incremental', action='store_true',
+                                 help='Only write or remove the generated files whose contents changed')
+        self.parser.add_argument('--manifest',
+                                 help='Write a JSON manifest of the added, changed and removed files '
+                                      'to this file (\'-\' for stdout), implies --incremental')
 
         self.func = self.command_generate
 
@@ -80,6 +85,10 @@ class NetplanGenerate(utils.NetplanCommand):
             argv += ['--root-dir', self.root_dir]
         if self.mapping:
             argv += ['--mapping', self.mapping]
+        if self.incremental:
+            argv += ['--incremental']
+        if self.manifest:
+            argv += ['--manifest', self.manifest]
         logging.debug('command generate: running %s', argv)
         # FIXME: os.execv(argv[0], argv) would be better but fails coverage
         sys.exit(subprocess.call(argv))
@@ -17,6 +17,8 @@
 
 '''netplan get command line'''
 
+import sys
+
 from ..state import NetplanConfigState
 from .. import utils
 
@@ -39,4 +41,4 @@ class NetplanGet(utils.NetplanCommand):
 
     def command_get(self):
         state_data = NetplanConfigState(self.key, self.root_dir)
-        print(state_data, end='')
+        state_data.write(sys.stdout)
@@ -17,17 +17,28 @@
 
 '''netplan status command line'''
 
+import contextlib
 import json
 import logging
 import re
+import select
+import sys
+import threading
+import time
 
 import yaml
 
-from .. import utils
+import dbus
+
+from .. import metrics, netlink, utils
 from ..state import SystemConfigState, JSON
 
 
 MATCH_TAGS = re.compile(r'\[([a-z0-9]+)\].*\[\/\1\]')
+# Time (in seconds) to collect further change notifications, after receiving
+# the first one, so that a burst of them leads to a single update.
+WATCH_COALESCE_DELAY = 0.2
+WATCH_DBUS_SERVICES = ['org.freedesktop.network1', 'org.freedesktop.resolve1']
 RICH_OUTPUT = False
 try:
     from rich.console import Console
@@ -60,7 +71,11 @@ class NetplanStatus(utils.NetplanCommand):
         self.parser.add_argument('-v', '--verbose', action='store_true',
                                  help='Show extra information')
         self.parser.add_argument('-f', '--format', default='tabular',
-                                 help='Output in machine readable `json` or `yaml` format')
+                                 help='Output in machine readable `json`, `yaml` or `openmetrics` format')
+        self.parser.add_argument('-w', '--watch', action='store_true',
+                                 help='Keep running and show the changes of the networking state')
+        self.parser.add_argument('--serve-metrics', metavar='ADDRESS', default=None,
+                                 help='Keep running and serve OpenMetrics on a unix socket path or a TCP [host:]port')
 
         self.func = self.command
         self.parse_args()
@@ -98,11 +113,12 @@ class NetplanStatus(utils.NetplanCommand):
         global_state = data.get('netplan-global-state', {})
         interfaces = [(key, data[key]) for key in data if key != 'netplan-global-state']
 
-        # Global state
-        pprint(('{title:>'+pad+'} {value}').format(
-            title='Online state:',
-            value='[online]online[/online]' if global_state.get('online', False) else '[offline]offline[/offline]',
-            ))
+        # Global state, the online state is unknown when querying a single interface
+        if 'online' in global_state:
+            pprint(('{title:>'+pad+'} {value}').format(
+                title='Online state:',
+                value='[online]online[/online]' if global_state.get('online', False) else '[offline]offline[/offline]',
+                ))
         ns = global_state.get('nameservers', {})
         dns_addr: list = ns.get('addresses', [])
         dns_mode: str = ns.get('mode')
@@ -238,6 +254,14 @@ class NetplanStatus(utils.NetplanCommand):
                         start=default_start,
                         end=default_end))
 
+            hidden_routes: dict = data.get('hidden_routes', {})
+            if hidden_routes:
+                pprint(('{title:>'+pad+'} [muted]{count} more ({protocols}), use "--verbose" to show[/muted]').format(
+                    title='Routes:' if not lst else '',
+                    count=sum(hidden_routes.values()),
+                    protocols=', '.join('{}: {}'.format(proto, count) for proto, count in sorted(hidden_routes.items())),
+                    ))
+
             val = data.get('activation_mode')
             if val:
                 pprint(('{title:>'+pad+'} {value}').format(
@@ -250,8 +274,43 @@ class NetplanStatus(utils.NetplanCommand):
         if (hidden > 0):
             pprint('{} inactive interfaces hidden. Use "--all" to show all.'.format(hidden))
 
+    def print_changes(self, state_data: SystemConfigState, changes: JSON) -> None:
+        '''
+        Print the changes of the state while watching it: a single line of
+        JSON (or YAML document) holding the changed interfaces only, or the
+        whole human readable output, redrawn.
+        '''
+        output_format = self.format.lower()
+        if output_format == 'json':
+            print(json.dumps(changes), flush=True)
+        elif output_format == 'yaml':
+            print(yaml.dump(changes, explicit_start=True), end='', flush=True)
+        elif output_format == 'openmetrics':
+            print('\n'.join(metrics.openmetrics(state_data)), flush=True)
+        else:
+            if sys.stdout.isatty():
+                print('\033[H\033[2J', end='')  # clear the screen
+            self.pretty_print(state_data.get_data(), state_data.number_of_interfaces)
+            sys.stdout.flush()
+
     def command(self):
-        state_data = SystemConfigState(self.ifname, self.all)
+        start = time.monotonic()
+        state_data = SystemConfigState(self.ifname, self.all, self.verbose)
+        histogram = metrics.Histogram()
+        histogram.observe(time.monotonic() - start)
+
+        if self.serve_metrics:
+            self.serve(state_data, histogram)
+            return
+
+        if self.watch:
+            self.print_changes(state_data, state_data.get_data())
+            try:
+                with StatusWatcher(state_data, lambda changes: self.print_changes(state_data, changes)) as watcher:
+                    watcher.run()
+            except KeyboardInterrupt:
+                pass
+            return
 
         # Output data in requested format
         output_format = self.format.lower()
@@ -259,5 +318,138 @@ class NetplanStatus(utils.NetplanCommand):
             print(json.dumps(state_data.get_data()))
         elif output_format == 'yaml':  # stuctural YAML output
             print(yaml.dump(state_data.get_data()))
+        elif output_format == 'openmetrics':  # Prometheus exposition
+            print('\n'.join(metrics.openmetrics(state_data, histogram)))
         else:  # pretty print, human readable output
             self.pretty_print(state_data.get_data(), state_data.number_of_interfaces)
+
+    def serve(self, state_data: SystemConfigState, histogram: metrics.Histogram) -> None:
+        '''
+        Serve the metrics of the state, keeping it up to date incrementally
+        while watching the changes, so that a scrape does not re-collect it.
+        '''
+        exporter = metrics.Exporter(state_data, histogram)
+        try:
+            server = metrics.make_server(self.serve_metrics, exporter)
+        except (OSError, ValueError) as e:
+            logging.error('Cannot serve metrics on {}: {}'.format(self.serve_metrics, e))
+            sys.exit(1)
+        with StatusWatcher(state_data, lambda changes: None, lock=exporter) as watcher:
+            threading.Thread(target=watcher.run, daemon=True).start()
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                server.server_close()
+
+
+def dbus_path_ifindex(path: str) -> int:
+    '''
+    Get the interface index from the D-Bus object path of a
+    systemd-networkd/-resolved link, e.g. '/org/freedesktop/network1/link/_32'.
+    Returns None for other objects.
+    '''
+    if not path or '/link/' not in path:
+        return None
+    name = re.sub(r'_([0-9a-f]{2})', lambda m: chr(int(m.group(1), 16)), path.rsplit('/', 1)[1])
+    return int(name) if name.isdigit() else None
+
+
+class StatusWatcher():
+    '''
+    Keep the system state up to date, listening to the netlink notifications
+    about changed links, addresses and routes, as well as to the property
+    changes of systemd-networkd and systemd-resolved, and pass the changed
+    parts of it to the callback. The updates are done holding the lock, if any.
+    '''
+
+    def __init__(self, state_data: SystemConfigState, callback, delay: float = WATCH_COALESCE_DELAY, lock=None):
+        self.state_data = state_data
+        self.callback = callback
+        self.delay = delay
+        self.lock = lock or contextlib.nullcontext()
+        self.monitor = netlink.Monitor()
+        # interfaces to update; None requests a full refresh
+        self.pending = set()
+        self.changed = False
+        self._glib = None
+        self._timer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.monitor.close()
+
+    def _changed(self):
+        self.changed = True
+        if self._glib and self._timer is None:
+            self._timer = self._glib.timeout_add(int(self.delay * 1000), self._on_timeout)
+
+    def on_netlink(self, *args) -> bool:
+        ifindexes = self.monitor.read()
+        if ifindexes is None or self.pending is None:
+            self.pending = None
+        else:
+            self.pending |= ifindexes
+        if ifindexes != set():
+            self._changed()
+        return True  # keep the GLib watch
+
+    def on_properties_changed(self, interface, changed, invalidated, path=None):
+        ifindex = dbus_path_ifindex(path)
+        if ifindex and self.pending is not None:
+            self.pending.add(ifindex)
+        self._changed()
+
+    def _on_timeout(self) -> bool:
+        self._timer = None
+        self.flush()
+        return False  # one-shot
+
+    def flush(self):
+        '''Update the state of the interfaces, that changed since the last call'''
+        if not self.changed:
+            return
+        pending = self.pending
+        self.pending = set()
+        self.changed = False
+        with self.lock:
+            changes = self.state_data.update(pending)
+        if changes:
+            self.callback(changes)
+
+    def run(self):
+        try:
+            from dbus.mainloop.glib import DBusGMainLoop
+            from gi.repository import GLib
+        except ImportError:  # pragma: nocover (covered in autopkgtest)
+            logging.debug('GLib not available, not watching systemd-networkd/-resolved on D-Bus')
+            self.run_select()
+            return
+        self.run_glib(GLib, DBusGMainLoop)  # pragma: nocover (covered in autopkgtest)
+
+    def run_glib(self, GLib, DBusGMainLoop):  # pragma: nocover (covered in autopkgtest)
+        self._glib = GLib
+        bus = dbus.SystemBus(mainloop=DBusGMainLoop())
+        for name in WATCH_DBUS_SERVICES:
+            bus.add_signal_receiver(self.on_properties_changed, signal_name='PropertiesChanged',
+                                    dbus_interface='org.freedesktop.DBus.Properties',
+                                    bus_name=name, path_keyword='path')
+        GLib.io_add_watch(self.monitor.fileno(), GLib.PRIORITY_DEFAULT, GLib.IO_IN, self.on_netlink)
+        GLib.MainLoop().run()
+
+    def run_select(self, iterations: int = None):
+        '''Watch the netlink notifications only, without a main loop'''
+        while iterations is None or iterations > 0:
+            select.select([self.monitor], [], [])
+            self.on_netlink()
+            # collect the burst of notifications that usually follows
+            deadline = time.monotonic() + self.delay
+            while (timeout := deadline - time.monotonic()) > 0:
+                if select.select([self.monitor], [], [], timeout)[0]:
+                    self.on_netlink()
+            self.flush()
+            if iterations:
+                iterations -= 1
@@ -0,0 +1,211 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2023 Canonical, Ltd.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Export of the networking state in the OpenMetrics (Prometheus) text format'''
+
+import http.server
+import logging
+import os
+import socket
+import socketserver
+import stat
+import threading
+import time
+from typing import Iterator
+
+from .state import SystemConfigState
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+# Upper bounds (in seconds) of the collection duration histogram buckets
+DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+FAMILIES = {2: 'ipv4', 10: 'ipv6'}
+
+
+class Histogram():
+    '''A cumulative histogram, e.g. of the durations of the state collections'''
+
+    def __init__(self, buckets: list = DURATION_BUCKETS):
+        self.buckets = list(buckets) + [float('inf')]
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _sample(name: str, value, **labels) -> str:
+    if labels:
+        name += '{' + ','.join('{}="{}"'.format(k, _escape(v)) for k, v in labels.items()) + '}'
+    return '{} {}'.format(name, value)
+
+
+def _bound(value: float) -> str:
+    return '+Inf' if value == float('inf') else repr(value)
+
+
+def openmetrics(state: SystemConfigState, histogram: Histogram = None) -> Iterator[str]:
+    '''
+    Generate the lines of the OpenMetrics exposition of the given state.
+    Only the interface records are looked at, the (more costly) output data
+    of SystemConfigState.get_data() is not built.
+    '''
+    interfaces = state.shown_interfaces
+    if not state.single:
+        yield '# TYPE netplan_online gauge'
+        yield '# HELP netplan_online Whether the system is online, i.e. has a configured interface with a default route and DNS.'
+        yield _sample('netplan_online', int(bool(state.online)))
+
+    yield '# TYPE netplan_interface info'
+    yield '# HELP netplan_interface Information about the interface.'
+    for itf in interfaces:
+        yield _sample('netplan_interface_info', 1, interface=itf.name, index=itf.idx, type=itf.type or '',
+                      backend=itf.backend or '', netdef=itf.netdef_id or '', operstate=itf.operstate)
+
+    yield '# TYPE netplan_interface_admin_up gauge'
+    yield '# HELP netplan_interface_admin_up Whether the interface is administratively up.'
+    for itf in interfaces:
+        yield _sample('netplan_interface_admin_up', int(itf.adminstate == 'UP'), interface=itf.name)
+
+    yield '# TYPE netplan_interface_oper_up gauge'
+    yield '# HELP netplan_interface_oper_up Whether the interface is operationally up.'
+    for itf in interfaces:
+        yield _sample('netplan_interface_oper_up', int(itf.operstate == 'UP'), interface=itf.name)
+
+    yield '# TYPE netplan_interface_addresses gauge'
+    yield '# HELP netplan_interface_addresses Number of IP addresses of the interface.'
+    for itf in interfaces:
+        addresses = [addr for elem in itf.addresses or [] for addr in elem]
+        ipv6 = sum(1 for addr in addresses if ':' in addr)
+        yield _sample('netplan_interface_addresses', len(addresses) - ipv6, interface=itf.name, family='ipv4')
+        yield _sample('netplan_interface_addresses', ipv6, interface=itf.name, family='ipv6')
+
+    yield '# TYPE netplan_interface_default_route gauge'
+    yield '# HELP netplan_interface_default_route Whether the interface has a default route.'
+    for itf in interfaces:
+        defaults = set(FAMILIES.get(route.get('family')) for route in itf.routes or [] if route.get('to') == 'default')
+        for family in FAMILIES.values():
+            yield _sample('netplan_interface_default_route', int(family in defaults), interface=itf.name, family=family)
+
+    yield '# TYPE netplan_netdef info'
+    yield '# HELP netplan_netdef The netplan definitions, as rendered by their backend.'
+    netdefs = dict((itf.netdef_id, itf.backend) for itf in interfaces if itf.netdef_id)
+    for netdef, backend in sorted(netdefs.items()):
+        yield _sample('netplan_netdef_info', 1, netdef=netdef, backend=backend)
+
+    if histogram:
+        name = 'netplan_status_collection_duration_seconds'
+        yield '# TYPE {} histogram'.format(name)
+        yield '# HELP {} Time spent querying the networking state.'.format(name)
+        yield '# UNIT {} seconds'.format(name)
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            yield _sample(name + '_bucket', count, le=_bound(bound))
+        yield _sample(name + '_sum', histogram.sum)
+        yield _sample(name + '_count', histogram.count)
+    yield '# EOF'
+
+
+class Exporter():
+    '''
+    Keep the metrics of a (warm) SystemConfigState. Used as a context
+    manager around each update of the state, it serializes the update with
+    the scrapes and records its duration.
+    '''
+
+    def __init__(self, state: SystemConfigState, histogram: Histogram = None):
+        self.state = state
+        self.histogram = histogram or Histogram()
+        self.lock = threading.Lock()
+        self._start = None
+
+    def __enter__(self):
+        self.lock.acquire()
+        self._start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.monotonic() - self._start)
+        self.lock.release()
+
+    def render(self) -> bytes:
+        with self.lock:
+            return ''.join(line + '\n' for line in openmetrics(self.state, self.histogram)).encode('utf-8')
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ['/', '/metrics']:
+            self.send_error(404)
+            return
+        body = self.server.exporter.render()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self) -> str:
+        # the client address of a unix socket is an empty string
+        return 'unix' if isinstance(self.client_address, str) else self.client_address[0]
+
+    def log_message(self, format, *args):
+        logging.debug('metrics: %s - %s', self.address_string(), format % args)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        try:
+            if stat.S_ISSOCK(os.stat(self.server_address).st_mode):
+                os.unlink(self.server_address)  # stale socket of an earlier run
+        except FileNotFoundError:
+            pass
+        super().server_bind()
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except FileNotFoundError:
+            pass
+
+
+def make_server(address: str, exporter: Exporter) -> socketserver.BaseServer:
+    '''
+    Create the HTTP server, serving the metrics of the exporter, on a unix
+    socket path (containing a '/') or on a TCP '[host:]port', listening on all
+    IPv4 addresses by default.
+    '''
+    if '/' in address:
+        server = UnixHTTPServer(address, MetricsHandler)
+    else:
+        host, _, port = address.rpartition(':')
+        host = host.strip('[]')
+        server_class = http.server.ThreadingHTTPServer
+        if ':' in host:
+            server_class = type('HTTPServer6', (server_class,), {'address_family': socket.AF_INET6})
+        server = server_class((host, int(port)), MetricsHandler)
+    server.exporter = exporter
+    return server
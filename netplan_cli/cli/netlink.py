@@ -0,0 +1,490 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2023 Canonical, Ltd.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Minimal rtnetlink client, dumping the links, addresses and routes of the
+system in-process. The data is returned in the same shape as the JSON output
+of 'ip -d -j addr' and 'ip -d -j route show table all'. A Monitor socket
+receives the notifications about changes to them.
+'''
+
+import errno
+import os
+import socket
+import struct
+from collections import Counter
+from typing import Iterable
+
+# linux/netlink.h
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+SOL_NETLINK = 270
+NETLINK_GET_STRICT_CHK = 12
+
+# linux/rtnetlink.h
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+RTM_NEWROUTE = 24
+RTM_DELROUTE = 25
+RTM_GETROUTE = 26
+RTM_F_CLONED = 0x200
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV4_ROUTE = 0x40
+RTMGRP_IPV6_IFADDR = 0x100
+RTMGRP_IPV6_ROUTE = 0x400
+RTMGRP_ALL = RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV4_ROUTE | RTMGRP_IPV6_IFADDR | RTMGRP_IPV6_ROUTE
+
+# linux/if_link.h
+IFLA_ADDRESS = 1
+IFLA_IFNAME = 3
+IFLA_MTU = 4
+IFLA_OPERSTATE = 16
+IFLA_LINKINFO = 18
+IFLA_PERM_ADDRESS = 54
+IFLA_INFO_KIND = 1
+
+# linux/if_addr.h
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_LABEL = 3
+
+# linux/rtnetlink.h (rtattr_type_t)
+RTA_DST = 1
+RTA_OIF = 4
+RTA_GATEWAY = 5
+RTA_PRIORITY = 6
+RTA_PREFSRC = 7
+RTA_TABLE = 15
+
+NLMSGHDR = struct.Struct('=IHHII')
+RTATTR = struct.Struct('=HH')
+IFINFOMSG = struct.Struct('=BxHiII')
+IFADDRMSG = struct.Struct('=BBBBI')
+RTMSG = struct.Struct('=BBBBBBBBI')
+
+RECV_BUFSIZE = 1 << 18
+
+# Flags in the order printed by iproute2
+IFF_FLAGS = [
+    ('LOOPBACK', 0x8),
+    ('BROADCAST', 0x2),
+    ('POINTOPOINT', 0x10),
+    ('MULTICAST', 0x1000),
+    ('NOARP', 0x80),
+    ('ALLMULTI', 0x200),
+    ('PROMISC', 0x100),
+    ('MASTER', 0x400),
+    ('SLAVE', 0x800),
+    ('DEBUG', 0x4),
+    ('DYNAMIC', 0x8000),
+    ('AUTOMEDIA', 0x4000),
+    ('PORTSEL', 0x2000),
+    ('NOTRAILERS', 0x20),
+    ('UP', 0x1),
+    ('LOWER_UP', 0x10000),
+    ('DORMANT', 0x20000),
+    ('ECHO', 0x40000),
+    ]
+OPERSTATES = ['UNKNOWN', 'NOTPRESENT', 'DOWN', 'LOWERLAYERDOWN', 'TESTING', 'DORMANT', 'UP']
+FAMILIES = {socket.AF_INET: 'inet', socket.AF_INET6: 'inet6'}
+# Names from /etc/iproute2/rt_*, as used by iproute2
+RT_SCOPES = {0: 'global', 200: 'site', 253: 'link', 254: 'host', 255: 'nowhere'}
+RT_TABLES = {253: 'default', 254: 'main', 255: 'local'}
+RT_TYPES = ['unspec', 'unicast', 'local', 'broadcast', 'anycast', 'multicast', 'blackhole',
+            'unreachable', 'prohibit', 'throw', 'nat', 'xresolve']
+RT_PROTOCOLS = {
+    0: 'unspec', 1: 'redirect', 2: 'kernel', 3: 'boot', 4: 'static', 8: 'gated', 9: 'ra',
+    10: 'mrt', 11: 'zebra', 12: 'bird', 13: 'dnrouted', 14: 'xorp', 15: 'ntk', 16: 'dhcp',
+    17: 'mrouted', 18: 'keepalived', 42: 'babel', 99: 'openr', 186: 'bgp', 187: 'isis',
+    188: 'ospf', 189: 'rip', 192: 'eigrp',
+    }
+
+
+class NetlinkError(OSError):
+    pass
+
+
+def _align(length: int) -> int:
+    return (length + 3) & ~3
+
+
+def _attr(rta_type: int, payload: bytes) -> bytes:
+    length = RTATTR.size + len(payload)
+    return RTATTR.pack(length, rta_type) + payload + b'\0' * (_align(length) - length)
+
+
+def _parse_attrs(data: memoryview, offset: int, end: int) -> dict:
+    attrs = {}
+    while offset + RTATTR.size <= end:
+        length, rta_type = RTATTR.unpack_from(data, offset)
+        if length < RTATTR.size:
+            break
+        # Strip the NLA_F_NESTED and NLA_F_NET_BYTEORDER flags
+        attrs[rta_type & 0x3fff] = data[offset + RTATTR.size:offset + length]
+        offset += _align(length)
+    return attrs
+
+
+def _table_oif(data: memoryview, offset: int, end: int) -> tuple:
+    '''
+    The RTA_TABLE and RTA_OIF of a route, without collecting its other
+    attributes, for the many routes that are only counted
+    '''
+    table = oif = None
+    while offset + RTATTR.size <= end and (table is None or oif is None):
+        length, rta_type = RTATTR.unpack_from(data, offset)
+        if length < RTATTR.size:
+            break
+        if rta_type & 0x3fff == RTA_TABLE:
+            table = struct.unpack_from('=I', data, offset + RTATTR.size)[0]
+        elif rta_type & 0x3fff == RTA_OIF:
+            oif = struct.unpack_from('=I', data, offset + RTATTR.size)[0]
+        offset += _align(length)
+    return table, oif
+
+
+def _string(value: memoryview) -> str:
+    return bytes(value).split(b'\0', 1)[0].decode('utf-8', 'replace')
+
+
+def _u32(value: memoryview) -> int:
+    return struct.unpack_from('=I', value)[0]
+
+
+def _address(value: memoryview) -> str:
+    raw = bytes(value)
+    if len(raw) == 4:
+        return socket.inet_ntop(socket.AF_INET, raw)
+    if len(raw) == 16:
+        return socket.inet_ntop(socket.AF_INET6, raw)
+    return ':'.join('{:02x}'.format(b) for b in raw)
+
+
+class Netlink:
+    '''A NETLINK_ROUTE socket, to send dump requests and collect the replies'''
+
+    def __init__(self):
+        self._sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+        self._sock.bind((0, 0))
+        self._seq = 0
+        self._buf = bytearray(RECV_BUFSIZE)
+        # Let the kernel filter dumps by the header fields and attributes of
+        # the request (Linux >= 4.20). Replies are filtered again regardless.
+        try:
+            self._sock.setsockopt(SOL_NETLINK, NETLINK_GET_STRICT_CHK, 1)
+            self.strict = True
+        except OSError:
+            self.strict = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._sock.close()
+
+    def request(self, msg_type: int, payload: bytes, flags: int = NLM_F_DUMP):
+        '''
+        Send a request and yield the (type, memoryview, payload offset, end)
+        of each message of the reply.
+        '''
+        self._seq += 1
+        seq = self._seq
+        self._sock.send(NLMSGHDR.pack(NLMSGHDR.size + len(payload), msg_type,
+                                      NLM_F_REQUEST | flags, seq, 0) + payload)
+        while True:
+            size = self._sock.recv_into(self._buf)
+            data = memoryview(self._buf)[:size]
+            offset = 0
+            while offset + NLMSGHDR.size <= size:
+                length, nl_type, _, nl_seq, _ = NLMSGHDR.unpack_from(data, offset)
+                if length < NLMSGHDR.size:
+                    raise NetlinkError('Malformed netlink message')
+                end = min(offset + length, size)
+                if nl_seq == seq:
+                    if nl_type == NLMSG_DONE:
+                        return
+                    if nl_type == NLMSG_ERROR:
+                        err = struct.unpack_from('=i', data, offset + NLMSGHDR.size)[0]
+                        if err == 0:  # ACK
+                            return
+                        raise NetlinkError(-err, os.strerror(-err))
+                    yield (nl_type, data, offset + NLMSGHDR.size, end)
+                    if not flags & NLM_F_DUMP:
+                        return
+                offset += _align(length)
+
+    def links(self, ifindex: int = None, ifname: str = None) -> list:
+        flags = NLM_F_DUMP
+        attrs = b''
+        if ifindex or ifname:
+            flags = 0  # query a single link
+        if ifname:
+            attrs = _attr(IFLA_IFNAME, ifname.encode('utf-8') + b'\0')
+        links = []
+        try:
+            for nl_type, data, offset, end in self.request(RTM_GETLINK, IFINFOMSG.pack(0, 0, ifindex or 0, 0, 0) + attrs,
+                                                           flags):
+                if nl_type != RTM_NEWLINK:
+                    continue
+                _, _, index, ifi_flags, _ = IFINFOMSG.unpack_from(data, offset)
+                attrs = _parse_attrs(data, offset + IFINFOMSG.size, end)
+                link = {
+                    'ifindex': index,
+                    'ifname': _string(attrs[IFLA_IFNAME]) if IFLA_IFNAME in attrs else None,
+                    'flags': [name for name, flag in IFF_FLAGS if ifi_flags & flag],
+                    }
+                if IFLA_MTU in attrs:
+                    link['mtu'] = _u32(attrs[IFLA_MTU])
+                if IFLA_OPERSTATE in attrs:
+                    state = attrs[IFLA_OPERSTATE][0]
+                    link['operstate'] = OPERSTATES[state] if state < len(OPERSTATES) else 'UNKNOWN'
+                if IFLA_ADDRESS in attrs:
+                    link['address'] = _address(attrs[IFLA_ADDRESS])
+                if IFLA_PERM_ADDRESS in attrs:
+                    permaddr = _address(attrs[IFLA_PERM_ADDRESS])
+                    if permaddr != link.get('address'):
+                        link['permaddr'] = permaddr
+                if IFLA_LINKINFO in attrs:
+                    linkinfo = attrs[IFLA_LINKINFO]
+                    info = _parse_attrs(linkinfo, 0, len(linkinfo))
+                    if IFLA_INFO_KIND in info:
+                        link['linkinfo'] = {'info_kind': _string(info[IFLA_INFO_KIND])}
+                link['addr_info'] = []
+                links.append(link)
+        except NetlinkError as e:
+            if (ifindex or ifname) and e.errno == errno.ENODEV:
+                return []
+            raise
+        return links
+
+    def addresses(self, ifindex: int = None) -> list:
+        addresses = []
+        for nl_type, data, offset, end in self.request(RTM_GETADDR, IFADDRMSG.pack(0, 0, 0, 0, ifindex or 0)):
+            if nl_type != RTM_NEWADDR:
+                continue
+            family, prefixlen, _, scope, index = IFADDRMSG.unpack_from(data, offset)
+            if ifindex and index != ifindex:
+                continue
+            attrs = _parse_attrs(data, offset + IFADDRMSG.size, end)
+            local = attrs.get(IFA_LOCAL, attrs.get(IFA_ADDRESS))
+            if family not in FAMILIES or local is None:
+                continue
+            addr = {
+                'family': FAMILIES[family],
+                'local': _address(local),
+                'prefixlen': prefixlen,
+                'scope': RT_SCOPES.get(scope, str(scope)),
+                }
+            if IFA_LABEL in attrs:
+                addr['label'] = _string(attrs[IFA_LABEL])
+            addresses.append((index, addr))
+        return addresses
+
+    def routes(self, family: int, table: int = None, oif: int = None, ifnames: dict = None,
+               hide_protocols: Iterable[int] = (), hidden: Counter = None) -> list:
+        '''
+        Dump the routes, skipping those of the hide_protocols, except for
+        default routes. They are only counted in hidden, by (dev, protocol).
+        '''
+        ifnames = ifnames or {}
+        hide_protocols = frozenset(hide_protocols)
+        attrs = b''
+        if table:
+            attrs += _attr(RTA_TABLE, struct.pack('=I', table))
+        if oif:
+            attrs += _attr(RTA_OIF, struct.pack('=I', oif))
+        # The rtm_table header field is limited to 8 bit, RTA_TABLE is authoritative
+        rtmsg = RTMSG.pack(family, 0, 0, 0, table if table and table < 256 else 0, 0, 0, 0, 0)
+        routes = []
+        try:
+            for nl_type, data, offset, end in self.request(RTM_GETROUTE, rtmsg + (attrs if self.strict else b'')):
+                if nl_type != RTM_NEWROUTE:
+                    continue
+                (rt_family, dst_len, _, _, rt_table, protocol,
+                 scope, rt_type, rt_flags) = RTMSG.unpack_from(data, offset)
+                if rt_family != family or rt_flags & RTM_F_CLONED:
+                    continue
+                # default routes are kept, as they make the system online
+                if protocol in hide_protocols and dst_len != 0:
+                    # There might be a full BGP table of them: skip early, or
+                    # only look up the attributes needed to count them
+                    if hidden is None:
+                        continue
+                    attr_table, route_oif = _table_oif(data, offset + RTMSG.size, end)
+                    if attr_table is not None:
+                        rt_table = attr_table
+                    if (table and rt_table != table) or (oif and route_oif != oif) or not route_oif:
+                        continue
+                    if route_oif not in ifnames:
+                        ifnames[route_oif] = _ifname(route_oif)
+                    hidden[(ifnames[route_oif], RT_PROTOCOLS.get(protocol, str(protocol)))] += 1
+                    continue
+                attrs = _parse_attrs(data, offset + RTMSG.size, end)
+                if RTA_TABLE in attrs:
+                    rt_table = _u32(attrs[RTA_TABLE])
+                route_oif = _u32(attrs[RTA_OIF]) if RTA_OIF in attrs else None
+                if (table and rt_table != table) or (oif and route_oif != oif):
+                    continue
+                if dst_len == 0:
+                    dst = 'default'
+                else:
+                    dst = _address(attrs[RTA_DST]) if RTA_DST in attrs else '0.0.0.0' if family == socket.AF_INET else '::'
+                    if dst_len != (32 if family == socket.AF_INET else 128):
+                        dst = '{}/{}'.format(dst, dst_len)
+                route = {
+                    'type': RT_TYPES[rt_type] if rt_type < len(RT_TYPES) else str(rt_type),
+                    'dst': dst,
+                    }
+                if RTA_GATEWAY in attrs:
+                    route['gateway'] = _address(attrs[RTA_GATEWAY])
+                if route_oif:
+                    route['dev'] = ifnames.get(route_oif) or _ifname(route_oif)
+                route['table'] = RT_TABLES.get(rt_table, str(rt_table))
+                route['protocol'] = RT_PROTOCOLS.get(protocol, str(protocol))
+                route['scope'] = RT_SCOPES.get(scope, str(scope))
+                if RTA_PREFSRC in attrs:
+                    route['prefsrc'] = _address(attrs[RTA_PREFSRC])
+                if RTA_PRIORITY in attrs:
+                    route['metric'] = _u32(attrs[RTA_PRIORITY])
+                route['flags'] = []
+                routes.append(route)
+        except NetlinkError as e:
+            # The output interface has gone away meanwhile
+            if oif and e.errno == errno.ENODEV:
+                return []
+            # The table has no routes of this family (with strict checking)
+            if table and e.errno == errno.ENOENT:
+                return []
+            raise
+        return routes
+
+
+class Monitor:
+    '''
+    A NETLINK_ROUTE socket, subscribed to the notifications about changed
+    links, addresses and routes.
+    '''
+
+    def __init__(self, groups: int = RTMGRP_ALL):
+        self._sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+        self._sock.bind((0, groups))
+        self._sock.setblocking(False)
+        self._buf = bytearray(RECV_BUFSIZE)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._sock.close()
+
+    def fileno(self) -> int:
+        return self._sock.fileno()
+
+    def read(self) -> set:
+        '''
+        Read all pending notifications and return the indexes of the
+        interfaces they affect. Returns None if notifications got lost, as
+        the receive buffer overflowed, so the whole state needs a refresh.
+        '''
+        ifindexes = set()
+        overrun = False
+        while True:
+            try:
+                size = self._sock.recv_into(self._buf)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                if e.errno != errno.ENOBUFS:
+                    raise
+                overrun = True
+                continue
+            ifindexes.update(_event_ifindexes(memoryview(self._buf)[:size]))
+        return None if overrun else ifindexes
+
+
+def _event_ifindexes(data: memoryview):
+    '''Yield the interface index of each notification in a datagram'''
+    offset = 0
+    size = len(data)
+    while offset + NLMSGHDR.size <= size:
+        length, nl_type, _, _, _ = NLMSGHDR.unpack_from(data, offset)
+        if length < NLMSGHDR.size:
+            break
+        start = offset + NLMSGHDR.size
+        end = min(offset + length, size)
+        if nl_type in (RTM_NEWLINK, RTM_DELLINK):
+            yield IFINFOMSG.unpack_from(data, start)[2]
+        elif nl_type in (RTM_NEWADDR, RTM_DELADDR):
+            yield IFADDRMSG.unpack_from(data, start)[4]
+        elif nl_type in (RTM_NEWROUTE, RTM_DELROUTE):
+            if not RTMSG.unpack_from(data, start)[8] & RTM_F_CLONED:
+                attrs = _parse_attrs(data, start + RTMSG.size, end)
+                # Routes without an output interface are not shown per interface
+                if RTA_OIF in attrs:
+                    yield _u32(attrs[RTA_OIF])
+        offset += _align(length)
+
+
+def _ifname(ifindex: int) -> str:
+    try:
+        return socket.if_indextoname(ifindex)
+    except OSError:
+        return str(ifindex)
+
+
+def dump_links(ifindex: int = None, ifname: str = None) -> list:
+    '''
+    Dump the links of the system, including their addresses, like
+    'ip -d -j addr [show dev <ifname>]', optionally limited to a single link,
+    given by its index or name. Raises OSError or NetlinkError.
+    '''
+    with Netlink() as nl:
+        links = nl.links(ifindex, ifname)
+        by_index = dict((link['ifindex'], link) for link in links)
+        if ifname and links:
+            ifindex = links[0]['ifindex']
+        if links:
+            for index, addr in nl.addresses(ifindex):
+                if index in by_index:
+                    by_index[index]['addr_info'].append(addr)
+    return links
+
+
+def dump_routes(family: int, table: int = None, oif: int = None,
+                hide_protocols: Iterable[int] = (), hidden: Counter = None) -> list:
+    '''
+    Dump the routes of the given address family, like
+    'ip -d -j -4|-6 route show table all', optionally limited to a single
+    routing table and output interface. The routes of the hide_protocols are
+    skipped, except for default routes, and only counted in hidden, if given.
+    Raises OSError or NetlinkError.
+    '''
+    with Netlink() as nl:
+        ifnames = dict((link['ifindex'], link['ifname']) for link in nl.links(oif))
+        return nl.routes(family, table, oif, ifnames, hide_protocols, hidden)
@@ -0,0 +1,189 @@
+#!/usr/bin/python3
+#
+# Copyright (C) 2023 Canonical, Ltd.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Timing of the individual phases of a netplan command'''
+
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import time
+
+JOURNAL_SOCKET = '/run/systemd/journal/socket'
+
+# The profiler currently recording phases, if any. It is used by the audit
+# hook to account spawned subprocesses to the running phase.
+_active_profiler = None
+_audit_hook_installed = False
+
+
+def _audit_hook(event, args):
+    if event == 'subprocess.Popen' and _active_profiler and _active_profiler.current:
+        _active_profiler.current.subprocesses += 1
+
+
+def _exit_status(exc):
+    '''Map an exception, ending a phase, to a process exit status.'''
+    if exc is None:
+        return 0
+    if isinstance(exc, SystemExit):
+        if exc.code is None:
+            return 0
+        return exc.code if isinstance(exc.code, int) else 1
+    if isinstance(exc, subprocess.CalledProcessError):
+        return exc.returncode
+    return 1
+
+
+def journal_send(fields: dict, path: str = JOURNAL_SOCKET):
+    '''
+    Send a structured entry to the systemd journal, using its native protocol.
+    Failures are ignored, e.g. if the journal is not running.
+    '''
+    lines = []
+    for key, value in fields.items():
+        # The simple KEY=VALUE serialization cannot carry newlines
+        lines.append('{}={}'.format(key, str(value).replace('\n', ' ')))
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.sendto(('\n'.join(lines) + '\n').encode('utf-8'), path)
+    except OSError as e:
+        logging.debug('Cannot log to the journal: {}'.format(e))
+
+
+class Phase:
+    def __init__(self, name: str):
+        self.name = name
+        self.start = time.monotonic()
+        self.duration = None
+        self.subprocesses = 0
+        self.exit_status = None
+        self.error = None
+
+    def finish(self, exc=None):
+        self.duration = time.monotonic() - self.start
+        self.exit_status = _exit_status(exc)
+        if self.exit_status:
+            self.error = str(exc) or type(exc).__name__
+
+    def to_dict(self) -> dict:
+        phase = {
+            'phase': self.name,
+            'duration': round(self.duration, 6),
+            'subprocesses': self.subprocesses,
+            'exit-status': self.exit_status,
+            }
+        if self.error:
+            phase['error'] = self.error
+        return phase
+
+
+class Profiler:
+    '''
+    Record the wall-clock duration, number of spawned subprocesses and exit
+    status of the consecutive phases of a command.
+
+    Used as a context manager, enclosing all phases. Each call of start()
+    finishes the running phase, if any, and starts the next one. A phase,
+    that is interrupted by an exception, is recorded with a non-zero exit
+    status.
+    '''
+
+    def __init__(self, command: str, output_format: str = None, journal: bool = None):
+        self.command = command
+        self.output_format = output_format
+        # Only log to the journal on request, by default
+        self.journal = bool(output_format) if journal is None else journal
+        self.phases = []
+        self.current = None
+        self._previous = None
+
+    def __enter__(self):
+        global _active_profiler, _audit_hook_installed
+        # Subprocesses are only counted, if the phases get reported. Audit
+        # hooks cannot be removed, it stays idle if no profiler is active.
+        if (self.output_format or self.journal) and not _audit_hook_installed:
+            sys.addaudithook(_audit_hook)
+            _audit_hook_installed = True
+        self._previous = _active_profiler
+        _active_profiler = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _active_profiler
+        self.stop(exc_value)
+        _active_profiler = self._previous
+        self.report()
+        return False
+
+    def start(self, name: str):
+        self.stop()
+        self.current = Phase(name)
+
+    def stop(self, exc=None):
+        if not self.current:
+            return
+        phase = self.current
+        self.current = None
+        phase.finish(exc)
+        self.phases.append(phase)
+        logging.debug('netplan {} phase {} took {:.3f}s ({} subprocesses, exit status {})'.format(
+            self.command, phase.name, phase.duration, phase.subprocesses, phase.exit_status))
+        if self.journal:
+            fields = {
+                'MESSAGE': 'netplan {} phase {}: {:.3f}s'.format(self.command, phase.name, phase.duration),
+                'PRIORITY': 6,  # LOG_INFO
+                'SYSLOG_IDENTIFIER': 'netplan',
+                'NETPLAN_COMMAND': self.command,
+                'NETPLAN_PHASE': phase.name,
+                'NETPLAN_DURATION_USEC': int(phase.duration * 1000000),
+                'NETPLAN_SUBPROCESSES': phase.subprocesses,
+                'NETPLAN_EXIT_STATUS': phase.exit_status,
+                }
+            if phase.error:
+                fields['NETPLAN_ERROR'] = phase.error
+            journal_send(fields)
+
+    def to_dict(self) -> dict:
+        return {
+            'command': self.command,
+            'duration': round(sum(p.duration for p in self.phases), 6),
+            'subprocesses': sum(p.subprocesses for p in self.phases),
+            'phases': [p.to_dict() for p in self.phases],
+            }
+
+    def summary(self) -> str:
+        width = max([len('phase')] + [len(p.name) for p in self.phases])
+        lines = ['{:<{w}}  {:>10}  {:>12}  {:>6}'.format('phase', 'duration', 'subprocesses', 'status', w=width)]
+        for p in self.phases:
+            lines.append('{:<{w}}  {:>9.3f}s  {:>12}  {:>6}'.format(
+                p.name, p.duration, p.subprocesses, p.exit_status, w=width))
+        total = self.to_dict()
+        lines.append('{:<{w}}  {:>9.3f}s  {:>12}'.format('total', total['duration'], total['subprocesses'], w=width))
+        return '\n'.join(lines)
+
+    def report(self, output=None):
+        '''Print the recorded phases in the requested output format, if any.'''
+        if not self.output_format:
+            return
+        output = output or sys.stdout
+        if self.output_format == 'json':
+            output.write(json.dumps(self.to_dict()) + os.linesep)
+        else:
+            output.write(self.summary() + os.linesep)
+        output.flush()
@@ -27,8 +27,6 @@ from . import utils
 from ..configmanager import ConfigurationError
 import netplan
 
-import netifaces
-
 
 # PCIDevice class originates from mlnx_switchdev_mode/sriovify.py
 # Copyright 2019 Canonical Ltd, Apache License, Version 2.0
@@ -195,18 +193,14 @@ def _get_target_interface(interfaces, np_state, pf_link, pfs):
                 # renamed - use the new name
                 pfs[pf_link] = set_name
             else:
-                for interface in interfaces:
-                    if not pf_dev._match_interface(
-                            iface_name=interface,
-                            iface_driver=utils.get_interface_driver_name(interface),
-                            iface_mac=utils.get_interface_macaddress(interface)):
-                        continue
-                    # we have a matching PF
-                    # store the matching interface in the dictionary of
-                    # active PFs, but error out if we matched more than one
-                    if pf_link in pfs:
-                        raise ConfigurationError('matched more than one interface for a PF device: %s' % pf_link)
-                    pfs[pf_link] = interface
+                matches = utils.find_matching_ifaces(interfaces, pf_dev)
+                # we have a matching PF
+                # store the matching interface in the dictionary of
+                # active PFs, but error out if we matched more than one
+                if len(matches) > 1:
+                    raise ConfigurationError('matched more than one interface for a PF device: %s' % pf_link)
+                if matches:
+                    pfs[pf_link] = matches[0]
         else:
             # no match field, assume entry name is the interface name
             if pf_link in interfaces:
@@ -239,6 +233,8 @@ def get_vf_count_and_functions(interfaces, np_state,
     PFs and VFs, matching the former with actual networking interfaces.
     Count how many VFs each PF will need.
     """
+    if not isinstance(interfaces, utils.InterfaceInventory):
+        interfaces = utils.InterfaceInventory(interfaces)
     for nid, netdef in np_state.ethernets.items():
         if netdef.links.get('sriov') and _get_target_interface(interfaces, np_state, netdef.links.get('sriov').id, pfs):
             vfs[nid] = None
@@ -370,19 +366,14 @@ def apply_vlan_filter_for_vf(pf, vf, vlan_name, vlan_id, prefix='/'):
             'failed setting SR-IOV VLAN filter for vlan %s (ip link set command failed)' % vlan_name)
 
 
-def apply_sriov_config(config_manager, rootdir='/'):
+def apply_sriov_config(config_manager, inventory: utils.InterfaceInventory = None):
     """
     Go through all interfaces, identify which ones are SR-IOV VFs, create
     them and perform all other necessary setup.
+    The given interface inventory is refreshed, if VFs got created.
     """
-    parser = netplan.Parser()
-    parser.load_yaml_hierarchy(rootdir)
-
-    np_state = netplan.State()
-    np_state.import_parser_results(parser)
-
     config_manager.parse()
-    interfaces = netifaces.interfaces()
+    interfaces = inventory if inventory is not None else utils.InterfaceInventory()
     np_state = config_manager.np_state
 
     # for sr-iov devices, we identify VFs by them having a link: field
@@ -417,25 +408,25 @@ def apply_sriov_config(config_manager, rootdir='/'):
 
         # also, since the VF number changed, the interfaces list also
         # changed, so we need to refresh it
-        interfaces = netifaces.interfaces()
+        interfaces.refresh()
 
     # now in theory we should have all the new VFs set up and existing;
     # this is needed because we will have to now match the defined VF
     # entries to existing interfaces, otherwise we won't be able to set
     # filtered VLANs for those.
     # XXX: does matching those even make sense?
+    # right now we only match by name, as I don't think matching per
+    # driver and/or macaddress makes sense
+    # TODO: print warning if other matches are provided
+    vf_matches = np_state.match_interfaces((interface, None, None) for interface in interfaces) if vfs else {}
     for vf in vfs:
         netdef = np_state[vf]
         if netdef._has_match:
-            # right now we only match by name, as I don't think matching per
-            # driver and/or macaddress makes sense
-            # TODO: print warning if other matches are provided
-
-            for interface in interfaces:
-                if netdef._match_interface(iface_name=interface):
-                    if vf in vfs and vfs[vf]:
-                        raise ConfigurationError('matched more than one interface for a VF device: %s' % vf)
-                    vfs[vf] = interface
+            matches = vf_matches.get(vf, [])
+            if len(matches) > 1:
+                raise ConfigurationError('matched more than one interface for a VF device: %s' % vf)
+            if matches:
+                vfs[vf] = matches[0]
         else:
             if vf in interfaces:
                 vfs[vf] = vf
@@ -17,6 +17,9 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import concurrent.futures
+import contextlib
+import functools
 import ipaddress
 import json
 import logging
@@ -24,18 +27,29 @@ import re
 import socket
 import subprocess
 import sys
-from io import StringIO
-from typing import Dict, List, Type, Union
+import threading
+from collections import Counter, defaultdict
+from typing import IO, Callable, Dict, Iterable, Iterator, List, Type, Union
 
 import yaml
 
 import dbus
 import netplan
 
-from . import utils
+from . import netlink, utils
 
 JSON = Union[Dict[str, 'JSON'], List['JSON'], int, str, float, bool, Type[None]]
 
+# Time (in seconds) to wait for each source of system state. Optional sources
+# get less time, as the status is shown without them, if they are slow.
+REQUIRED_QUERY_TIMEOUT = 10
+OPTIONAL_QUERY_TIMEOUT = 5
+
+# The routes of these protocols are only counted, not shown, unless asked for
+# verbose output, as full-table BGP routers carry a million of them.
+HIDDEN_ROUTE_PROTOCOLS = ['bgp', 'zebra']
+MAIN_ROUTE_TABLE = 254
+
 DEVICE_TYPES = {
     'bond': 'bond',
     'bridge': 'bridge',
@@ -66,7 +80,36 @@ DEVICE_TYPES = {
     }
 
 
+# Marks a cached Interface property, that was not computed yet
+_UNSET = object()
+
+
+def cached_property(func):
+    '''
+    Like functools.cached_property, but storing the value in the '_<name>'
+    slot, as Interface has no __dict__.
+    '''
+    slot = '_' + func.__name__
+
+    @functools.wraps(func)
+    def getter(self):
+        value = getattr(self, slot)
+        if value is _UNSET:
+            value = func(self)
+            setattr(self, slot, value)
+        return value
+    return property(getter)
+
+
 class Interface():
+    # Status is collected for thousands of (container) interfaces on some
+    # hosts, keep the records compact. The derived properties are computed
+    # once, on first use, and cached in the '_<name>' slots.
+    __slots__ = ['idx', 'name', 'adminstate', 'operstate', 'macaddress', 'nd', 'nm',
+                 'dns_addresses', 'dns_search', 'routes', 'hidden_routes', 'addresses',
+                 'iproute_type', '_networkctl_status',
+                 '_type', '_tunnel_mode', '_backend', '_netdef_id', '_vendor', '_ssid', '_activation_mode']
+
     def __extract_mac(self, ip: dict) -> str:
         '''
         Extract the MAC address if it's set inside the JSON data and seems to
@@ -77,7 +120,8 @@ class Interface():
         return None
 
     def __init__(self, ip: dict, nd_data: JSON = [], nm_data: JSON = [],
-                 resolved_data: tuple = (None, None), route_data: tuple = (None, None)):
+                 resolved_data: tuple = (None, None), route_data: tuple = (None, None),
+                 hidden_routes: Dict[str, int] = None):
         self.idx: int = ip.get('ifindex', -1)
         self.name: str = ip.get('ifname', 'unknown')
         self.adminstate: str = 'UP' if 'UP' in ip.get('flags', []) else 'DOWN'
@@ -134,6 +178,8 @@ class Interface():
                     if val := obj.get('table'):
                         elem['table'] = val
                     self.routes.append(elem)
+        # number of routes not shown, by protocol
+        self.hidden_routes: Dict[str, int] = hidden_routes or None
 
         self.addresses: list = None
         if addr_info := ip.get('addr_info'):
@@ -159,8 +205,13 @@ class Interface():
         if info_kind := ip.get('linkinfo', {}).get('info_kind'):
             self.iproute_type = info_kind.strip()
 
-        # workaround: query some data which is not available via networkctl's JSON output
-        self._networkctl: str = self.query_networkctl(self.name) or ''
+        # workaround: some data is not available via networkctl's JSON output
+        # before systemd v250. It is queried lazily, unless SystemConfigState
+        # filled it in already, using a single 'networkctl status' call.
+        self._networkctl_status: str = None
+
+        self._type = self._tunnel_mode = self._backend = self._netdef_id = _UNSET
+        self._vendor = self._ssid = self._activation_mode = _UNSET
 
     def query_nm_ssid(self, con_name: str) -> str:
         ssid: str = None
@@ -173,15 +224,33 @@ class Interface():
                             con_name, str(e)))
         return ssid
 
-    def query_networkctl(self, ifname: str) -> str:
+    def query_networkctl(self, ifname: str, timeout: float = OPTIONAL_QUERY_TIMEOUT) -> str:
         output: str = None
         try:
-            output = subprocess.check_output(['networkctl', 'status', '--', ifname], text=True)
+            output = subprocess.check_output(['networkctl', 'status', '--', ifname], text=True, timeout=timeout)
         except Exception as e:
             logging.warning('Cannot query networkctl for {}: {}'.format(
                 ifname, str(e)))
         return output
 
+    @property
+    def _networkctl(self) -> str:
+        if self._networkctl_status is None:
+            self._networkctl_status = self.query_networkctl(self.name) or ''
+        return self._networkctl_status
+
+    @property
+    def needs_networkctl_status(self) -> bool:
+        '''
+        Whether the SSID or activation mode of this interface can only be
+        found in the output of 'networkctl status'.
+        '''
+        if not self.nd:
+            return False
+        if DEVICE_TYPES.get(self.nd.get('Type')) == 'wifi' and 'SSID' not in self.nd:
+            return True
+        return self.backend == 'networkd' and 'ActivationPolicy' not in self.nd
+
     def json(self) -> JSON:
         json = {
             'index': self.idx,
@@ -210,6 +279,8 @@ class Interface():
             json['dns_search'] = self.dns_search
         if self.routes:
             json['routes'] = self.routes
+        if self.hidden_routes:
+            json['hidden_routes'] = self.hidden_routes
         if self.activation_mode:
             json['activation_mode'] = self.activation_mode
         return (self.name, json)
@@ -222,7 +293,7 @@ class Interface():
     def down(self) -> bool:
         return self.adminstate == 'DOWN' and self.operstate == 'DOWN'
 
-    @property
+    @cached_property
     def type(self) -> str:
         nd_type = self.nd.get('Type') if self.nd else None
         if device_type := DEVICE_TYPES.get(nd_type):
@@ -230,13 +301,13 @@ class Interface():
         logging.warning('Unknown device type: {}'.format(nd_type))
         return None
 
-    @property
+    @cached_property
     def tunnel_mode(self) -> str:
         if self.type == 'tunnel' and self.iproute_type:
             return self.iproute_type
         return None
 
-    @property
+    @cached_property
     def backend(self) -> str:
         if (self.nd and
                 'unmanaged' not in self.nd.get('SetupState', '') and
@@ -246,7 +317,7 @@ class Interface():
             return 'NetworkManager'
         return None
 
-    @property
+    @cached_property
     def netdef_id(self) -> str:
         if self.backend == 'networkd':
             return self.nd.get('NetworkFile', '').split(
@@ -255,23 +326,26 @@ class Interface():
             netdef = self.nm.get('filename', '').split(
                 'run/NetworkManager/system-connections/netplan-')[1].split('.nmconnection')[0]
             if self.nm.get('type', '') == '802-11-wireless':
-                ssid = self.query_nm_ssid(self.nm.get('name'))
+                # usually queried along with the connections already
+                ssid = self.nm['ssid'] if 'ssid' in self.nm else self.query_nm_ssid(self.nm.get('name'))
                 if ssid:  # XXX: escaping needed?
                     netdef = netdef.split('-' + ssid)[0]
             return netdef
         return None
 
-    @property
+    @cached_property
     def vendor(self) -> str:
         if self.nd and 'Vendor' in self.nd and self.nd['Vendor']:
             return self.nd['Vendor'].strip()
         return None
 
-    @property
+    @cached_property
     def ssid(self) -> str:
         if self.type == 'wifi':
-            # XXX: available from networkctl's JSON output as of v250:
-            #      https://github.com/systemd/systemd/commit/da7c995
+            # available from networkctl's JSON output as of v250:
+            # https://github.com/systemd/systemd/commit/da7c995
+            if 'SSID' in self.nd:
+                return self.nd['SSID'] or None
             for line in self._networkctl.splitlines():
                 line = line.strip()
                 key = 'WiFi access point: '
@@ -280,11 +354,14 @@ class Interface():
                     return ssid if ssid else None
         return None
 
-    @property
+    @cached_property
     def activation_mode(self) -> str:
         if self.backend == 'networkd':
-            # XXX: available from networkctl's JSON output as of v250:
-            #      https://github.com/systemd/systemd/commit/3b60ede
+            # available from networkctl's JSON output as of v250:
+            # https://github.com/systemd/systemd/commit/3b60ede
+            if 'ActivationPolicy' in self.nd:
+                mode = self.nd['ActivationPolicy']
+                return mode if mode != 'up' else None
             for line in self._networkctl.splitlines():
                 line = line.strip()
                 key = 'Activation Policy: '
@@ -300,7 +377,7 @@ class Interface():
 class SystemConfigState():
     ''' Collects the system's network configuration '''
 
-    def __init__(self, ifname=None, all=False):
+    def __init__(self, ifname=None, all=False, verbose=False):
         # Make sure sd-networkd is running, as we need the data it provides.
         if not utils.systemctl_is_active('systemd-networkd.service'):
             if utils.systemctl_is_masked('systemd-networkd.service'):
@@ -311,47 +388,186 @@ class SystemConfigState():
             logging.debug('systemd-networkd.service is not active. Starting...')
             utils.systemctl('start', ['systemd-networkd.service'], True)
 
-        # required data: iproute2 and sd-networkd can be expected to exist,
-        # due to hard package dependencies
-        iproute2 = self.query_iproute2()
-        networkd = self.query_networkd()
+        # Query only the main and netplan's routing tables, skipping the routes
+        # of routing daemons, unless asked for verbose output
+        self.route_tables = None
+        self.hide_protocols = []
+        if not verbose:
+            self.route_tables = sorted(self.query_netplan_route_tables() | {MAIN_ROUTE_TABLE})
+            self.hide_protocols = HIDDEN_ROUTE_PROTOCOLS
+        hidden_routes = Counter()
+
+        self.ifname = ifname
+        self.all = all
+        # A single interface is queried on its own, instead of filtering the
+        # data of all of them. The online state cannot be told from it.
+        self.single = bool(ifname) and not all
+        ifindex = None
+        if self.single:
+            iproute2 = self.query_links(ifname)
+            if iproute2 == []:
+                logging.error('Could not find interface {}'.format(ifname))
+                sys.exit(1)
+            ifindex = iproute2[0].get('ifindex') if iproute2 else None
+
+        # Query all sources concurrently, each of them is bound by its own timeout
+        with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
+            # required data: iproute2 and sd-networkd can be expected to exist,
+            # due to hard package dependencies
+            if not self.single:
+                iproute2_future = executor.submit(self.query_links)
+            networkd_future = executor.submit(self.query_networkd, ifindex=ifindex)
+            # optional data
+            nmcli_future = executor.submit(self.query_nm, device=ifname if self.single else None)
+            routes_future = executor.submit(self.query_route_tables, tables=self.route_tables,
+                                            hide_protocols=self.hide_protocols, hidden=hidden_routes,
+                                            oif=ifindex, dev=ifname if self.single else None)
+            resolved_future = executor.submit(self.query_resolved)
+
+        if not self.single:
+            iproute2 = iproute2_future.result()
+        networkd = networkd_future.result()
         if not iproute2 or not networkd:
             logging.error('Could not query iproute2 or systemd-networkd')
             sys.exit(1)
 
-        # optional data
-        nmcli = self.query_nm()
-        route4, route6 = self.query_routes()
-        dns_addresses, dns_search = self.query_resolved()
+        nmcli = nmcli_future.result()
+        route4, route6 = routes_future.result()
+        dns_addresses, dns_search = resolved_future.result()
 
-        self.interface_list = [Interface(itf, networkd, nmcli, (dns_addresses, dns_search),
-                                         (route4, route6)) for itf in iproute2]
-
-        # show only active interfaces by default
-        filtered = [itf for itf in self.interface_list if itf.operstate != 'DOWN']
-        # down interfaces do not contribute anything to the online state
-        online_state = self.query_online_state(filtered)
+        self.interface_list = self.build_interfaces(iproute2, networkd, nmcli, (dns_addresses, dns_search),
+                                                    (route4, route6), hidden_routes)
         # show only a single interface, if requested
         # XXX: bash completion (for interfaces names)
-        if ifname:
-            filtered = [next((itf for itf in self.interface_list if itf.name == ifname), None)]
-        filtered = [elem for elem in filtered if elem is not None]
-        if ifname and filtered == []:
+        if ifname and not any(itf.name == ifname for itf in self.interface_list):
             logging.error('Could not find interface {}'.format(ifname))
             sys.exit(1)
+        # built on first use, as not every output needs all of it
+        self.state: dict = None
 
+    @classmethod
+    def build_interfaces(cls, iproute2: JSON, networkd: JSON, nmcli: JSON, resolved_data: tuple,
+                         route_data: tuple, hidden_routes: Counter = None) -> List[Interface]:
+        # Index the data by interface once, so that each Interface only needs
+        # to look at its own slice, instead of scanning all of it.
+        nd_by_idx = cls.index_by(networkd, lambda x: x['Index'])
+        nm_by_dev = cls.index_by(nmcli, lambda x: x['device'])
+        dns_by_idx = cls.index_by(resolved_data[0], lambda x: int(x[0]))
+        search_by_idx = cls.index_by(resolved_data[1], lambda x: int(x[0]))
+        route4_by_dev = cls.index_by(route_data[0], lambda x: x.get('dev'))
+        route6_by_dev = cls.index_by(route_data[1], lambda x: x.get('dev'))
+        hidden_by_dev = defaultdict(dict)
+        for (dev, protocol), count in (hidden_routes or {}).items():
+            hidden_by_dev[dev][protocol] = count
+
+        interfaces = []
+        for itf in iproute2:
+            idx = itf.get('ifindex', -1)
+            name = itf.get('ifname', 'unknown')
+            interfaces.append(Interface(
+                itf, nd_by_idx.get(idx, []), nm_by_dev.get(name, []),
+                (dns_by_idx.get(idx), search_by_idx.get(idx)),
+                (route4_by_dev.get(name), route6_by_dev.get(name)), hidden_by_dev.get(name)))
+        return interfaces
+
+    @property
+    def online(self) -> bool:
+        '''The online state of the system, unknown (None) when querying a single interface'''
+        if self.single:
+            return None
+        # down interfaces do not contribute anything to the online state
+        return self.query_online_state([itf for itf in self.interface_list if itf.operstate != 'DOWN'])
+
+    @property
+    def shown_interfaces(self) -> List[Interface]:
+        if self.all:
+            return self.interface_list
+        if self.ifname:
+            return [itf for itf in self.interface_list if itf.name == self.ifname]
+        # show only active interfaces by default
+        return [itf for itf in self.interface_list if itf.operstate != 'DOWN']
+
+    def build_state(self) -> dict:
         # Global state
-        self.state = {
-            'netplan-global-state': {
-                'online': online_state,
-                'nameservers': self.resolvconf_json()
-            }
-        }
+        global_state = {}
+        if not self.single:
+            global_state['online'] = self.online
+        global_state['nameservers'] = self.resolvconf_json()
+        state = {'netplan-global-state': global_state}
+
         # Per interface
-        itf_iter = self.interface_list if all else filtered
+        itf_iter = self.shown_interfaces
+        # Scrape 'networkctl status' only for the interfaces that need it, at once
+        networkctl_itfs = [itf for itf in itf_iter
+                           if itf._networkctl_status is None and itf.needs_networkctl_status]
+        networkctl_status = self.query_networkctl_status([itf.name for itf in networkctl_itfs])
+        if networkctl_status is not None:
+            for itf in networkctl_itfs:
+                itf._networkctl_status = networkctl_status.get(itf.name, '')
         for itf in itf_iter:
             ifname, obj = itf.json()
-            self.state[ifname] = obj
+            state[ifname] = obj
+        return state
+
+    def update(self, ifindexes: Iterable[int] = None) -> dict:
+        '''
+        Query the state of the given interfaces again, e.g. after being
+        notified about changes to them, and refresh the global state.
+        All interfaces are queried again, if ifindexes is None.
+        Returns the changed parts of get_data(), removed interfaces map to None.
+        Nothing is returned, if get_data() was not used so far.
+        '''
+        hidden_routes = Counter()
+        route_filter = dict(tables=self.route_tables, hide_protocols=self.hide_protocols, hidden=hidden_routes)
+        ifindex = None
+        if self.single and ifindexes is not None:
+            # only the requested interface is of interest, it might get (re-)created, though
+            known = set(itf.idx for itf in self.interface_list)
+            ifindexes = None if not known or known & set(ifindexes) else set()
+        if ifindexes is None and self.single:
+            links = self.query_links(self.ifname)
+            route_data = ([], [])
+            if links:
+                ifindex = links[0].get('ifindex')
+                route_data = self.query_route_tables(**route_filter, oif=ifindex, dev=self.ifname)
+        elif ifindexes is None:
+            links = self.query_links()
+            route_data = self.query_route_tables(**route_filter)
+        else:
+            ifindexes = set(ifindexes)
+            links = []
+            route4, route6 = [], []
+            for idx in ifindexes:
+                data = self.query_netlink_links(idx)
+                routes = self.query_netlink_routes(idx, **route_filter)
+                if data is None or routes is None:
+                    links = [itf for itf in self.query_iproute2() or [] if itf.get('ifindex') in ifindexes]
+                    hidden_routes.clear()
+                    route4, route6 = self.query_routes(**route_filter)
+                    break
+                links += data
+                route4 += routes[0]
+                route6 += routes[1]
+            route_data = (route4, route6)
+
+        if (ifindexes is None and links is not None) or ifindexes:
+            # the other sources are cheap to query as a whole, compared to
+            # running a command per interface
+            interfaces = self.build_interfaces(links or [], self.query_networkd(ifindex=ifindex) or [],
+                                               self.query_nm(device=self.ifname if self.single else None),
+                                               self.query_resolved(), route_data, hidden_routes)
+            if ifindexes is not None:
+                interfaces += [itf for itf in self.interface_list if itf.idx not in ifindexes]
+                interfaces.sort(key=lambda itf: itf.idx)
+            self.interface_list = interfaces
+
+        old_state = self.state
+        if old_state is None:
+            return {}
+        self.state = self.build_state()
+        changes = dict((key, value) for key, value in self.state.items() if old_state.get(key) != value)
+        changes.update((key, None) for key in old_state if key not in self.state)
+        return changes
 
     @classmethod
     def resolvconf_json(cls) -> dict:
@@ -393,36 +609,120 @@ class SystemConfigState():
                     return True
         return False
 
+    @classmethod
+    def index_by(cls, data: JSON, key: Callable) -> Dict:
+        '''Group the elements of a list by the given key, keeping their order'''
+        index = defaultdict(list)
+        for elem in data or []:
+            index[key(elem)].append(elem)
+        return index
+
     @classmethod
     def process_generic(cls, cmd_output: str) -> JSON:
         return json.loads(cmd_output)
 
     @classmethod
-    def query_iproute2(cls) -> JSON:
+    def query_iproute2(cls, timeout: float = REQUIRED_QUERY_TIMEOUT, dev: str = None) -> JSON:
         data: JSON = None
         try:
-            output: str = subprocess.check_output(['ip', '-d', '-j', 'addr'],
-                                                  text=True)
+            output: str = subprocess.check_output(['ip', '-d', '-j', 'addr'] + (['show', 'dev', dev] if dev else []),
+                                                  text=True, timeout=timeout)
             data = cls.process_generic(output)
         except Exception as e:
             logging.critical('Cannot query iproute2 interface data: {}'.format(str(e)))
         return data
 
+    @classmethod
+    def query_netlink_links(cls, ifindex: int = None, ifname: str = None) -> JSON:
+        data: JSON = None
+        try:
+            data = netlink.dump_links(ifindex, ifname)
+        except Exception as e:
+            logging.debug('Cannot query netlink interface data: {}'.format(str(e)))
+        return data
+
+    @classmethod
+    def query_links(cls, ifname: str = None) -> JSON:
+        '''
+        Query the links and addresses via netlink, falling back to iproute2,
+        optionally of a single interface only.
+        '''
+        data = cls.query_netlink_links(ifname=ifname)
+        if data is None:
+            data = cls.query_iproute2(dev=ifname)
+            if data is None and ifname:
+                data = []  # iproute2 fails for unknown interfaces
+        return data
+
     @classmethod
     def process_networkd(cls, cmd_output) -> JSON:
         return json.loads(cmd_output)['Interfaces']
 
     @classmethod
-    def query_networkd(cls) -> JSON:
+    def query_networkd(cls, timeout: float = REQUIRED_QUERY_TIMEOUT, ifindex: int = None) -> JSON:
+        if ifindex:
+            data = cls.query_networkd_link(ifindex, timeout)
+            if data is not None:
+                return data
         data: JSON = None
         try:
             output: str = subprocess.check_output(['networkctl', '--json=short'],
-                                                  text=True)
+                                                  text=True, timeout=timeout)
             data = cls.process_networkd(output)
         except Exception as e:
             logging.critical('Cannot query networkd interface data: {}'.format(str(e)))
         return data
 
+    @classmethod
+    def query_networkd_link(cls, ifindex: int, timeout: float = REQUIRED_QUERY_TIMEOUT) -> JSON:
+        '''Query the networkd data of a single interface, in the shape of process_networkd()'''
+        data: JSON = None
+        try:
+            # A private connection, as the shared one must not be used by
+            # multiple threads concurrently
+            with contextlib.closing(dbus.SystemBus(private=True)) as ipc:
+                # sd-bus escapes the leading digit of the object path's last element
+                path = '/org/freedesktop/network1/link/_3' + str(ifindex)
+                link = ipc.get_object('org.freedesktop.network1', path)
+                output = link.Describe(dbus_interface='org.freedesktop.network1.Link', timeout=timeout)
+            data = [json.loads(str(output))]
+        except Exception as e:
+            logging.debug('Cannot query networkd data of interface {}: {}'.format(ifindex, str(e)))
+        return data
+
+    @classmethod
+    def process_networkctl_status(cls, cmd_output: str) -> Dict[str, str]:
+        '''
+        Split the output of 'networkctl status' for multiple interfaces
+        into a dict, mapping the interface names to their section.
+        '''
+        data: Dict[str, List[str]] = {}
+        lines: List[str] = None
+        for line in cmd_output.splitlines():
+            # Each section starts with an unindented '● <ifindex>: <ifname>' header
+            if header := re.match(r'^(?:\S+\s+)?\d+: (\S+)\s*$', line):
+                lines = data.setdefault(header.group(1), [])
+            if lines is not None:
+                lines.append(line)
+        return dict((name, '\n'.join(lines)) for name, lines in data.items())
+
+    @classmethod
+    def query_networkctl_status(cls, ifnames: List[str], timeout: float = OPTIONAL_QUERY_TIMEOUT) -> Dict[str, str]:
+        if not ifnames:
+            return {}
+        try:
+            output: str = subprocess.check_output(['networkctl', 'status', '--'] + ifnames,
+                                                  text=True, timeout=timeout)
+        except subprocess.TimeoutExpired as e:
+            # networkd is stuck, do not wait for it once per interface again
+            logging.debug('Cannot query networkctl for {}: {}'.format(' '.join(ifnames), str(e)))
+            return {}
+        except Exception as e:
+            # Interfaces fall back to querying their own status
+            logging.debug('Cannot query networkctl for {}: {}'.format(' '.join(ifnames), str(e)))
+            return None
+        return cls.process_networkctl_status(output)
+
     @classmethod
     def process_nm(cls, cmd_output) -> JSON:
         data: JSON = []
@@ -441,31 +741,144 @@ class SystemConfigState():
         return data
 
     @classmethod
-    def query_nm(cls) -> JSON:
+    def query_nm(cls, timeout: float = OPTIONAL_QUERY_TIMEOUT, device: str = None) -> JSON:
         data: JSON = None
         try:
+            # Only active connections have a device, the others are ignored anyway
             output: str = utils.nmcli_out(['-t', '-f',
                                            'DEVICE,NAME,UUID,FILENAME,TYPE,AUTOCONNECT',
-                                           'con', 'show'])
+                                           'con', 'show'] + (['--active'] if device else []), timeout=timeout)
             data = cls.process_nm(output)
+            if device:
+                data = [con for con in data if con['device'] == device]
         except Exception as e:
             logging.debug('Cannot query NetworkManager interface data: {}'.format(str(e)))
+            return data
+        # 'con show' cannot list the SSIDs, query those of all wifi connections at once
+        wifi = [con for con in data if con['type'] == '802-11-wireless']
+        if wifi:
+            ssids = cls.query_nm_ssids([con['uuid'] for con in wifi], timeout=timeout)
+            for con in wifi:
+                if con['uuid'] in ssids:
+                    con['ssid'] = ssids[con['uuid']]
         return data
 
     @classmethod
-    def query_routes(cls) -> tuple:
+    def process_nm_ssids(cls, cmd_output: str) -> Dict[str, str]:
+        ssids = {}
+        uuid = None
+        for line in cmd_output.splitlines():
+            key, _, value = line.partition(':')
+            # terse output escapes colons and backslashes in the values
+            value = re.sub(r'\\(.)', r'\1', value).strip()
+            if key == 'connection.uuid':
+                uuid = value
+            elif key == '802-11-wireless.ssid' and uuid:
+                ssids[uuid] = value
+        return ssids
+
+    @classmethod
+    def query_nm_ssids(cls, uuids: List[str], timeout: float = OPTIONAL_QUERY_TIMEOUT) -> Dict[str, str]:
+        '''Query the SSIDs of the given NetworkManager connections, using a single nmcli call'''
+        args = []
+        for uuid in uuids:
+            args += ['uuid', uuid]
+        try:
+            output = utils.nmcli_out(['-t', '-f', 'connection.uuid,802-11-wireless.ssid', 'con', 'show'] + args,
+                                     timeout=timeout)
+        except Exception as e:
+            logging.debug('Cannot query NetworkManager SSIDs: {}'.format(str(e)))
+            return {}
+        return cls.process_nm_ssids(output)
+
+    @classmethod
+    def process_generic_stream(cls, stream: IO[str], chunk_size: int = 1 << 16) -> Iterator[JSON]:
+        '''
+        Yield the elements of a JSON array one by one, while reading it from
+        the stream, instead of loading all of it at once.
+        '''
+        decoder = json.JSONDecoder()
+        buf = ''
+        pos = 0
+        eof = False
+        while True:
+            # skip the array syntax around the elements
+            while pos < len(buf) and buf[pos] in '[], \t\r\n':
+                pos += 1
+            try:
+                if pos < len(buf):
+                    elem, pos = decoder.raw_decode(buf, pos)
+                    yield elem
+                    continue
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            if eof:
+                return
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buf = buf[pos:] + chunk
+            pos = 0
+
+    @classmethod
+    def filter_routes(cls, routes: Iterable[JSON], hide_protocols: Iterable[str] = (),
+                      hidden: Counter = None) -> Iterator[JSON]:
+        '''
+        Skip the routes of hide_protocols, except for default routes, counting
+        them in hidden, by (dev, protocol), if given.
+        '''
+        for route in routes:
+            protocol = route.get('protocol')
+            if protocol in hide_protocols and route.get('dst') != 'default':
+                if hidden is not None and route.get('dev'):
+                    hidden[(route['dev'], protocol)] += 1
+                continue
+            yield route
+
+    @classmethod
+    def query_routes(cls, timeout: float = REQUIRED_QUERY_TIMEOUT, tables: List[int] = None,
+                     hide_protocols: Iterable[str] = (), hidden: Counter = None, dev: str = None) -> tuple:
         data4 = None
         data6 = None
         try:
-            output4: str = subprocess.check_output(['ip', '-d', '-j', '-4', 'route', 'show', 'table', 'all'],
-                                                   text=True)
-            data4: JSON = cls.process_generic(output4)
-            output6: str = subprocess.check_output(['ip', '-d', '-j', '-6', 'route', 'show', 'table', 'all'],
-                                                   text=True)
-            data6: JSON = cls.process_generic(output6)
+            data4: JSON = []
+            data6: JSON = []
+            for table in tables or ['all']:
+                for family, data in (('-4', data4), ('-6', data6)):
+                    with subprocess.Popen(['ip', '-d', '-j', family, 'route', 'show', 'table', str(table)] +
+                                          (['dev', dev] if dev else []),
+                                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True) as proc:
+                        # bound the whole (streamed) query, not only the wait for the exit status
+                        timer = threading.Timer(timeout, proc.kill)
+                        timer.start()
+                        try:
+                            for route in cls.filter_routes(cls.process_generic_stream(proc.stdout),
+                                                           hide_protocols, hidden):
+                                # iproute2 omits the table and device, when showing a single one
+                                if table != 'all':
+                                    route.setdefault('table', netlink.RT_TABLES.get(table, str(table)))
+                                if dev:
+                                    route.setdefault('dev', dev)
+                                data.append(route)
+                        finally:
+                            timer.cancel()
+                        if proc.wait() != 0:
+                            stderr = proc.stderr.read()
+                            # The table has no routes of this family
+                            if table != 'all' and 'FIB table does not exist' in stderr:
+                                continue
+                            raise subprocess.CalledProcessError(proc.returncode, proc.args, stderr=stderr)
         except Exception as e:
             logging.debug('Cannot query iproute2 route data: {}'.format(str(e)))
+            data4 = None
+            data6 = None
+            if hidden is not None:
+                hidden.clear()
+
+        return cls.add_route_family(data4, data6)
 
+    @classmethod
+    def add_route_family(cls, data4: JSON, data6: JSON) -> tuple:
         # Add the address family to the data
         # IPv4: 2, IPv6: 10
         if data4:
@@ -477,14 +890,81 @@ class SystemConfigState():
         return (data4, data6)
 
     @classmethod
-    def query_resolved(cls) -> tuple:
+    def query_netlink_routes(cls, oif: int = None, tables: List[int] = None,
+                             hide_protocols: Iterable[str] = (), hidden: Counter = None) -> tuple:
+        protocols = [num for num, name in netlink.RT_PROTOCOLS.items() if name in hide_protocols]
+        data4: JSON = []
+        data6: JSON = []
+        try:
+            # A single socket and link dump, to name the output interfaces of all tables
+            with netlink.Netlink() as nl:
+                ifnames = dict((link['ifindex'], link['ifname']) for link in nl.links(oif))
+                for table in tables or [None]:
+                    data4 += nl.routes(socket.AF_INET, table, oif, ifnames, protocols, hidden)
+                    data6 += nl.routes(socket.AF_INET6, table, oif, ifnames, protocols, hidden)
+        except Exception as e:
+            logging.debug('Cannot query netlink route data: {}'.format(str(e)))
+            if hidden is not None:
+                hidden.clear()
+            return None
+        return cls.add_route_family(data4, data6)
+
+    @classmethod
+    def query_route_tables(cls, tables: List[int] = None, hide_protocols: Iterable[str] = (),
+                           hidden: Counter = None, oif: int = None, dev: str = None) -> tuple:
+        '''
+        Query the routes of the given routing tables (default: all of them)
+        via netlink, falling back to iproute2, optionally of a single output
+        interface, given by its index and name. The routes of hide_protocols
+        are only counted in hidden, by (dev, protocol).
+        '''
+        data = cls.query_netlink_routes(oif=oif, tables=tables, hide_protocols=hide_protocols, hidden=hidden)
+        if data is None:
+            data = cls.query_routes(tables=tables, hide_protocols=hide_protocols, hidden=hidden, dev=dev)
+        return data
+
+    @classmethod
+    def query_netplan_route_tables(cls, rootdir: str = '/') -> set:
+        '''
+        The routing tables used by the netplan configuration: those of its
+        routes and routing policies, of its VRFs and of its DHCP overrides
+        '''
+        tables = set()
+        try:
+            parser = netplan.Parser()
+            parser.load_yaml_hierarchy(rootdir)
+            np_state = netplan.State()
+            np_state.import_parser_results(parser)
+            config = np_state.to_dict().get('network', {})
+        except netplan.NetplanFileException as e:
+            # e.g. an unprivileged user, who cannot read the configuration
+            logging.warning('Cannot read the netplan configuration, not showing the routes '
+                            'of its routing tables: {}'.format(str(e)))
+            return set()
+        except netplan.NetplanException as e:
+            logging.debug('Cannot query netplan routing tables: {}'.format(str(e)))
+            return set()
+        for netdefs in config.values():
+            if not isinstance(netdefs, dict):
+                continue  # e.g. version and renderer
+            for settings in netdefs.values():
+                tables.update(route.get('table') for route in settings.get('routes', []))
+                tables.update(rule.get('table') for rule in settings.get('routing-policy', []))
+                tables.add(settings.get('table'))
+                for overrides in ('dhcp4-overrides', 'dhcp6-overrides'):
+                    tables.add(settings.get(overrides, {}).get('route-table'))
+        return set(int(table) for table in tables if table and int(table) > 0)
+
+    @classmethod
+    def query_resolved(cls, timeout: float = OPTIONAL_QUERY_TIMEOUT) -> tuple:
         addresses = None
         search = None
         try:
-            ipc = dbus.SystemBus()
-            resolve1 = ipc.get_object('org.freedesktop.resolve1', '/org/freedesktop/resolve1')
-            resolve1_if = dbus.Interface(resolve1, 'org.freedesktop.DBus.Properties')
-            res = resolve1_if.GetAll('org.freedesktop.resolve1.Manager')
+            # A private connection, as this runs concurrently to other queries
+            with contextlib.closing(dbus.SystemBus(private=True)) as ipc:
+                resolve1 = ipc.get_object('org.freedesktop.resolve1', '/org/freedesktop/resolve1')
+                resolve1_if = dbus.Interface(resolve1, 'org.freedesktop.DBus.Properties')
+                res = resolve1_if.GetAll('org.freedesktop.resolve1.Manager', timeout=timeout)
             addresses = res['DNS']
             search = res['Domains']
         except Exception as e:
@@ -496,6 +976,8 @@ class SystemConfigState():
         return len(self.interface_list)
 
     def get_data(self) -> dict:
+        if self.state is None:
+            self.state = self.build_state()
         return self.state
 
 
@@ -510,24 +992,28 @@ class NetplanConfigState():
         np_state = netplan.State()
         np_state.import_parser_results(parser)
 
-        self.state = StringIO()
-
-        if subtree == 'all':
-            np_state._dump_yaml(output_file=self.state)
-        else:
+        prefix = None
+        if subtree != 'all':
             if not subtree.startswith('network'):
                 subtree = '.'.join(('network', subtree))
             # Split at '.' but not at '\.' via negative lookbehind expression
-            subtree = re.split(r'(?<!\\)\.', subtree)
+            prefix = re.split(r'(?<!\\)\.', subtree)
             # Replace remaining '\.' by plain '.'
-            subtree = [elem.replace(r'\.', '.') for elem in subtree]
+            prefix = [elem.replace(r'\.', '.') for elem in prefix]
 
-            tmp_in = StringIO()
-            np_state._dump_yaml(output_file=tmp_in)
-            netplan._dump_yaml_subtree(subtree, tmp_in, self.state)
+        # The YAML document, as mapped from the output of libnetplan
+        self.state = np_state.dump_yaml_bytes(prefix)
 
     def __str__(self) -> str:
-        return self.state.getvalue()
+        return str(self.state, 'utf-8')
+
+    def write(self, output_file: IO):
+        ''' Write the YAML document into a text file, bypassing its text layer if possible '''
+        if buffer := getattr(output_file, 'buffer', None):
+            output_file.flush()
+            buffer.write(self.state)
+        else:
+            output_file.write(str(self))
 
     def get_data(self) -> dict:
-        return yaml.safe_load(self.state.getvalue())
+        return yaml.safe_load(bytes(self.state))
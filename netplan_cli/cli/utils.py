@@ -22,10 +22,19 @@ import argparse
 import subprocess
 import netifaces
 import fnmatch
+import glob
+import hashlib
+import itertools
 import re
+import socket
+import urllib.parse
 
-from ..configmanager import ConfigurationError
+from collections import defaultdict
+
+from . import netlink
+from ..configmanager import ConfigurationError, yaml_hierarchy
 from netplan import NetDefinition, NetplanException
+from netplan import _get_version as netplan_version
 
 
 NM_SERVICE_NAME = 'NetworkManager.service'
@@ -33,6 +42,16 @@ NM_SNAP_SERVICE_NAME = 'snap.network-manager.networkmanager.service'
 
 config_errors = (ConfigurationError, NetplanException, RuntimeError)
 
+# Locations of the backend configuration written by the netplan generator
+GENERATED_FILES_GLOBS = ['run/systemd/network/*netplan-*',
+                         'run/NetworkManager/system-connections/netplan-*',
+                         'run/NetworkManager/conf.d/netplan.conf',
+                         'run/NetworkManager/conf.d/10-globally-managed-devices.conf',
+                         'run/systemd/system/netplan-*',
+                         'run/netplan/wpa-*.conf',
+                         'run/udev/rules.d/*netplan*']
+OVS_CLEANUP_UNIT = 'netplan-ovs-cleanup.service'
+
 
 def get_generator_path():
     return os.environ.get('NETPLAN_GENERATE_PATH', '/usr/libexec/netplan/generate')
@@ -48,10 +67,10 @@ def nmcli(args):  # pragma: nocover (covered in autopkgtest)
     subprocess.check_call(['nmcli'] + args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 
 
-def nmcli_out(args: list) -> str:  # pragma: nocover (covered in autopkgtest)
+def nmcli_out(args: list, timeout: float = None) -> str:  # pragma: nocover (covered in autopkgtest)
     # 'nmcli' could be /usr/bin/nmcli or /snap/bin/nmcli -> /snap/bin/network-manager.nmcli
     # PATH is defined in cli/core.py
-    return subprocess.check_output(['nmcli'] + args, text=True)
+    return subprocess.check_output(['nmcli'] + args, text=True, timeout=timeout)
 
 
 def nm_running():  # pragma: nocover (covered in autopkgtest)
@@ -112,6 +131,17 @@ def networkctl_reload():
     subprocess.check_call(['networkctl', 'reload'])
 
 
+def interface_indexes(interfaces):
+    '''Return the ifindex (as a string, like networkd_interfaces()) of the given, existing interfaces'''
+    indexes = set()
+    for iface in interfaces:
+        try:
+            indexes.add(str(socket.if_nametoindex(iface)))
+        except OSError:
+            logging.debug('Cannot find ifindex of %s, it is gone', iface)
+    return indexes
+
+
 def networkctl_reconfigure(interfaces):
     if len(interfaces) >= 1:
         subprocess.check_call(['networkctl', 'reconfigure'] + list(interfaces))
@@ -173,15 +203,182 @@ def get_interface_macaddress(interface):
     return link.get('addr', '')
 
 
-def find_matching_iface(interfaces: list, netdef):
+def _read_sysfs_attr(interface, attr):
+    try:
+        with open(os.path.join('/sys/class/net', interface, attr)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _get_interface_pci_slot_name(interface):
+    uevent = _read_sysfs_attr(interface, os.path.join('device', 'uevent'))
+    for line in (uevent or '').splitlines():
+        if line.startswith('PCI_SLOT_NAME='):
+            return line.split('=', 1)[1]
+    return None
+
+
+def _get_permanent_macaddresses():
+    '''
+    Return a dict mapping interface names to their permanent MAC address, for
+    all interfaces whose current MAC address differs from the permanent one
+    '''
+    try:
+        with netlink.Netlink() as nl:
+            return {link['ifname']: link['permaddr'] for link in nl.links() if 'permaddr' in link}
+    except OSError as e:
+        logging.debug('Cannot read permanent MAC addresses: %s', str(e))
+        return {}
+
+
+class InterfaceInfo:
+    '''Properties of a network interface, as seen by an InterfaceInventory'''
+
+    def __init__(self, name, ifindex=None, macaddress=None, driver=None,
+                 pci_slot=None, operstate=None, permanent_macaddress=None, inventory=None):
+        self.name = name
+        self.ifindex = ifindex
+        self.macaddress = macaddress
+        self.driver = driver
+        self.pci_slot = pci_slot
+        self.operstate = operstate
+        self._permanent_macaddress = permanent_macaddress
+        self._inventory = inventory
+
+    @property
+    def permanent_macaddress(self):
+        # Only looked up on demand, as it needs another netlink dump
+        if self._permanent_macaddress is None:
+            permanent = self._inventory.permanent_macaddresses() if self._inventory else {}
+            self._permanent_macaddress = permanent.get(self.name, self.macaddress)
+        return self._permanent_macaddress
+
+    def __repr__(self):
+        return 'InterfaceInfo(%r, ifindex=%r, macaddress=%r, driver=%r)' % (
+            self.name, self.ifindex, self.macaddress, self.driver)
+
+
+class InterfaceInventory:
+    '''
+    Snapshot of the network interfaces of the system and their properties,
+    so that matching netdefs against interfaces does not need to hit sysfs
+    for every netdef. The snapshot is taken at creation time and needs to be
+    refreshed explicitly, after the set of links changed (e.g. after creating
+    SR-IOV VFs or restarting a backend).
+
+    It can be used everywhere a list of interface names is expected.
+    '''
+
+    def __init__(self, interfaces: list = None):
+        # A fixed list of interface names, instead of the system's interfaces
+        self._interfaces = interfaces
+        self.refresh()
+
+    def refresh(self):
+        names = netifaces.interfaces() if self._interfaces is None else self._interfaces
+        self._permanent_macaddresses = None
+        self._by_name = {}
+        self._by_ifindex = {}
+        self._by_macaddress = defaultdict(list)
+        self._by_driver = defaultdict(list)
+        self._by_pci_slot = {}
+        self._state_matches = {}
+        for name in names:
+            ifindex = _read_sysfs_attr(name, 'ifindex')
+            macaddress = get_interface_macaddress(name)
+            info = InterfaceInfo(name,
+                                 ifindex=int(ifindex) if ifindex else None,
+                                 macaddress=macaddress,
+                                 driver=get_interface_driver_name(name),
+                                 pci_slot=_get_interface_pci_slot_name(name),
+                                 operstate=_read_sysfs_attr(name, 'operstate'),
+                                 inventory=self)
+            self._by_name[name] = info
+            if info.ifindex is not None:
+                self._by_ifindex[info.ifindex] = info
+            if info.macaddress:
+                self._by_macaddress[info.macaddress.lower()].append(info)
+            if info.driver:
+                self._by_driver[info.driver].append(info)
+            if info.pci_slot:
+                self._by_pci_slot[info.pci_slot] = info
+
+    @property
+    def names(self) -> list:
+        return list(self._by_name)
+
+    def __iter__(self):
+        return iter(self._by_name)
+
+    def __len__(self):
+        return len(self._by_name)
+
+    def __contains__(self, name):
+        return name in self._by_name
+
+    def __getitem__(self, name) -> InterfaceInfo:
+        return self._by_name[name]
+
+    def get(self, name) -> InterfaceInfo:
+        return self._by_name.get(name)
+
+    def by_ifindex(self, ifindex: int) -> InterfaceInfo:
+        return self._by_ifindex.get(ifindex)
+
+    def by_macaddress(self, macaddress: str) -> list:
+        return list(self._by_macaddress.get(macaddress.lower(), []))
+
+    def by_driver(self, driver: str) -> list:
+        return list(self._by_driver.get(driver, []))
+
+    def by_pci_slot(self, pci_slot: str) -> InterfaceInfo:
+        return self._by_pci_slot.get(pci_slot)
+
+    def permanent_macaddresses(self) -> dict:
+        '''
+        Return a dict mapping interface names to their permanent MAC address,
+        if it differs from the current one. It is only read on first use.
+        '''
+        if self._permanent_macaddresses is None:
+            self._permanent_macaddresses = _get_permanent_macaddresses()
+        return self._permanent_macaddresses
+
+    def match_all(self, np_state) -> dict:
+        '''
+        Return a dict mapping each netdef ID of the given netplan.State to the
+        names of the interfaces it matches. The result is cached until the
+        next refresh.
+        '''
+        # Keep a reference to the state, so its id() cannot be reused
+        state, matches = self._state_matches.get(id(np_state), (None, None))
+        if state is not np_state:
+            matches = np_state.match_interfaces(
+                (info.name, info.macaddress, info.driver) for info in self._by_name.values())
+            self._state_matches[id(np_state)] = (np_state, matches)
+        return matches
+
+    def match(self, netdef) -> list:
+        '''Return the names of all interfaces matching the given netdef'''
+        return list(self.match_all(netdef._parent).get(netdef.id, []))
+
+
+def find_matching_ifaces(interfaces, netdef):
     assert isinstance(netdef, NetDefinition)
     assert netdef._has_match
 
-    matches = list(filter(lambda itf: netdef._match_interface(
+    if isinstance(interfaces, InterfaceInventory):
+        return interfaces.match(netdef)
+    # A plain list of names: only query what the match needs
+    return list(filter(lambda itf: netdef._match_interface(
             iface_name=itf,
             iface_driver=get_interface_driver_name(itf),
             iface_mac=get_interface_macaddress(itf)), interfaces))
 
+
+def find_matching_iface(interfaces, netdef):
+    matches = find_matching_ifaces(interfaces, netdef)
+
     # Return current name of unique matched interface, if available
     if len(matches) != 1:
         logging.info(matches)
@@ -189,6 +386,143 @@ def find_matching_iface(interfaces: list, netdef):
     return matches[0]
 
 
+def config_digest(rootdir='/'):
+    '''
+    Return a SHA-256 digest over the netplan YAML hierarchy (file names, modes
+    and contents) and the version of libnetplan, which generates the backend
+    configuration, or None if some file cannot be read
+    '''
+    digest = hashlib.sha256(b'\0'.join([b'libnetplan', netplan_version().encode(), b'']))
+    for path in yaml_hierarchy(rootdir):
+        try:
+            mode = os.stat(path).st_mode
+            with open(path, 'rb') as f:
+                contents = f.read()
+        except OSError as e:
+            logging.debug('Cannot read %s: %s', path, str(e))
+            return None
+        digest.update(b'\0'.join([path.encode(), oct(mode).encode(), contents, b'']))
+    return digest.hexdigest()
+
+
+def generated_files_digests(rootdir='/'):
+    '''
+    Return a dict mapping every netplan generated backend file to the
+    SHA-256 digest of its content
+    '''
+    digests = {}
+    for pattern in GENERATED_FILES_GLOBS:
+        for path in glob.glob(os.path.join(rootdir, pattern)):
+            if not os.path.isfile(path):
+                continue
+            try:
+                with open(path, 'rb') as f:
+                    digests[path] = hashlib.sha256(f.read()).hexdigest()
+            except OSError as e:  # pragma: nocover (race with a concurrent generator run)
+                logging.debug('Cannot hash generated file %s: %s', path, str(e))
+    return digests
+
+
+def unknown_files_digests(*snapshots):
+    '''
+    Return a snapshot to compare other snapshots, as taken by
+    generated_files_digests(), against, in which every file of the given
+    snapshots is considered as changed. It stands in for a snapshot, which
+    is unknown.
+    '''
+    return dict.fromkeys(itertools.chain(*snapshots), '')
+
+
+def _systemd_unescape(name):
+    name = name.replace('-', '/')
+    return re.sub(r'\\x([0-9a-fA-F]{2})', lambda m: chr(int(m.group(1), 16)), name)
+
+
+def _nm_netdef_id(path, stem):
+    # Wifi connection profiles are named netplan-<id>-<escaped SSID>.nmconnection,
+    # strip the SSID suffix if we can still read it from the keyfile
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                if line.startswith('ssid='):
+                    ssid = line[len('ssid='):].rstrip('\n')
+                    for suffix in [urllib.parse.quote(ssid, safe=''), ssid]:
+                        if stem.endswith('-' + suffix):
+                            return stem[:-len(suffix)-1]
+                    break
+    except OSError:
+        pass  # the profile was removed by the generator
+    return stem
+
+
+def generated_file_owner(path):
+    '''
+    Return a (backend, netdef ID) tuple for a netplan generated file, or
+    (None, None) if the file is not bound to any backend restart.
+    '''
+    name = os.path.basename(path)
+    m = re.match(r'^10-netplan-(.+)\.(network|netdev|link)$', name)
+    if m:
+        return ('networkd', m.group(1))
+    m = re.match(r'^netplan-(.+)\.nmconnection$', name)
+    if m:
+        return ('NetworkManager', _nm_netdef_id(path, m.group(1)))
+    if os.path.basename(os.path.dirname(path)) == 'conf.d':
+        return ('NetworkManager', None)  # global NetworkManager configuration
+    # The wpa_supplicant configuration, holding the networkd wifi and 802.1x
+    # credentials, which do not show up in any other file
+    m = re.match(r'^wpa-(.+)\.conf$', name)
+    if m:
+        return ('networkd', m.group(1))
+    if name == OVS_CLEANUP_UNIT:
+        return (None, None)  # it can always be there
+    m = re.match(r'^netplan-ovs-(.+)\.service$', name)
+    if m:
+        return ('OpenVSwitch', m.group(1))
+    m = re.match(r'^netplan-wpa-(.+)\.service$', name)
+    if m:
+        return ('networkd', _systemd_unescape(m.group(1)))
+    return (None, None)
+
+
+def generated_files_changes(old_digests, new_digests):
+    '''
+    Compare two snapshots taken by generated_files_digests() and return the
+    files which were added, modified or removed, grouped by backend and
+    netdef ID, e.g.:
+    {'networkd': {'eth0': {'/run/systemd/network/10-netplan-eth0.network'}},
+     'NetworkManager': {}, 'OpenVSwitch': {}}
+    '''
+    changes = {'networkd': {}, 'NetworkManager': {}, 'OpenVSwitch': {}}
+    for path in set(old_digests) | set(new_digests):
+        if old_digests.get(path) == new_digests.get(path):
+            continue
+        backend, netdef_id = generated_file_owner(path)
+        if backend:
+            changes[backend].setdefault(netdef_id, set()).add(path)
+    return changes
+
+
+def generated_udev_changes(old_digests, new_digests):
+    '''
+    Compare two snapshots taken by generated_files_digests() and return the
+    set of netdef IDs whose .link file or udev rules were added, modified or
+    removed. Returns None if a udev rules file that applies to all network
+    interfaces changed (e.g. 90-netplan.rules).
+    '''
+    changed_ids = set()
+    for path in set(old_digests) | set(new_digests):
+        if old_digests.get(path) == new_digests.get(path):
+            continue
+        name = os.path.basename(path)
+        m = re.match(r'^(?:10-netplan-(.+)\.link|99-netplan-(.+)\.rules)$', name)
+        if m:
+            changed_ids.add(m.group(1) or m.group(2))
+        elif '/run/udev/rules.d/' in path:
+            return None
+    return changed_ids
+
+
 class NetplanCommand(argparse.Namespace):
 
     def __init__(self, command_id, description, leaf=True, testing=False):
@@ -17,15 +17,71 @@
 
 '''netplan configuration manager'''
 
+import glob
+import hashlib
 import logging
 import netplan
 import os
 import shutil
 import sys
 import tempfile
+import time
 
 from typing import Optional
 
+# Files modified less than this many nanoseconds before being parsed could be
+# modified again without changing their mtime (timestamp granularity), so for
+# those the file contents need to be compared as well
+RACY_MTIME_NS = 2 * 1000 * 1000 * 1000
+
+# Process-level cache of parsed configurations, shared by all ConfigManagers.
+# Maps the root directory to a (files key, contents digest, netplan.State) tuple
+_parsed_states = {}
+
+
+def yaml_hierarchy(rootdir='/'):
+    '''
+    Return the ordered list of YAML files, as loaded by
+    netplan_parser_load_yaml_hierarchy(): files in /run/netplan shadow files
+    in /etc/netplan, which shadow files in /lib/netplan, ordered by file name.
+    '''
+    configs = {}
+    for config_dir in ['lib', 'etc', 'run']:
+        for path in sorted(glob.glob(os.path.join(rootdir, config_dir, 'netplan', '*.yaml'))):
+            configs[os.path.basename(path)] = path
+    return [configs[name] for name in sorted(configs)]
+
+
+def _hierarchy_key(files):
+    '''
+    Identify the state of the given files by their (path, mtime, size, inode)
+    attributes. Returns None if some file cannot be accessed.
+    '''
+    key = []
+    for path in files:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        key.append((path, st.st_mtime_ns, st.st_size, st.st_ino))
+    return tuple(key)
+
+
+def _hierarchy_digest(files):
+    digest = hashlib.sha256()
+    for path in files:
+        try:
+            with open(path, 'rb') as f:
+                digest.update(b'\0'.join([path.encode(), f.read(), b'']))
+        except OSError:
+            return None
+    return digest.hexdigest()
+
+
+def clear_parsed_states():
+    '''Drop all cached parsed configurations'''
+    _parsed_states.clear()
+
 
 class ConfigManager(object):
     def __init__(self, prefix="/", extra_files={}):
@@ -70,8 +126,27 @@ class ConfigManager(object):
         entire configuration, so that it can later be interrogated.
 
         Returns a libnetplan State wrapper
+
+        The parsed configuration is cached for the whole process, as long as
+        the configuration files do not change.
         """
 
+        files = yaml_hierarchy(self.prefix) + list(extra_config or [])
+        key = _hierarchy_key(files)
+        racy = False
+        digest = None
+        if key:
+            cached_key, cached_digest, cached_state = _parsed_states.get(self.prefix, (None, None, None))
+            if key == cached_key and (cached_digest is None or cached_digest == _hierarchy_digest(files)):
+                logging.debug('Using cached netplan configuration of %s', self.prefix)
+                self.np_state = cached_state
+                return self.np_state
+            now = time.time_ns()
+            racy = any(now - mtime < RACY_MTIME_NS for _, mtime, _, _ in key)
+            if racy:
+                digest = _hierarchy_digest(files)
+        _parsed_states.pop(self.prefix, None)
+
         # /run/netplan shadows /etc/netplan/, which shadows /lib/netplan
         parser = netplan.Parser()
         try:
@@ -86,10 +161,11 @@ class ConfigManager(object):
         except netplan.NetplanException as e:
             raise ConfigurationError(str(e))
 
-        # Convoluted way to dump the parsed config to the logs...
-        with tempfile.TemporaryFile() as tmp:
-            self.np_state._dump_yaml(output_file=tmp)
-            logging.debug("Merged config:\n{}".format(tmp.read()))
+        if key and not (racy and digest is None):
+            _parsed_states[self.prefix] = (key, digest, self.np_state)
+
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("Merged config:\n{}".format(str(self.np_state.dump_yaml_bytes(), 'utf-8')))
 
         return self.np_state
 
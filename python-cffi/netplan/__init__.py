@@ -18,17 +18,21 @@ import json
 import os
 from typing import Union, List, IO
 
-from ._netplan_cffi import lib
+from ._netplan_cffi import ffi, lib
 from .netdef import NetDefinition, NetDefinitionIterator
 from .parser import Parser
 from .state import State
-from ._utils import _checked_lib_call
+from ._utils import _checked_lib_call, _memfd_view
 from ._utils import (NetplanException, NetplanBackendException,
                      NetplanEmitterException, NetplanFileException,
                      NetplanFormatException, NetplanParserException,
                      NetplanValidationException)
 
 
+def _get_version() -> str:
+    return ffi.string(lib._netplan_version()).decode('utf-8')
+
+
 def _dump_yaml_subtree(prefix: List[str], input_file: IO, output_file: IO):
     if isinstance(input_file, StringIO):
         input_fd = os.memfd_create(name='netplan_temp_input_file')
@@ -49,10 +53,7 @@ def _dump_yaml_subtree(prefix: List[str], input_file: IO, output_file: IO):
         os.close(input_fd)
 
     if isinstance(output_file, StringIO):
-        size = os.lseek(output_fd, 0, os.SEEK_CUR)
-        os.lseek(output_fd, 0, os.SEEK_SET)
-        data = os.read(output_fd, size)
-        output_file.write(data.decode('utf-8'))
+        output_file.write(str(_memfd_view(output_fd), 'utf-8'))
         os.close(output_fd)
 
 
@@ -67,7 +68,7 @@ def _create_yaml_patch(patch_object_path: List[str], patch_payload: Union[str, d
 
 # Re-export submodules
 __all__ = [Parser, State, NetDefinition, NetDefinitionIterator,
-           _dump_yaml_subtree, _create_yaml_patch,
+           _dump_yaml_subtree, _create_yaml_patch, _get_version,
            NetplanException, NetplanBackendException, NetplanEmitterException,
            NetplanFileException, NetplanFormatException, NetplanParserException,
            NetplanValidationException]
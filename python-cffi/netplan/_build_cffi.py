@@ -116,6 +116,11 @@ ffibuilder.cdef("""
     gboolean _netplan_netdef_is_trivial_compound_itf(const NetplanNetDefinition* netdef);
     int _netplan_state_get_vf_count_for_def(
         const NetplanState* np_state, const NetplanNetDefinition* netdef, NetplanError** error);
+    size_t _netplan_netdefs_match_interfaces(
+        const NetplanNetDefinition** netdefs, size_t n_netdefs,
+        const char** names, const char** macs, const char** driver_names, size_t n_ifaces,
+        uint8_t* out_matches);
+    const char* _netplan_version(void);
 
     // Iterators (internal)
     struct netdef_pertype_iter* _netplan_state_new_netdef_pertype_iter(NetplanState* np_state, const char* def_type);
@@ -134,6 +139,14 @@ ffibuilder.cdef("""
     NetplanIPRoute* _netplan_route_iter_next(struct route_iter* it);
     void _netplan_route_iter_free(struct route_iter* it);
 
+    // State (internal)
+    gboolean _netplan_state_dump_json(const NetplanState* np_state, int out_fd, NetplanError** error);
+
+    // Generation (internal)
+    gboolean _netplan_state_generate(
+        const NetplanState* np_state, const char* rootdir, gboolean incremental,
+        const char* manifest_path, gboolean* any_networkd, NetplanError** error);
+
     // Utils
     gboolean netplan_util_dump_yaml_subtree(const char* prefix, int input_fd, int output_fd, NetplanError** error);
     gboolean netplan_util_create_yaml_patch(const char* conf_obj_path, const char* obj_payload, int out_fd, NetplanError** error);
@@ -164,6 +177,7 @@ ffibuilder.set_source_pkgconfig(
     // internal headers (private API)
     #include "util-internal.h"
     #include "names.h"
+    #include "backends.h"
     """,
     include_dirs=[cffi_inc],
     library_dirs=[cffi_lib],
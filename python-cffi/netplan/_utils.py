@@ -15,7 +15,10 @@
 
 from collections import defaultdict
 from enum import IntEnum
+import mmap
+import os
 import re
+import threading
 
 from ._netplan_cffi import ffi, lib
 
@@ -190,25 +193,48 @@ def _checked_lib_call(fn, *args):
         domain_code = lib.netplan_error_code(err)
         error_domain = domain_code >> 32  # upper 32 bits
         error_code = int(ffi.cast('uint32_t', domain_code))  # lower 32 bits
-        error_message = _string_realloc_call_no_error(lambda b: lib.netplan_error_message(err, b, len(b)))
+        error_message = _string_call_no_error(lambda b, size: lib.netplan_error_message(err, b, size))
         exception = NETPLAN_EXCEPTIONS[error_domain][error_code]
         raise exception(error_message, error_domain, error_code)
     return ret
 
 
-def _string_realloc_call_no_error(function: callable):
-    size = 16
-    while size < 1048576:  # 1MB
+# Strings are read into a reusable, per-thread buffer first. Most of them
+# (IDs, file paths, MAC addresses) fit into it and take a single call.
+_STRING_BUFFER_SIZE = 4096
+_string_buffers = threading.local()
+
+
+def _string_call_no_error(function: callable):
+    '''
+    Read a string using a libnetplan getter, called as function(buffer, size).
+    Longer strings are read into a buffer of their exact size, as queried by
+    passing a NULL buffer, instead of growing it step by step.
+    '''
+    buf = getattr(_string_buffers, 'buf', None)
+    if buf is None:
+        buf = _string_buffers.buf = ffi.new('char[]', _STRING_BUFFER_SIZE)
+    code = function(buf, _STRING_BUFFER_SIZE)
+    if code == -2:  # NETPLAN_BUFFER_TOO_SMALL
+        size = function(ffi.NULL, 0)
         buf = ffi.new('char[]', size)
-        code = function(buf)
-        if code == -2:
-            size = size * 2
-            continue
-
-        if code < 0:  # pragma: nocover
-            raise NetplanException("Unknown error: %d" % code)
-        elif code == 0:
-            return None  # pragma: nocover as it's hard to trigger for now
-        else:
-            return ffi.string(buf).decode('utf-8')
-    raise NetplanException('Halting due to string buffer size > 1M')  # pragma: nocover
+        code = function(buf, size)
+
+    if code < 0:  # pragma: nocover
+        raise NetplanException("Unknown error: %d" % code)
+    elif code == 0:
+        return None  # pragma: nocover as it's hard to trigger for now
+    # the returned size includes the final NUL character
+    return ffi.buffer(buf, code - 1)[:].decode('utf-8')
+
+
+def _memfd_view(fd: int) -> memoryview:
+    '''
+    Get the content written into a memfd, up to its current offset, as a
+    read-only buffer. It is mapped instead of read, so it is not copied.
+    The file descriptor can be closed afterwards.
+    '''
+    size = os.lseek(fd, 0, os.SEEK_CUR)
+    if size == 0:
+        return memoryview(b'')  # empty files cannot be mapped
+    return memoryview(mmap.mmap(fd, size, access=mmap.ACCESS_READ))
@@ -14,23 +14,62 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from dataclasses import dataclass
+import functools
 
 from ._netplan_cffi import ffi, lib
-from ._utils import _string_realloc_call_no_error, NetplanException
+from ._utils import _string_call_no_error, NetplanException
+
+
+def _cached(getter):
+    '''
+    Turn the getter of a scalar setting into a property, which is memoized
+    per NetDefinition, as a netdef does not change once imported into a State.
+    '''
+    name = getter.__name__
+
+    @functools.wraps(getter)
+    def cached_getter(self):
+        try:
+            return self._cache[name]
+        except KeyError:
+            value = self._cache[name] = getter(self)
+            return value
+    return property(cached_getter)
 
 
 class NetDefinition():
+    '''
+    A read-only view of a netdef of a State. The wrappers are interned by
+    their State, see State._netdef(), and hashable.
+    '''
+    __slots__ = ('_ptr', '_parent', '_cache', '__weakref__')
+
     def __init__(self, np_state, ptr):
-        self._ptr = ptr
+        object.__setattr__(self, '_ptr', ptr)
         # We hold on to this to avoid the underlying pointer being invalidated by
         # the GC invoking netplan_state_free
-        self._parent = np_state
+        object.__setattr__(self, '_parent', np_state)
+        object.__setattr__(self, '_cache', {})
+
+    def __setattr__(self, name, value):
+        raise AttributeError('NetDefinition objects are read-only')
 
     def __eq__(self, other: 'NetDefinition') -> bool:
         if not hasattr(other, '_ptr'):
             return False
         return self._ptr == other._ptr
 
+    def __hash__(self) -> int:
+        return hash(self._ptr)
+
+    def to_dict(self) -> dict:
+        '''
+        Get the settings of this netdef, as found in State.to_dict(). The
+        state is serialized once and shared by all of its netdefs. OVS ports
+        are not part of any per-type section, so theirs is empty.
+        '''
+        return self._parent._netdef_dict(self)
+
     def _match_interface(self, iface_name: str = None, iface_driver: str = None, iface_mac: str = None) -> bool:
         return bool(lib.netplan_netdef_match_interface(
             self._ptr,
@@ -42,11 +81,11 @@ class NetDefinition():
     def addresses(self) -> '_NetdefAddressIterator':
         return _NetdefAddressIterator(self._ptr)
 
-    @property
+    @_cached
     def dhcp4(self) -> bool:
         return bool(lib.netplan_netdef_get_dhcp4(self._ptr))
 
-    @property
+    @_cached
     def dhcp6(self) -> bool:
         return bool(lib.netplan_netdef_get_dhcp6(self._ptr))
 
@@ -62,74 +101,78 @@ class NetDefinition():
     def routes(self) -> '_NetdefRouteIterator':
         return _NetdefRouteIterator(self._ptr)
 
-    @property
+    @_cached
     def macaddress(self) -> str:
-        return _string_realloc_call_no_error(lambda b: lib.netplan_netdef_get_macaddress(self._ptr, b, len(b)))
+        return _string_call_no_error(lambda b, size: lib.netplan_netdef_get_macaddress(self._ptr, b, size))
 
-    @property
+    @_cached
     def _has_match(self) -> bool:
         return bool(lib.netplan_netdef_has_match(self._ptr))
 
-    @property
+    @_cached
     def set_name(self) -> str:
-        return _string_realloc_call_no_error(lambda b: lib.netplan_netdef_get_set_name(self._ptr, b, len(b)))
+        return _string_call_no_error(lambda b, size: lib.netplan_netdef_get_set_name(self._ptr, b, size))
 
-    @property
+    @_cached
     def critical(self) -> bool:
         return bool(lib._netplan_netdef_get_critical(self._ptr))
 
     @property
     def links(self) -> dict:
+        return dict(self._links)
+
+    @_cached
+    def _links(self) -> dict:
         d = dict()
         if sriov_link := lib.netplan_netdef_get_sriov_link(self._ptr):
-            d['sriov'] = NetDefinition(self._parent, sriov_link)
+            d['sriov'] = self._parent._netdef(sriov_link)
 
         if vlan_link := lib.netplan_netdef_get_vlan_link(self._ptr):
-            d['vlan'] = NetDefinition(self._parent, vlan_link)
+            d['vlan'] = self._parent._netdef(vlan_link)
 
         if bridge_link := lib.netplan_netdef_get_bridge_link(self._ptr):
-            d['bridge'] = NetDefinition(self._parent, bridge_link)
+            d['bridge'] = self._parent._netdef(bridge_link)
 
         if bond_link := lib.netplan_netdef_get_bond_link(self._ptr):
-            d['bond'] = NetDefinition(self._parent, bond_link)
+            d['bond'] = self._parent._netdef(bond_link)
 
         # TODO: ovs vs veth? Should we use the same field?
         if peer_link := lib.netplan_netdef_get_peer_link(self._ptr):
-            d['peer'] = NetDefinition(self._parent, peer_link)
+            d['peer'] = self._parent._netdef(peer_link)
         return d
 
-    @property
+    @_cached
     def _vlan_id(self) -> int:
         vlan_id = lib._netplan_netdef_get_vlan_id(self._ptr)
         if vlan_id == lib.UINT_MAX:
             return None
         return vlan_id
 
-    @property
+    @_cached
     def _has_sriov_vlan_filter(self) -> bool:
         return bool(lib._netplan_netdef_get_sriov_vlan_filter(self._ptr))
 
-    @property
+    @_cached
     def backend(self) -> str:
         return ffi.string(lib.netplan_backend_name(lib.netplan_netdef_get_backend(self._ptr))).decode('utf-8')
 
-    @property
+    @_cached
     def type(self) -> str:
         return ffi.string(lib.netplan_def_type_name(lib.netplan_netdef_get_type(self._ptr))).decode('utf-8')
 
-    @property
+    @_cached
     def id(self) -> str:
-        return _string_realloc_call_no_error(lambda b: lib.netplan_netdef_get_id(self._ptr, b, len(b)))
+        return _string_call_no_error(lambda b, size: lib.netplan_netdef_get_id(self._ptr, b, size))
 
-    @property
+    @_cached
     def filepath(self) -> str:
-        return _string_realloc_call_no_error(lambda b: lib.netplan_netdef_get_filepath(self._ptr, b, len(b)))
+        return _string_call_no_error(lambda b, size: lib.netplan_netdef_get_filepath(self._ptr, b, size))
 
-    @property
+    @_cached
     def _embedded_switch_mode(self) -> str:
-        return _string_realloc_call_no_error(lambda b: lib._netplan_netdef_get_embedded_switch_mode(self._ptr, b, len(b)))
+        return _string_call_no_error(lambda b, size: lib._netplan_netdef_get_embedded_switch_mode(self._ptr, b, size))
 
-    @property
+    @_cached
     def _delay_virtual_functions_rebind(self) -> bool:
         return bool(lib.netplan_netdef_get_delay_virtual_functions_rebind(self._ptr))
 
@@ -139,11 +182,11 @@ class NetDefinition():
         count = lib._netplan_state_get_vf_count_for_def(self._parent._ptr, self._ptr, ref)
         if count < 0:
             err = ref[0]
-            msg = _string_realloc_call_no_error(lambda b: lib.netplan_error_message(err, b, len(b)))
+            msg = _string_call_no_error(lambda b, size: lib.netplan_error_message(err, b, size))
             raise NetplanException(msg)
         return count
 
-    @property
+    @_cached
     def _is_trivial_compound_itf(self) -> bool:
         '''
         Returns True if the interface is a compound interface (bond or bridge),
@@ -169,7 +212,7 @@ class NetDefinitionIterator():
         next_value = lib._netplan_netdef_pertype_iter_next(self.iterator)
         if not next_value:
             raise StopIteration
-        return NetDefinition(self.np_state, next_value)
+        return self.np_state._netdef(next_value)
 
 
 class NetplanAddress:
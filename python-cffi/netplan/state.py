@@ -14,14 +14,18 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 # from enum import IntEnum
-from io import StringIO
+import copy
+import io
+import json
 import os
-from typing import IO
+from types import MappingProxyType
+from typing import IO, Dict, Iterable, List, Mapping, Tuple
+import weakref
 
 from ._netplan_cffi import ffi, lib
 from .netdef import NetDefinition, NetDefinitionIterator
 from .parser import Parser
-from ._utils import _checked_lib_call
+from ._utils import _checked_lib_call, _memfd_view
 
 
 # class NETPLAN_STORAGE(IntEnum):
@@ -33,6 +37,12 @@ from ._utils import _checked_lib_call
 class State():
     def __init__(self):
         self._ptr = lib.netplan_state_new()
+        # NetDefinition wrappers in use, by address, see _netdef()
+        self._netdef_wrappers: Mapping[int, NetDefinition] = weakref.WeakValueDictionary()
+        # netdefs by type (None for all of them), see _netdefs_of_type()
+        self._netdefs_by_type: Dict[str, Mapping[str, NetDefinition]] = None
+        # to_dict() of the whole state, for NetDefinition.to_dict()
+        self._dict: dict = None
 
     def __del__(self):
         ref = ffi.new('NetplanState **', self._ptr)
@@ -42,13 +52,27 @@ class State():
         ptr = lib.netplan_state_get_netdef(self._ptr, netdef_id.encode('utf-8'))
         if not ptr:
             raise IndexError()
-        return NetDefinition(self, ptr)
+        return self._netdef(ptr)
 
     def __len__(self):
         return lib.netplan_state_get_netdefs_size(self._ptr)
 
+    def _netdef(self, ptr) -> NetDefinition:
+        '''
+        Get the wrapper of a netdef of this state. It is shared by all users
+        while in use, so that repeated lookups neither allocate a new wrapper
+        nor query its (memoized) settings again.
+        '''
+        address = int(ffi.cast('uintptr_t', ptr))
+        netdef = self._netdef_wrappers.get(address)
+        if netdef is None:
+            netdef = self._netdef_wrappers[address] = NetDefinition(self, ptr)
+        return netdef
+
     def import_parser_results(self, parser: Parser):
         _checked_lib_call(lib.netplan_state_import_parser_results, self._ptr, parser._ptr)
+        self._netdefs_by_type = None
+        self._dict = None
 
     # def write_yaml(filter: str, default_filename: str = None,
     #                storage: NETPLAN_STORAGE = NETPLAN_STORAGE.ETC, rootdir str = None):
@@ -65,71 +89,172 @@ class State():
         root = rootdir.encode('utf-8') if rootdir else ffi.NULL
         _checked_lib_call(lib.netplan_state_update_yaml_hierarchy, self._ptr, name, root)
 
+    def generate(self, rootdir: str = None, incremental: bool = False, manifest: str = None):
+        '''
+        Write the backend configuration (systemd-networkd, NetworkManager,
+        Open vSwitch, SR-IOV, udev) for this state into rootdir, replacing
+        the previously generated configuration, like the netplan generator.
+        In incremental mode, only the files whose contents changed are
+        written or removed. The optional manifest path ('-' for stdout)
+        receives a JSON manifest of those files and implies incremental mode.
+        '''
+        root = rootdir.encode('utf-8') if rootdir else ffi.NULL
+        manifest_path = manifest.encode('utf-8') if manifest else ffi.NULL
+        _checked_lib_call(lib._netplan_state_generate, self._ptr, root, incremental, manifest_path, ffi.NULL)
+
     def _dump_yaml(self, output_file: IO):
-        if isinstance(output_file, StringIO):
-            fd = os.memfd_create(name='netplan_temp_file')
-            _checked_lib_call(lib.netplan_state_dump_yaml, self._ptr, fd)
-            size = os.lseek(fd, 0, os.SEEK_CUR)
-            os.lseek(fd, 0, os.SEEK_SET)
-            data = os.read(fd, size)
-            os.close(fd)
-            output_file.write(data.decode('utf-8'))
-        else:
+        '''
+        Write the YAML representation of this state into the given file.
+        libnetplan writes into its file descriptor directly, if it has one,
+        otherwise (e.g. for StringIO or BytesIO) dump_yaml_bytes() is written.
+        '''
+        try:
             fd = output_file.fileno()
+        except (AttributeError, io.UnsupportedOperation):
+            data = self.dump_yaml_bytes()
+            output_file.write(str(data, 'utf-8') if isinstance(output_file, io.TextIOBase) else data)
+            return
+        output_file.flush()
+        _checked_lib_call(lib.netplan_state_dump_yaml, self._ptr, fd)
+
+    def dump_yaml_bytes(self, prefix: List[str] = None) -> memoryview:
+        '''
+        Get the YAML representation of this state, or only of the subtree at
+        the given path of keys (e.g. ['network', 'ethernets']), as a read-only
+        UTF-8 buffer. It is written by libnetplan into an anonymous memory
+        file, which is mapped rather than read, so the document is not copied.
+        '''
+        fd = os.memfd_create(name='netplan_state_yaml')
+        try:
             _checked_lib_call(lib.netplan_state_dump_yaml, self._ptr, fd)
+            if prefix:
+                subtree_fd = os.memfd_create(name='netplan_state_yaml_subtree')
+                os.lseek(fd, 0, os.SEEK_SET)
+                try:
+                    _checked_lib_call(lib.netplan_util_dump_yaml_subtree,
+                                      '\t'.join(prefix).encode('utf-8'), fd, subtree_fd)
+                    return _memfd_view(subtree_fd)
+                finally:
+                    os.close(subtree_fd)
+            return _memfd_view(fd)
+        finally:
+            os.close(fd)
+
+    def to_dict(self) -> dict:
+        '''
+        Get the whole state as native Python objects, structured like its
+        YAML representation. It is serialized by libnetplan in a single call
+        and decoded in a single pass, instead of reading it setting by setting.
+        '''
+        with os.fdopen(os.memfd_create(name='netplan_state_json'), 'rb') as f:
+            _checked_lib_call(lib._netplan_state_dump_json, self._ptr, f.fileno())
+            f.seek(0)
+            return json.load(f)
+
+    def _netdef_dict(self, netdef: NetDefinition) -> dict:
+        if self._dict is None:
+            self._dict = self.to_dict()
+        network = self._dict.get('network', {})
+        return copy.deepcopy(network.get(netdef.type, {}).get(netdef.id, {}))
+
+    def match_interfaces(self, interfaces: Iterable[Tuple[str, str, str]]) -> Dict[str, List[str]]:
+        '''
+        Match all netdefs against the given (name, macaddress, driver) tuples,
+        describing the interfaces of a system. The MAC address and driver
+        might be None, if unknown.
+        Returns a dict mapping each netdef ID to the list of names of the
+        interfaces it matches.
+        '''
+        netdefs = list(NetDefinitionIterator(self, None))
+        interfaces = list(interfaces)
+        keepalive = []
+
+        def c_string(value: str):
+            if not value:
+                return ffi.NULL
+            c_value = ffi.new('char[]', value.encode('utf-8'))
+            keepalive.append(c_value)
+            return c_value
+
+        names = ffi.new('const char*[]', [c_string(name) for name, _, _ in interfaces])
+        macs = ffi.new('const char*[]', [c_string(mac) for _, mac, _ in interfaces])
+        drivers = ffi.new('const char*[]', [c_string(driver) for _, _, driver in interfaces])
+        ptrs = ffi.new('const NetplanNetDefinition*[]', [netdef._ptr for netdef in netdefs])
+        size = len(interfaces)
+        matches = ffi.new('uint8_t[]', len(netdefs) * size)
+        lib._netplan_netdefs_match_interfaces(ptrs, len(netdefs), names, macs, drivers, size, matches)
+
+        data = ffi.buffer(matches)[:]
+        return dict((netdef.id, [interfaces[j][0] for j, match in enumerate(data[i * size:(i + 1) * size]) if match])
+                    for i, netdef in enumerate(netdefs))
+
+    def _netdefs_of_type(self, dev_type: str = None) -> Mapping[str, NetDefinition]:
+        '''
+        Get a read-only mapping of the netdefs of the given type (or all of
+        them), by ID. All netdefs are indexed by type in a single pass over
+        the state on first use, and kept until the state is changed.
+        '''
+        if self._netdefs_by_type is None:
+            by_type = {None: {}}
+            for nd in NetDefinitionIterator(self, None):
+                netdef_id = nd.id
+                by_type[None][netdef_id] = nd
+                by_type.setdefault(nd.type, {})[netdef_id] = nd
+            self._netdefs_by_type = dict((key, MappingProxyType(value)) for key, value in by_type.items())
+        return self._netdefs_by_type.get(dev_type, MappingProxyType({}))
 
     @property
     def backend(self) -> str:
         return ffi.string(lib.netplan_backend_name(lib.netplan_state_get_backend(self._ptr))).decode('utf-8')
 
     @property
-    def netdefs(self) -> NetDefinitionIterator:
-        return dict((nd.id, nd) for nd in NetDefinitionIterator(self, None))
+    def netdefs(self) -> Mapping[str, NetDefinition]:
+        return self._netdefs_of_type(None)
 
     @property
-    def ethernets(self) -> NetDefinitionIterator:
-        return dict((nd.id, nd) for nd in NetDefinitionIterator(self, "ethernets"))
+    def ethernets(self) -> Mapping[str, NetDefinition]:
+        return self._netdefs_of_type("ethernets")
 
     @property
-    def modems(self) -> NetDefinitionIterator:
-        return dict((nd.id, nd) for nd in NetDefinitionIterator(self, "modems"))
+    def modems(self) -> Mapping[str, NetDefinition]:
+        return self._netdefs_of_type("modems")
 
     @property
-    def wifis(self) -> NetDefinitionIterator:
-        return dict((nd.id, nd) for nd in NetDefinitionIterator(self, "wifis"))
+    def wifis(self) -> Mapping[str, NetDefinition]:
+        return self._netdefs_of_type("wifis")
 
     @property
-    def vlans(self) -> NetDefinitionIterator:
-        return dict((nd.id, nd) for nd in NetDefinitionIterator(self, "vlans"))
+    def vlans(self) -> Mapping[str, NetDefinition]:
+        return self._netdefs_of_type("vlans")
 
     @property
-    def bridges(self) -> NetDefinitionIterator:
-        return dict((nd.id, nd) for nd in NetDefinitionIterator(self, "bridges"))
+    def bridges(self) -> Mapping[str, NetDefinition]:
+        return self._netdefs_of_type("bridges")
 
     @property
-    def bonds(self) -> NetDefinitionIterator:
-        return dict((nd.id, nd) for nd in NetDefinitionIterator(self, "bonds"))
+    def bonds(self) -> Mapping[str, NetDefinition]:
+        return self._netdefs_of_type("bonds")
 
     @property
-    def dummy_devices(self) -> NetDefinitionIterator:
-        return dict((nd.id, nd) for nd in NetDefinitionIterator(self, "dummy-devices"))
+    def dummy_devices(self) -> Mapping[str, NetDefinition]:
+        return self._netdefs_of_type("dummy-devices")
 
     @property
-    def tunnels(self) -> NetDefinitionIterator:
-        return dict((nd.id, nd) for nd in NetDefinitionIterator(self, "tunnels"))
+    def tunnels(self) -> Mapping[str, NetDefinition]:
+        return self._netdefs_of_type("tunnels")
 
     @property
-    def virtual_ethernets(self) -> NetDefinitionIterator:
-        return dict((nd.id, nd) for nd in NetDefinitionIterator(self, "virtual-ethernets"))
+    def virtual_ethernets(self) -> Mapping[str, NetDefinition]:
+        return self._netdefs_of_type("virtual-ethernets")
 
     @property
-    def vrfs(self) -> NetDefinitionIterator:
-        return dict((nd.id, nd) for nd in NetDefinitionIterator(self, "vrfs"))
+    def vrfs(self) -> Mapping[str, NetDefinition]:
+        return self._netdefs_of_type("vrfs")
 
     @property
-    def ovs_ports(self) -> NetDefinitionIterator:
-        return dict((nd.id, nd) for nd in NetDefinitionIterator(self, "_ovs-ports"))
+    def ovs_ports(self) -> Mapping[str, NetDefinition]:
+        return self._netdefs_of_type("_ovs-ports")
 
     @property
-    def nm_devices(self) -> NetDefinitionIterator:
-        return dict((nd.id, nd) for nd in NetDefinitionIterator(self, "nm-devices"))
+    def nm_devices(self) -> Mapping[str, NetDefinition]:
+        return self._netdefs_of_type("nm-devices")
@@ -0,0 +1,121 @@
+/*
+ * Copyright (C) 2026 Canonical, Ltd.
+ *
+ * This program is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation; version 3.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+#include <glib.h>
+
+#include "backends.h"
+#include "util-internal.h"
+#include "parse.h"
+#include "networkd.h"
+#include "nm.h"
+#include "openvswitch.h"
+#include "sriov.h"
+
+/**
+ * Generate the backend configuration for all netdefs of @np_state, replacing
+ * any previously generated configuration, like the netplan generator does.
+ * @np_state: the #NetplanState to generate the configuration for
+ * @rootdir: optional rootdir (@NULL means "/")
+ * @incremental: only write or remove the files whose contents changed
+ * @manifest_path: optional path to write a JSON manifest of the added, changed
+ *                 and removed files to, "-" means stdout. Implies @incremental.
+ * @any_networkd: optional location to store whether any systemd-networkd
+ *                configuration was written
+ * Failures to write the files are reported as @error, instead of exiting the
+ * program like the file writing helpers do otherwise.
+ */
+gboolean
+_netplan_state_generate(
+        const NetplanState* np_state,
+        const char* rootdir,
+        gboolean incremental,
+        const char* manifest_path,
+        gboolean* any_networkd,
+        GError** error)
+{
+    gboolean networkd_written = FALSE;
+    gboolean nm_written = FALSE;
+    gboolean ret = FALSE;
+
+    /* In incremental mode the cleanup only marks files for removal, they are
+     * removed at the end, unless they got generated again. */
+    if (manifest_path)
+        incremental = TRUE;
+    if (incremental)
+        _netplan_generated_files_track_begin();
+    /* Report failures to write files as error, instead of exiting the program */
+    _netplan_file_errors_collect_begin();
+
+    /* Clean up generated config from previous runs */
+    netplan_networkd_cleanup(rootdir);
+    netplan_nm_cleanup(rootdir);
+    netplan_ovs_cleanup(rootdir);
+    netplan_sriov_cleanup(rootdir);
+
+    /* Generate backend specific configuration files from merged data. */
+    if (!netplan_state_finish_ovs_write(np_state, rootdir, error)) // OVS cleanup unit is always written
+        goto cleanup; // LCOV_EXCL_LINE
+    if (np_state->netdefs) {
+        g_debug("Generating output files..");
+        for (GList* iterator = np_state->netdefs_ordered; iterator; iterator = iterator->next) {
+            NetplanNetDefinition* def = (NetplanNetDefinition*) iterator->data;
+            gboolean has_been_written = FALSE;
+            if (incremental)
+                _netplan_generated_files_set_netdef(def->id);
+            if (!netplan_netdef_write_networkd(np_state, def, rootdir, &has_been_written, error))
+                goto cleanup;
+            networkd_written = networkd_written || has_been_written;
+
+            if (!netplan_netdef_write_ovs(np_state, def, rootdir, &has_been_written, error))
+                goto cleanup;
+            if (!netplan_netdef_write_nm(np_state, def, rootdir, &has_been_written, error))
+                goto cleanup;
+            nm_written = nm_written || has_been_written;
+            if (!_netplan_file_errors_check(error))
+                goto cleanup;
+        }
+        if (incremental)
+            _netplan_generated_files_set_netdef(NULL);
+
+        if (!netplan_state_finish_nm_write(np_state, rootdir, error))
+            goto cleanup; // LCOV_EXCL_LINE
+        if (!netplan_state_finish_sriov_write(np_state, rootdir, error))
+            goto cleanup;
+    }
+
+    /* Disable /usr/lib/NetworkManager/conf.d/10-globally-managed-devices.conf
+     * (which restricts NM to wifi and wwan) if "renderer: NetworkManager" is used anywhere */
+    if (netplan_state_get_backend(np_state) == NETPLAN_BACKEND_NM || nm_written)
+        g_string_free_to_file(g_string_new(NULL), rootdir, "/run/NetworkManager/conf.d/10-globally-managed-devices.conf", NULL);
+    if (!_netplan_file_errors_check(error))
+        goto cleanup;
+
+    ret = TRUE;
+
+cleanup:
+    if (incremental) {
+        if (ret)
+            ret = _netplan_generated_files_track_finish(rootdir, manifest_path, error);
+        else
+            /* Leave the stale files of the previous run in place */
+            _netplan_generated_files_track_abort();
+    }
+    if (!_netplan_file_errors_collect_end(error))
+        ret = FALSE;
+    if (any_networkd)
+        *any_networkd = networkd_written;
+    return ret;
+}
@@ -0,0 +1,29 @@
+/*
+ * Copyright (C) 2023 Canonical, Ltd.
+ *
+ * This program is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation; version 3.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+#pragma once
+
+#include "netplan.h"
+#include <glib.h>
+
+NETPLAN_INTERNAL gboolean
+_netplan_state_generate(
+        const NetplanState* np_state,
+        const char* rootdir,
+        gboolean incremental,
+        const char* manifest_path,
+        gboolean* any_networkd,
+        GError** error);
@@ -30,22 +30,22 @@
 #include "util-internal.h"
 #include "parse.h"
 #include "names.h"
-#include "networkd.h"
-#include "nm.h"
-#include "openvswitch.h"
-#include "sriov.h"
+#include "backends.h"
 #include "netplan.h"
 
 static gchar* rootdir;
 static gchar** files;
 static gboolean any_networkd = FALSE;
-static gboolean any_nm = FALSE;
 static gchar* mapping_iface;
+static gboolean incremental = FALSE;
+static gchar* manifest_path;
 
 static GOptionEntry options[] = {
     {"root-dir", 'r', 0, G_OPTION_ARG_FILENAME, &rootdir, "Search for and generate configuration files in this root directory instead of /", NULL},
     {G_OPTION_REMAINING, 0, 0, G_OPTION_ARG_FILENAME_ARRAY, &files, "Read configuration from this/these file(s) instead of /etc/netplan/*.yaml", "[config file ..]"},
     {"mapping", 0, 0, G_OPTION_ARG_STRING, &mapping_iface, "Only show the device to backend mapping for the specified interface.", NULL},
+    {"incremental", 0, 0, G_OPTION_ARG_NONE, &incremental, "Only write or remove the generated files whose contents changed.", NULL},
+    {"manifest", 0, 0, G_OPTION_ARG_FILENAME, &manifest_path, "Write a JSON manifest of the added, changed and removed files to this file ('-' for stdout). Implies --incremental.", NULL},
     {NULL}
 };
 
@@ -260,29 +260,8 @@ int main(int argc, char** argv)
         goto cleanup;
     }
 
-    /* Clean up generated config from previous runs */
-    netplan_networkd_cleanup(rootdir);
-    netplan_nm_cleanup(rootdir);
-    netplan_ovs_cleanup(rootdir);
-    netplan_sriov_cleanup(rootdir);
-
-    /* Generate backend specific configuration files from merged data. */
-    CHECK_CALL(netplan_state_finish_ovs_write(np_state, rootdir, &error)); // OVS cleanup unit is always written
+    CHECK_CALL(_netplan_state_generate(np_state, rootdir, incremental, manifest_path, &any_networkd, &error));
     if (np_state->netdefs) {
-        g_debug("Generating output files..");
-        for (GList* iterator = np_state->netdefs_ordered; iterator; iterator = iterator->next) {
-            NetplanNetDefinition* def = (NetplanNetDefinition*) iterator->data;
-            gboolean has_been_written = FALSE;
-            CHECK_CALL(netplan_netdef_write_networkd(np_state, def, rootdir, &has_been_written, &error));
-            any_networkd = any_networkd || has_been_written;
-
-            CHECK_CALL(netplan_netdef_write_ovs(np_state, def, rootdir, &has_been_written, &error));
-            CHECK_CALL(netplan_netdef_write_nm(np_state, def, rootdir, &has_been_written, &error));
-            any_nm = any_nm || has_been_written;
-        }
-
-        CHECK_CALL(netplan_state_finish_nm_write(np_state, rootdir, &error));
-        CHECK_CALL(netplan_state_finish_sriov_write(np_state, rootdir, &error));
         /* We may have written .rules & .link files, thus we must
          * invalidate udevd cache of its config as by default it only
          * invalidates cache at most every 3 seconds. Not sure if this
@@ -292,11 +271,6 @@ int main(int argc, char** argv)
         reload_udevd();
     }
 
-    /* Disable /usr/lib/NetworkManager/conf.d/10-globally-managed-devices.conf
-     * (which restricts NM to wifi and wwan) if "renderer: NetworkManager" is used anywhere */
-    if (netplan_state_get_backend(np_state) == NETPLAN_BACKEND_NM || any_nm)
-        g_string_free_to_file(g_string_new(NULL), rootdir, "/run/NetworkManager/conf.d/10-globally-managed-devices.conf", NULL);
-
     if (called_as_generator) {
         /* Ensure networkd starts if we have any configuration for it */
         if (any_networkd)
@@ -21,6 +21,7 @@
 #include <fcntl.h>
 #include <unistd.h>
 #include <errno.h>
+#include <sys/mman.h>
 
 #include "netplan.h"
 #include "parse.h"
@@ -1195,6 +1196,232 @@ netplan_state_dump_yaml(const NetplanState* np_state, int out_fd, GError** error
     return netplan_netdef_list_write_yaml(np_state, np_state->netdefs_ordered, out_fd, NULL, TRUE, error);
 }
 
+static void
+json_write_string(FILE* out, const char* value, size_t len)
+{
+    fputc('"', out);
+    for (size_t i = 0; i < len; i++) {
+        unsigned char c = value[i];
+        switch (c) {
+            case '"': fputs("\\\"", out); break;
+            case '\\': fputs("\\\\", out); break;
+            case '\n': fputs("\\n", out); break;
+            case '\r': fputs("\\r", out); break;
+            case '\t': fputs("\\t", out); break;
+            default:
+                if (c < 0x20)
+                    fprintf(out, "\\u%04x", c);
+                else
+                    fputc(c, out);
+        }
+    }
+    fputc('"', out);
+}
+
+static gboolean
+json_is_number(const char* value)
+{
+    const char* p = value;
+    if (*p == '-')
+        p++;
+    if (*p == '0')
+        p++;
+    else if (g_ascii_isdigit(*p))
+        while (g_ascii_isdigit(*p)) p++;
+    else
+        return FALSE;
+    if (*p == '.') {
+        p++;
+        if (!g_ascii_isdigit(*p))
+            return FALSE;
+        while (g_ascii_isdigit(*p)) p++;
+    }
+    if (*p == 'e' || *p == 'E') {
+        p++;
+        if (*p == '+' || *p == '-')
+            p++;
+        if (!g_ascii_isdigit(*p))
+            return FALSE;
+        while (g_ascii_isdigit(*p)) p++;
+    }
+    return *p == '\0';
+}
+
+/*
+ * Write a YAML scalar as JSON value. Plain scalars are resolved along the
+ * lines of the YAML 1.2 JSON schema (null, booleans and numbers), all other
+ * scalars and mapping keys are strings.
+ */
+static void
+json_write_scalar(FILE* out, const yaml_event_t* event, gboolean is_key)
+{
+    static const char* const nulls[] = {"", "~", "null", "Null", "NULL", NULL};
+    static const char* const trues[] = {"true", "True", "TRUE", NULL};
+    static const char* const falses[] = {"false", "False", "FALSE", NULL};
+    const char* value = (const char*)event->data.scalar.value;
+
+    if (!is_key && event->data.scalar.style == YAML_PLAIN_SCALAR_STYLE) {
+        if (g_strv_contains(nulls, value))
+            fputs("null", out);
+        else if (g_strv_contains(trues, value))
+            fputs("true", out);
+        else if (g_strv_contains(falses, value))
+            fputs("false", out);
+        else if (json_is_number(value))
+            fputs(value, out);
+        else
+            json_write_string(out, value, event->data.scalar.length);
+        return;
+    }
+    json_write_string(out, value, event->data.scalar.length);
+}
+
+/*
+ * Convert the YAML node starting with @event into JSON, consuming its
+ * events from @parser. Returns FALSE on parser errors and on YAML features
+ * that netplan's emitter does not produce (aliases, complex keys).
+ */
+static gboolean
+json_write_node(yaml_parser_t* parser, const yaml_event_t* event, FILE* out)
+{
+    yaml_event_t child;
+    gboolean ret = TRUE;
+    gboolean first = TRUE;
+
+    switch (event->type) {
+        case YAML_SCALAR_EVENT:
+            json_write_scalar(out, event, FALSE);
+            return TRUE;
+        case YAML_SEQUENCE_START_EVENT:
+            fputc('[', out);
+            while (ret) {
+                if (!yaml_parser_parse(parser, &child))
+                    return FALSE; // LCOV_EXCL_LINE
+                if (child.type == YAML_SEQUENCE_END_EVENT) {
+                    yaml_event_delete(&child);
+                    break;
+                }
+                if (!first)
+                    fputc(',', out);
+                first = FALSE;
+                ret = json_write_node(parser, &child, out);
+                yaml_event_delete(&child);
+            }
+            fputc(']', out);
+            return ret;
+        case YAML_MAPPING_START_EVENT:
+            fputc('{', out);
+            while (ret) {
+                if (!yaml_parser_parse(parser, &child))
+                    return FALSE; // LCOV_EXCL_LINE
+                if (child.type == YAML_MAPPING_END_EVENT) {
+                    yaml_event_delete(&child);
+                    break;
+                }
+                if (child.type != YAML_SCALAR_EVENT) {
+                    yaml_event_delete(&child); // LCOV_EXCL_LINE
+                    return FALSE; // LCOV_EXCL_LINE
+                }
+                if (!first)
+                    fputc(',', out);
+                first = FALSE;
+                json_write_scalar(out, &child, TRUE);
+                yaml_event_delete(&child);
+                fputc(':', out);
+                if (!yaml_parser_parse(parser, &child))
+                    return FALSE; // LCOV_EXCL_LINE
+                ret = json_write_node(parser, &child, out);
+                yaml_event_delete(&child);
+            }
+            fputc('}', out);
+            return ret;
+        default:
+            return FALSE; // LCOV_EXCL_LINE
+    }
+}
+
+/**
+ * Serialize the whole state into @out_fd as a single JSON object, of the
+ * same structure as the YAML written by netplan_state_dump_yaml(). This
+ * allows the bindings to load all of it in a single call and pass, instead
+ * of querying each setting of each netdef on its own.
+ */
+gboolean
+_netplan_state_dump_json(const NetplanState* np_state, int out_fd, GError** error)
+{
+    gboolean ret = FALSE;
+    gboolean found = FALSE;
+    yaml_parser_t parser;
+    yaml_event_t event;
+    yaml_event_type_t type;
+    FILE* input = NULL;
+    FILE* output = NULL;
+    int out_dup = -1;
+    int yaml_fd = memfd_create("netplan_state.yaml", MFD_CLOEXEC);
+
+    if (yaml_fd < 0)
+        goto file_error; // LCOV_EXCL_LINE
+    if (!netplan_state_dump_yaml(np_state, yaml_fd, error)) {
+        close(yaml_fd); // LCOV_EXCL_LINE
+        return FALSE; // LCOV_EXCL_LINE
+    }
+    input = fdopen(yaml_fd, "r");
+    if (!input) {
+        close(yaml_fd); // LCOV_EXCL_LINE
+        goto file_error; // LCOV_EXCL_LINE
+    }
+    if (fseek(input, 0, SEEK_SET) < 0)
+        goto file_error; // LCOV_EXCL_LINE
+    out_dup = dup(out_fd);
+    if (out_dup < 0)
+        goto file_error; // LCOV_EXCL_LINE
+    output = fdopen(out_dup, "w");
+    if (!output) {
+        g_set_error(error, NETPLAN_FILE_ERROR, errno, "%m");
+        close(out_dup);
+        fclose(input);
+        return FALSE;
+    }
+
+    yaml_parser_initialize(&parser);
+    yaml_parser_set_input_file(&parser, input);
+    do {
+        if (!yaml_parser_parse(&parser, &event))
+            goto parser_error; // LCOV_EXCL_LINE
+        type = event.type;
+        if (type == YAML_MAPPING_START_EVENT || type == YAML_SEQUENCE_START_EVENT || type == YAML_SCALAR_EVENT) {
+            found = TRUE;
+            if (!json_write_node(&parser, &event, output)) {
+                yaml_event_delete(&event); // LCOV_EXCL_LINE
+                goto parser_error; // LCOV_EXCL_LINE
+            }
+        }
+        yaml_event_delete(&event);
+    } while (type != YAML_STREAM_END_EVENT);
+    /* An empty state does not produce any YAML document */
+    if (!found)
+        fputs("{}", output);
+    ret = TRUE;
+    goto cleanup;
+
+parser_error:
+    // LCOV_EXCL_START
+    g_set_error(error, NETPLAN_FORMAT_ERROR, NETPLAN_ERROR_FORMAT_INVALID_YAML,
+                "Error converting YAML to JSON: %s", parser.problem ? parser.problem : "unsupported YAML");
+    // LCOV_EXCL_STOP
+cleanup:
+    yaml_parser_delete(&parser);
+    fclose(input);
+    fclose(output);
+    return ret;
+
+file_error:
+    g_set_error(error, NETPLAN_FILE_ERROR, errno, "%m");
+    if (input)
+        fclose(input);
+    return FALSE;
+}
+
 /**
  * Regenerate the YAML configuration files from a given state. Any state that
  * hasn't an associated filepath will use the default_filename output in the
@@ -306,7 +306,7 @@ write_regdom(const NetplanNetDefinition* def, const char* rootdir, GError** erro
 
     g_string_free_to_file(s, rootdir, path, NULL);
     safe_mkdir_p_dir(link);
-    if (symlink(path, link) < 0 && errno != EEXIST) {
+    if (netplan_symlink(path, link) < 0 && errno != EEXIST) {
         // LCOV_EXCL_START
         g_set_error(error, NETPLAN_FILE_ERROR, errno, "failed to create enablement symlink: %m\n");
         return FALSE;
@@ -1347,7 +1347,7 @@ netplan_netdef_write_networkd(
         g_debug("Creating wpa_supplicant service enablement link %s", link);
         safe_mkdir_p_dir(link);
 
-        if (symlink(slink, link) < 0 && errno != EEXIST) {
+        if (netplan_symlink(slink, link) < 0 && errno != EEXIST) {
             // LCOV_EXCL_START
             g_set_error(error, NETPLAN_FILE_ERROR, errno, "failed to create enablement symlink: %m\n");
             return FALSE;
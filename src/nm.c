@@ -611,7 +611,8 @@ write_nm_conf_access_point(const NetplanNetDefinition* def, const char* rootdir,
 {
     g_autoptr(GKeyFile) kf = NULL;
     g_autofree gchar* conf_path = NULL;
-    g_autofree gchar* full_path = NULL;
+    g_autofree gchar* kf_data = NULL;
+    gsize kf_len = 0;
     g_autofree gchar* nd_nm_id = NULL;
     const gchar* nm_type = NULL;
     gchar* tmp_key = NULL;
@@ -961,11 +962,9 @@ write_nm_conf_access_point(const NetplanNetDefinition* def, const char* rootdir,
     }
 
     /* NM connection files might contain secrets, and NM insists on tight permissions */
-    full_path = g_strjoin(G_DIR_SEPARATOR_S, rootdir ?: "", conf_path, NULL);
+    kf_data = g_key_file_to_data(kf, &kf_len, NULL);
     orig_umask = umask(077);
-    safe_mkdir_p_dir(full_path);
-    if (!g_key_file_save_to_file(kf, full_path, error))
-        return FALSE; // LCOV_EXCL_LINE
+    g_string_free_to_file(g_string_new_len(kf_data, kf_len), rootdir, conf_path, NULL);
     umask(orig_umask);
     return TRUE;
 }
@@ -1145,10 +1144,8 @@ netplan_state_finish_nm_write(
 gboolean
 netplan_nm_cleanup(const char* rootdir)
 {
-    g_autofree char* confpath = g_strjoin(NULL, rootdir ?: "", "/run/NetworkManager/conf.d/netplan.conf", NULL);
-    g_autofree char* global_manage_path = g_strjoin(NULL, rootdir ?: "", "/run/NetworkManager/conf.d/10-globally-managed-devices.conf", NULL);
-    unlink(confpath);
-    unlink(global_manage_path);
+    unlink_glob(rootdir, "/run/NetworkManager/conf.d/netplan.conf");
+    unlink_glob(rootdir, "/run/NetworkManager/conf.d/10-globally-managed-devices.conf");
     unlink_glob(rootdir, "/run/NetworkManager/system-connections/netplan-*");
     return TRUE;
 }
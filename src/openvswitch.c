@@ -65,7 +65,7 @@ write_ovs_systemd_unit(const char* id, const GString* cmds, const char* rootdir,
     g_string_free_to_file(s, rootdir, path, NULL);
 
     safe_mkdir_p_dir(link);
-    if (symlink(path, link) < 0 && errno != EEXIST) {
+    if (netplan_symlink(path, link) < 0 && errno != EEXIST) {
         // LCOV_EXCL_START
         g_set_error(error, NETPLAN_FILE_ERROR, errno, "failed to create enablement symlink: %m\n");
         return FALSE;
@@ -51,7 +51,7 @@ write_sriov_rebind_systemd_unit(const GString* pfs, const char* rootdir, GError*
     g_string_free_to_file(s, rootdir, path, NULL);
 
     safe_mkdir_p_dir(link);
-    if (symlink(path, link) < 0 && errno != EEXIST) {
+    if (netplan_symlink(path, link) < 0 && errno != EEXIST) {
         // LCOV_EXCL_START
         g_set_error(error, NETPLAN_FILE_ERROR, errno,
                     "failed to create enablement symlink: %m\n");
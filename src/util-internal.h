@@ -37,12 +37,36 @@ wifi_frequency_5;
 NETPLAN_ABI void
 safe_mkdir_p_dir(const char* file_path);
 
+NETPLAN_INTERNAL void
+_netplan_file_errors_collect_begin(void);
+
+NETPLAN_INTERNAL gboolean
+_netplan_file_errors_check(GError** error);
+
+NETPLAN_INTERNAL gboolean
+_netplan_file_errors_collect_end(GError** error);
+
 NETPLAN_INTERNAL void
 g_string_free_to_file(GString* s, const char* rootdir, const char* path, const char* suffix);
 
 NETPLAN_INTERNAL void
 unlink_glob(const char* rootdir, const char* _glob);
 
+NETPLAN_INTERNAL int
+netplan_symlink(const char* target, const char* link);
+
+NETPLAN_INTERNAL void
+_netplan_generated_files_track_begin(void);
+
+NETPLAN_INTERNAL void
+_netplan_generated_files_set_netdef(const char* netdef_id);
+
+NETPLAN_INTERNAL void
+_netplan_generated_files_track_abort(void);
+
+NETPLAN_INTERNAL gboolean
+_netplan_generated_files_track_finish(const char* rootdir, const char* manifest_path, GError** error);
+
 NETPLAN_INTERNAL int
 find_yaml_glob(const char* rootdir, glob_t* out_glob);
 
@@ -123,6 +147,18 @@ _netplan_netdef_get_vlan_id(const NetplanNetDefinition* netdef);
 NETPLAN_INTERNAL gboolean
 _netplan_netdef_is_trivial_compound_itf(const NetplanNetDefinition* netdef);
 
+NETPLAN_INTERNAL gboolean
+_netplan_state_dump_json(const NetplanState* np_state, int out_fd, NetplanError** error);
+
+NETPLAN_INTERNAL size_t
+_netplan_netdefs_match_interfaces(
+        const NetplanNetDefinition** netdefs, size_t n_netdefs,
+        const char** names, const char** macs, const char** driver_names, size_t n_ifaces,
+        uint8_t* out_matches);
+
+NETPLAN_INTERNAL const char*
+_netplan_version(void);
+
 NETPLAN_INTERNAL gboolean //FIXME: avoid exporting private symbol
 is_route_present(const NetplanNetDefinition* netdef, const NetplanIPRoute* route);
 
@@ -22,6 +22,7 @@
 #include <errno.h>
 #include <string.h>
 #include <sys/mman.h>
+#include <sys/stat.h>
 
 #include <glib.h>
 #include <glib/gprintf.h>
@@ -44,23 +45,185 @@ wifi_frequency_5;
 const gchar* FALLBACK_FILENAME = "70-netplan-set.yaml";
 
 typedef struct netplan_state_iterator RealStateIter;
+/* Errors of the file writing helpers, which are collected instead of exiting
+ * the program while generating from within the library, see
+ * _netplan_file_errors_collect_begin() */
+static struct {
+    gboolean active;
+    GError* error;
+} file_errors;
+
+/* Exit the program with the message of @error, or keep it to be reported by
+ * _netplan_file_errors_collect_end(), if collecting. Takes ownership of @error. */
+static void
+file_error_report(GError* error)
+{
+    if (!file_errors.active) {
+        g_fprintf(stderr, "ERROR: %s\n", error->message);
+        exit(1);
+    }
+    /* Only the first error is reported, the others are likely a consequence */
+    if (file_errors.error)
+        g_error_free(error);
+    else
+        file_errors.error = error;
+}
+
 /**
- * Create the parent directories of given file path. Exit program on failure.
+ * Collect the errors of safe_mkdir_p_dir() and g_string_free_to_file()
+ * from now on, instead of exiting the program on the first one.
  */
 void
-safe_mkdir_p_dir(const char* file_path)
+_netplan_file_errors_collect_begin(void)
+{
+    g_clear_error(&file_errors.error);
+    file_errors.active = TRUE;
+}
+
+/**
+ * Check for errors of the file writing helpers since
+ * _netplan_file_errors_collect_begin(), without ending the collection.
+ * Returns %FALSE and sets @error to the first one, if any occurred. It
+ * replaces an error already set, which is likely a consequence of it (e.g. a
+ * failure to create a symlink to a file which could not be written).
+ */
+gboolean
+_netplan_file_errors_check(GError** error)
+{
+    if (file_errors.error) {
+        if (error)
+            g_clear_error(error);
+        g_propagate_error(error, file_errors.error);
+        file_errors.error = NULL;
+        return FALSE;
+    }
+    return TRUE;
+}
+
+/**
+ * Stop collecting the errors of the file writing helpers.
+ * Returns %FALSE and sets @error to the first one, if any occurred.
+ */
+gboolean
+_netplan_file_errors_collect_end(GError** error)
+{
+    file_errors.active = FALSE;
+    return _netplan_file_errors_check(error);
+}
+
+static gboolean
+mkdir_p_dir(const char* file_path)
 {
     g_autofree char* dir = g_path_get_dirname(file_path);
 
     if (g_mkdir_with_parents(dir, 0755) < 0) {
-        g_fprintf(stderr, "ERROR: cannot create directory %s: %m\n", dir);
-        exit(1);
+        file_error_report(g_error_new(NETPLAN_FILE_ERROR, errno, "cannot create directory %s: %m", dir));
+        return FALSE;
+    }
+    return TRUE;
+}
+
+/**
+ * Create the parent directories of given file path. Exit program on failure,
+ * unless collecting errors, see _netplan_file_errors_collect_begin().
+ */
+void
+safe_mkdir_p_dir(const char* file_path)
+{
+    mkdir_p_dir(file_path);
+}
+
+/* Book-keeping of generated files for the "write only if changed" mode,
+ * see _netplan_generated_files_track_begin() */
+typedef enum {
+    GENERATED_FILE_ADDED,
+    GENERATED_FILE_CHANGED,
+    GENERATED_FILE_UNCHANGED,
+    GENERATED_FILE_REMOVED,
+} GeneratedFileStatus;
+
+typedef struct {
+    gchar* path;
+    gchar* netdef_id;
+    GeneratedFileStatus status;
+} GeneratedFile;
+
+static struct {
+    gboolean active;
+    gchar* current_netdef_id;
+    /* paths matched by unlink_glob(), removed unless written again */
+    GHashTable* stale;
+    /* path -> GeneratedFile */
+    GHashTable* files;
+} generated_files;
+
+static void
+generated_file_free(gpointer data)
+{
+    GeneratedFile* file = data;
+    g_free(file->path);
+    g_free(file->netdef_id);
+    g_free(file);
+}
+
+/* Collapse duplicated path separators, to be able to compare paths created
+ * with and without the rootdir prefix */
+static gchar*
+normalize_path(const char* path)
+{
+    GString* s = g_string_sized_new(strlen(path));
+    for (const char* c = path; *c; ++c) {
+        if (*c == '/' && s->len > 0 && s->str[s->len - 1] == '/')
+            continue;
+        g_string_append_c(s, *c);
+    }
+    return g_string_free(s, FALSE);
+}
+
+static void
+generated_file_record(const char* path, GeneratedFileStatus status)
+{
+    GeneratedFile* file = NULL;
+    g_autofree gchar* normalized = normalize_path(path);
+
+    file = g_hash_table_lookup(generated_files.files, normalized);
+    if (file) {
+        /* The same file was written multiple times during this run, what
+         * matters is the difference to its state before the run */
+        if (file->status == GENERATED_FILE_UNCHANGED)
+            file->status = status;
+        return;
     }
+    file = g_new0(GeneratedFile, 1);
+    file->path = g_strdup(normalized);
+    file->netdef_id = g_strdup(generated_files.current_netdef_id);
+    file->status = status;
+    g_hash_table_insert(generated_files.files, g_strdup(normalized), file);
+}
+
+static gboolean
+file_has_contents(const char* path, const char* contents, gsize len)
+{
+    g_autofree gchar* old_contents = NULL;
+    gsize old_len = 0;
+    struct stat st;
+    mode_t mask = umask(0);
+    umask(mask);
+
+    /* g_file_set_contents() creates files with mode 0666, minus umask */
+    if (lstat(path, &st) < 0 || !S_ISREG(st.st_mode) || (st.st_mode & 0777) != (0666 & ~mask))
+        return FALSE;
+    if (!g_file_get_contents(path, &old_contents, &old_len, NULL))
+        return FALSE; // LCOV_EXCL_LINE
+    return old_len == len && memcmp(old_contents, contents, len) == 0;
 }
 
 /**
  * Write a GString to a file and free it. Create necessary parent directories
- * and exit with error message on error.
+ * and exit with error message on error, unless collecting errors, see
+ * _netplan_file_errors_collect_begin().
+ * In "write only if changed" mode, the file is left untouched (keeping its
+ * mtime) if it already has the same contents.
  * @s: #GString whose contents to write. Will be fully freed afterwards.
  * @rootdir: optional rootdir (@NULL means "/")
  * @path: path of file to write (@rootdir will be prepended)
@@ -70,25 +233,73 @@ void g_string_free_to_file(GString* s, const char* rootdir, const char* path, co
 {
     g_autofree char* full_path = NULL;
     g_autofree char* path_suffix = NULL;
+    gsize len = s->len;
     g_autofree char* contents = g_string_free(s, FALSE);
+    GeneratedFileStatus status = GENERATED_FILE_ADDED;
     GError* error = NULL;
 
     path_suffix = g_strjoin(NULL, path, suffix, NULL);
     full_path = g_build_path(G_DIR_SEPARATOR_S, rootdir ?: G_DIR_SEPARATOR_S, path_suffix, NULL);
-    safe_mkdir_p_dir(full_path);
+    if (generated_files.active) {
+        if (file_has_contents(full_path, contents, len)) {
+            generated_file_record(full_path, GENERATED_FILE_UNCHANGED);
+            return;
+        }
+        if (g_file_test(full_path, G_FILE_TEST_EXISTS))
+            status = GENERATED_FILE_CHANGED;
+    }
+    if (!mkdir_p_dir(full_path))
+        return;
     if (!g_file_set_contents(full_path, contents, -1, &error)) {
         /* the mkdir() just succeeded, there is no sensible
          * method to test this without root privileges, bind mounts, and
          * simulating ENOSPC */
         // LCOV_EXCL_START
-        g_fprintf(stderr, "ERROR: cannot create file %s: %s\n", path, error->message);
-        exit(1);
+        file_error_report(g_error_new(NETPLAN_FILE_ERROR, error->code, "cannot create file %s: %s",
+                                      path, error->message));
+        g_error_free(error);
+        return;
         // LCOV_EXCL_STOP
     }
+    if (generated_files.active)
+        generated_file_record(full_path, status);
+}
+
+/**
+ * Create a symlink @link pointing to @target, see symlink(2).
+ * In "write only if changed" mode, an existing @link is kept if it already
+ * points to @target, or replaced otherwise.
+ */
+int
+netplan_symlink(const char* target, const char* link)
+{
+    g_autofree gchar* old_target = NULL;
+    GeneratedFileStatus status = GENERATED_FILE_ADDED;
+    struct stat st;
+    int ret;
+
+    if (!generated_files.active)
+        return symlink(target, link);
+
+    if (lstat(link, &st) == 0) {
+        old_target = g_file_read_link(link, NULL);
+        if (g_strcmp0(old_target, target) == 0) {
+            generated_file_record(link, GENERATED_FILE_UNCHANGED);
+            return 0;
+        }
+        status = GENERATED_FILE_CHANGED;
+        unlink(link);
+    }
+    ret = symlink(target, link);
+    if (ret == 0)
+        generated_file_record(link, status);
+    return ret;
 }
 
 /**
  * Remove all files matching given glob.
+ * In "write only if changed" mode, the files are only removed by
+ * _netplan_generated_files_track_finish(), if they were not written again.
  */
 void
 unlink_glob(const char* rootdir, const char* _glob)
@@ -105,11 +316,270 @@ unlink_glob(const char* rootdir, const char* _glob)
         // LCOV_EXCL_STOP
     }
 
-    for (size_t i = 0; i < gl.gl_pathc; ++i)
-        unlink(gl.gl_pathv[i]);
+    for (size_t i = 0; i < gl.gl_pathc; ++i) {
+        if (generated_files.active)
+            g_hash_table_add(generated_files.stale, normalize_path(gl.gl_pathv[i]));
+        else
+            unlink(gl.gl_pathv[i]);
+    }
     globfree(&gl);
 }
 
+/**
+ * Enable the "write only if changed" mode: generated files are only written
+ * if their contents differ from what is on disk already and files matched by
+ * unlink_glob() are only removed if they were not generated again. Finish
+ * the mode using _netplan_generated_files_track_finish().
+ */
+void
+_netplan_generated_files_track_begin(void)
+{
+    g_assert(!generated_files.active);
+    generated_files.active = TRUE;
+    generated_files.stale = g_hash_table_new_full(g_str_hash, g_str_equal, g_free, NULL);
+    generated_files.files = g_hash_table_new_full(g_str_hash, g_str_equal, g_free, generated_file_free);
+}
+
+/**
+ * Leave the "write only if changed" mode, without removing any files.
+ */
+void
+_netplan_generated_files_track_abort(void)
+{
+    g_clear_pointer(&generated_files.current_netdef_id, g_free);
+    g_clear_pointer(&generated_files.stale, g_hash_table_destroy);
+    g_clear_pointer(&generated_files.files, g_hash_table_destroy);
+    generated_files.active = FALSE;
+}
+
+/**
+ * Associate all files generated from now on with the netdef of the given ID,
+ * or with no netdef if @netdef_id is %NULL.
+ */
+void
+_netplan_generated_files_set_netdef(const char* netdef_id)
+{
+    g_free(generated_files.current_netdef_id);
+    generated_files.current_netdef_id = g_strdup(netdef_id);
+}
+
+static gchar*
+systemd_unescape(const char* string)
+{
+    GString* s = g_string_new(NULL);
+    for (const char* c = string; *c; ++c) {
+        if (c[0] == '\\' && c[1] == 'x' && g_ascii_isxdigit(c[2]) && g_ascii_isxdigit(c[3])) {
+            g_string_append_c(s, (gchar) (g_ascii_xdigit_value(c[2]) << 4 | g_ascii_xdigit_value(c[3])));
+            c += 3;
+        } else
+            g_string_append_c(s, *c == '-' ? '/' : *c);
+    }
+    return g_string_free(s, FALSE);
+}
+
+static gchar*
+strip_affixes(const char* string, const char* prefix, const char* suffix)
+{
+    gsize len = strlen(string);
+    if (!g_str_has_prefix(string, prefix) || !g_str_has_suffix(string, suffix)
+        || len <= strlen(prefix) + strlen(suffix))
+        return NULL;
+    return g_strndup(string + strlen(prefix), len - strlen(prefix) - strlen(suffix));
+}
+
+/* Find the netdef ID of a generated file that is about to be removed, based
+ * on the naming scheme of the backends */
+static gchar*
+generated_file_guess_netdef_id(const char* path)
+{
+    g_autofree gchar* name = g_path_get_basename(path);
+    gchar* id = NULL;
+
+    if ((id = strip_affixes(name, "10-netplan-", ".network"))
+        || (id = strip_affixes(name, "10-netplan-", ".netdev"))
+        || (id = strip_affixes(name, "10-netplan-", ".link"))
+        || (id = strip_affixes(name, "99-netplan-", ".rules"))
+        || (id = strip_affixes(name, "wpa-", ".conf")))
+        return id;
+    if ((id = strip_affixes(name, "netplan-wpa-", ".service"))) {
+        gchar* unescaped = systemd_unescape(id);
+        g_free(id);
+        return unescaped;
+    }
+    if (g_strcmp0(name, "netplan-ovs-cleanup.service") != 0
+        && (id = strip_affixes(name, "netplan-ovs-", ".service")))
+        return id;
+    if (g_str_has_suffix(name, ".nmconnection")) {
+        g_autoptr(GKeyFile) kf = g_key_file_new();
+        g_autofree gchar* ssid = NULL;
+        /* the netdef ID is always shorter than the path */
+        gsize size = strlen(path) + 1;
+        id = g_malloc0(size);
+        if (g_key_file_load_from_file(kf, path, G_KEY_FILE_NONE, NULL))
+            ssid = g_key_file_get_string(kf, "wifi", "ssid", NULL);
+        if (netplan_get_id_from_nm_filepath(path, ssid, id, size) > 0)
+            return id;
+        g_free(id);
+    }
+    return NULL;
+}
+
+static void
+json_append_string(GString* s, const char* string)
+{
+    g_string_append_c(s, '"');
+    for (const char* c = string; *c; ++c) {
+        if (*c == '"' || *c == '\\')
+            g_string_append_printf(s, "\\%c", *c);
+        else if ((guchar) *c < 0x20)
+            g_string_append_printf(s, "\\u%04x", (guchar) *c);
+        else
+            g_string_append_c(s, *c);
+    }
+    g_string_append_c(s, '"');
+}
+
+static gint
+generated_file_compare(gconstpointer a, gconstpointer b)
+{
+    const GeneratedFile* file_a = *(const GeneratedFile**) a;
+    const GeneratedFile* file_b = *(const GeneratedFile**) b;
+    gint ret = g_strcmp0(file_a->netdef_id, file_b->netdef_id);
+    return ret ? ret : g_strcmp0(file_a->path, file_b->path);
+}
+
+/* Append {"added": [...], "changed": [...], "removed": [...]} of the
+ * files[start:end] slice */
+static void
+manifest_append_changes(GString* s, GPtrArray* files, guint start, guint end, gsize rootdir_len)
+{
+    const char* keys[] = {"added", "changed", "removed"};
+    const GeneratedFileStatus statuses[] = {GENERATED_FILE_ADDED, GENERATED_FILE_CHANGED, GENERATED_FILE_REMOVED};
+
+    g_string_append(s, "{");
+    for (guint i = 0; i < G_N_ELEMENTS(keys); ++i) {
+        gboolean first = TRUE;
+        g_string_append_printf(s, "%s\"%s\": [", i ? ", " : "", keys[i]);
+        for (guint j = start; j < end; ++j) {
+            const GeneratedFile* file = g_ptr_array_index(files, j);
+            if (file->status != statuses[i])
+                continue;
+            if (!first)
+                g_string_append(s, ", ");
+            json_append_string(s, file->path + rootdir_len);
+            first = FALSE;
+        }
+        g_string_append(s, "]");
+    }
+    g_string_append(s, "}");
+}
+
+/**
+ * Write a JSON manifest of the generated files which were added, changed or
+ * removed, keyed by netdef ID, e.g.:
+ * {"global": {"added": [], "changed": ["/run/udev/rules.d/90-netplan.rules"], "removed": []},
+ *  "netdefs": {"eth0": {"added": ["/run/systemd/network/10-netplan-eth0.network"], ...}}}
+ * Files which are not related to a specific netdef are listed as "global".
+ */
+static gboolean
+write_generated_files_manifest(const char* rootdir, const char* manifest_path, GError** error)
+{
+    g_autoptr(GPtrArray) files = g_ptr_array_new();
+    g_autoptr(GString) s = g_string_new("{\"global\": ");
+    g_autofree gchar* root = normalize_path(rootdir ?: "");
+    gsize rootdir_len = strlen(root);
+    GHashTableIter iter;
+    gpointer value;
+    guint start = 0;
+    FILE* f = NULL;
+
+    /* Paths are relative to rootdir */
+    if (rootdir_len > 0 && root[rootdir_len - 1] == '/')
+        rootdir_len--;
+
+    g_hash_table_iter_init(&iter, generated_files.files);
+    while (g_hash_table_iter_next(&iter, NULL, &value))
+        if (((GeneratedFile*) value)->status != GENERATED_FILE_UNCHANGED)
+            g_ptr_array_add(files, value);
+    /* sorts the files without netdef (global) first */
+    g_ptr_array_sort(files, generated_file_compare);
+
+    while (start < files->len && !((GeneratedFile*) g_ptr_array_index(files, start))->netdef_id)
+        start++;
+    manifest_append_changes(s, files, 0, start, rootdir_len);
+
+    g_string_append(s, ", \"netdefs\": {");
+    while (start < files->len) {
+        const char* netdef_id = ((GeneratedFile*) g_ptr_array_index(files, start))->netdef_id;
+        guint end = start;
+        while (end < files->len && !g_strcmp0(((GeneratedFile*) g_ptr_array_index(files, end))->netdef_id, netdef_id))
+            end++;
+        if (s->str[s->len - 1] != '{')
+            g_string_append(s, ", ");
+        json_append_string(s, netdef_id);
+        g_string_append(s, ": ");
+        manifest_append_changes(s, files, start, end, rootdir_len);
+        start = end;
+    }
+    g_string_append(s, "}}\n");
+
+    if (g_strcmp0(manifest_path, "-") == 0) {
+        fputs(s->str, stdout);
+        return TRUE;
+    }
+    if (!mkdir_p_dir(manifest_path))
+        return _netplan_file_errors_check(error);
+    f = fopen(manifest_path, "w");
+    if (!f) {
+        g_set_error(error, NETPLAN_FILE_ERROR, errno, "Cannot write manifest %s: %m", manifest_path);
+        return FALSE;
+    }
+    if (fputs(s->str, f) == EOF) {
+        g_set_error(error, NETPLAN_FILE_ERROR, errno, "Cannot write manifest %s: %m", manifest_path);
+        fclose(f);
+        return FALSE;
+    }
+    if (fclose(f) == EOF) {
+        g_set_error(error, NETPLAN_FILE_ERROR, errno, "Cannot write manifest %s: %m", manifest_path);
+        return FALSE;
+    }
+    return TRUE;
+}
+
+/**
+ * Remove all the files matched by unlink_glob(), which were not generated
+ * again, and leave the "write only if changed" mode.
+ * @rootdir: optional rootdir (@NULL means "/")
+ * @manifest_path: optional path to write a JSON manifest of the added, changed
+ *                 and removed files to, "-" means stdout
+ */
+gboolean
+_netplan_generated_files_track_finish(const char* rootdir, const char* manifest_path, GError** error)
+{
+    GHashTableIter iter;
+    gpointer key;
+    gboolean ret = TRUE;
+
+    g_assert(generated_files.active);
+    g_hash_table_iter_init(&iter, generated_files.stale);
+    while (g_hash_table_iter_next(&iter, &key, NULL)) {
+        const char* path = key;
+        if (g_hash_table_contains(generated_files.files, path))
+            continue;
+        g_free(generated_files.current_netdef_id);
+        generated_files.current_netdef_id = generated_file_guess_netdef_id(path);
+        unlink(path);
+        generated_file_record(path, GENERATED_FILE_REMOVED);
+    }
+    g_clear_pointer(&generated_files.current_netdef_id, g_free);
+
+    if (manifest_path)
+        ret = write_generated_files_manifest(rootdir, manifest_path, error);
+
+    _netplan_generated_files_track_abort();
+    return ret;
+}
+
 /**
  * Return a glob of all *.yaml files in /{lib,etc,run}/netplan/ (in this order)
  */
@@ -632,6 +1102,8 @@ netplan_get_id_from_nm_filepath(const char* filename, const char* ssid, char* ou
     start = pos + strlen(nm_prefix);
     id_len = end - start;
 
+    if (!out_buffer)
+        return id_len + 1;
     if (out_buf_size < id_len + 1)
         return NETPLAN_BUFFER_TOO_SMALL;
 
@@ -965,8 +1437,13 @@ complex_object_is_dirty(const NetplanNetDefinition* def, const void* obj, size_t
  * except if the input string is NULL. Notably, if the buffer is too small its
  * content will NOT be NUL-terminated.
  *
+ * If the output buffer is NULL, nothing is copied and the size of the string,
+ * including the final NUL character, is returned. This allows the caller to
+ * allocate a buffer of the right size, instead of growing it and retrying.
+ *
  * @input: the input string
- * @out_buffer: a pointer to a buffer into which we want to copy the string
+ * @out_buffer: a pointer to a buffer into which we want to copy the string,
+ *              or NULL to query the size of the string
  * @out_size: the size of the output buffer
  */
 ssize_t
@@ -974,6 +1451,8 @@ netplan_copy_string(const char* input, char* out_buffer, size_t out_size)
 {
     if (input == NULL)
         return 0; // LCOV_EXCL_LINE
+    if (out_buffer == NULL)
+        return strlen(input) + 1;
     char* end = stpncpy(out_buffer, input, out_size);
     // If it point to the first byte past the buffer, we don't have enough
     // space in the buffer.
@@ -983,41 +1462,150 @@ netplan_copy_string(const char* input, char* out_buffer, size_t out_size)
     return end - out_buffer + 1;
 }
 
-gboolean
-netplan_netdef_match_interface(const NetplanNetDefinition* netdef, const char* name, const char* mac, const char* driver_name)
+/* The match rules of a netdef, prepared to be checked against many interfaces */
+struct netdef_matcher {
+    const NetplanNetDefinition* netdef;
+    /* The only interface name this netdef can match, if its name is not a glob */
+    const char* literal_name;
+    char** drivers;
+};
+
+static void
+netdef_matcher_init(struct netdef_matcher* matcher, const NetplanNetDefinition* netdef)
+{
+    matcher->netdef = netdef;
+    matcher->literal_name = NULL;
+    matcher->drivers = NULL;
+
+    if (!netdef->has_match) {
+        matcher->literal_name = netdef->id;
+        return;
+    }
+    if (netdef->match.original_name && !strpbrk(netdef->match.original_name, "*?[\\"))
+        matcher->literal_name = netdef->match.original_name;
+    if (netdef->match.driver)
+        matcher->drivers = g_strsplit(netdef->match.driver, "\t", -1);
+}
+
+static void
+netdef_matcher_clear(struct netdef_matcher* matcher)
 {
+    g_clear_pointer(&matcher->drivers, g_strfreev);
+}
+
+/* Check an interface against the prepared match rules of a netdef. The MAC
+ * address and driver name might be NULL, if unknown. */
+static gboolean
+netdef_matcher_match(const struct netdef_matcher* matcher, const char* name, const char* mac, const char* driver_name)
+{
+    const NetplanNetDefinition* netdef = matcher->netdef;
+
     if (!netdef->has_match)
         return !g_strcmp0(name, netdef->id);
 
-    if (netdef->match.mac) {
+    if (netdef->match.mac && mac) {
         if (g_ascii_strcasecmp(netdef->match.mac, mac))
             return FALSE;
     }
 
     if (netdef->match.original_name) {
-        if (!name || fnmatch(netdef->match.original_name, name, 0))
+        if (!name)
+            return FALSE;
+        if (matcher->literal_name ? strcmp(matcher->literal_name, name) : fnmatch(netdef->match.original_name, name, 0))
             return FALSE;
     }
 
-    if (netdef->match.driver) {
-        gboolean matches_driver = FALSE;
-        char** tokens;
+    if (matcher->drivers) {
         if (!driver_name)
             return FALSE;
-        tokens = g_strsplit(netdef->match.driver, "\t", -1);
-        for (char** it = tokens; *it; it++) {
-            if (fnmatch(*it, driver_name, 0) == 0) {
-                matches_driver = TRUE;
-                break;
-            }
+        for (char** it = matcher->drivers; *it; it++) {
+            if (fnmatch(*it, driver_name, 0) == 0)
+                return TRUE;
         }
-        g_strfreev(tokens);
-        return matches_driver;
+        return FALSE;
     }
 
     return TRUE;
 }
 
+gboolean
+netplan_netdef_match_interface(const NetplanNetDefinition* netdef, const char* name, const char* mac, const char* driver_name)
+{
+    struct netdef_matcher matcher;
+    gboolean ret;
+
+    netdef_matcher_init(&matcher, netdef);
+    ret = netdef_matcher_match(&matcher, name, mac, driver_name);
+    netdef_matcher_clear(&matcher);
+    return ret;
+}
+
+/**
+ * Match a list of netdefs against a list of interfaces, in a single call.
+ *
+ * @netdefs: array of @n_netdefs netdefs
+ * @names: array of @n_ifaces (unique) interface names
+ * @macs: array of @n_ifaces interface MAC addresses, entries might be NULL
+ * @driver_names: array of @n_ifaces interface driver names, entries might be NULL
+ * @out_matches: a buffer of @n_netdefs * @n_ifaces bytes. Byte
+ *               [i * @n_ifaces + j] will be set to 1 if @netdefs[i] matches
+ *               interface j, to 0 otherwise.
+ *
+ * Returns the total number of matches.
+ */
+size_t
+_netplan_netdefs_match_interfaces(
+        const NetplanNetDefinition** netdefs, size_t n_netdefs,
+        const char** names, const char** macs, const char** driver_names, size_t n_ifaces,
+        uint8_t* out_matches)
+{
+    size_t count = 0;
+    /* Maps interface names to their index + 1 */
+    GHashTable* name_index = g_hash_table_new(g_str_hash, g_str_equal);
+
+    memset(out_matches, 0, n_netdefs * n_ifaces);
+    for (size_t j = 0; j < n_ifaces; j++) {
+        if (names[j])
+            g_hash_table_insert(name_index, (gpointer)names[j], GSIZE_TO_POINTER(j + 1));
+    }
+
+    for (size_t i = 0; i < n_netdefs; i++) {
+        struct netdef_matcher matcher;
+        uint8_t* row = out_matches + i * n_ifaces;
+
+        netdef_matcher_init(&matcher, netdefs[i]);
+        if (matcher.literal_name) {
+            /* No need to check all interfaces, if only one name can match */
+            size_t j = GPOINTER_TO_SIZE(g_hash_table_lookup(name_index, matcher.literal_name));
+            if (j && netdef_matcher_match(&matcher, names[j - 1], macs[j - 1], driver_names[j - 1])) {
+                row[j - 1] = 1;
+                count++;
+            }
+        } else {
+            for (size_t j = 0; j < n_ifaces; j++) {
+                if (netdef_matcher_match(&matcher, names[j], macs[j], driver_names[j])) {
+                    row[j] = 1;
+                    count++;
+                }
+            }
+        }
+        netdef_matcher_clear(&matcher);
+    }
+
+    g_hash_table_destroy(name_index);
+    return count;
+}
+
+/**
+ * Get the version of libnetplan. The backend configuration it generates
+ * for the same YAML configuration might differ between versions.
+ */
+const char*
+_netplan_version(void)
+{
+    return NETPLAN_VERSION;
+}
+
 ssize_t
 netplan_netdef_get_set_name(const NetplanNetDefinition* netdef, char* out_buffer, size_t out_buf_size)
 {
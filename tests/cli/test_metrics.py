@@ -0,0 +1,143 @@
+#!/usr/bin/python3
+# Closed-box tests of netplan CLI. These are run during "make check" and don't
+# touch the system configuration at all.
+#
+# Copyright (C) 2023 Canonical, Ltd.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+import yaml
+
+from unittest.mock import MagicMock, patch
+from netplan_cli.cli import metrics
+from netplan_cli.cli.state import SystemConfigState
+from tests.cli.test_status import IPROUTE2, NETWORKD, NMCLI, ROUTE4, ROUTE6
+
+
+class TestMetrics(unittest.TestCase):
+    '''Test the OpenMetrics exposition of the networking state'''
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        patcher = patch('netplan_cli.cli.state.Interface.query_nm_ssid', return_value='MYCON')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _state(self, single=False):
+        state = MagicMock()
+        state.single = single
+        state.online = True
+        state.shown_interfaces = SystemConfigState.build_interfaces(
+            yaml.safe_load(IPROUTE2), SystemConfigState.process_networkd(NETWORKD),
+            SystemConfigState.process_nm(NMCLI), (None, None),
+            (yaml.safe_load(ROUTE4), yaml.safe_load(ROUTE6)))
+        return state
+
+    def test_histogram(self):
+        histogram = metrics.Histogram([0.1, 1.0])
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+        self.assertEqual(histogram.buckets, [0.1, 1.0, float('inf')])
+        self.assertEqual(histogram.counts, [1, 2, 3])
+        self.assertEqual(histogram.count, 3)
+        self.assertAlmostEqual(histogram.sum, 5.55)
+
+    def test_openmetrics(self):
+        histogram = metrics.Histogram([0.1])
+        histogram.observe(0.5)
+        lines = list(metrics.openmetrics(self._state(), histogram))
+        self.assertEqual(lines[-1], '# EOF')
+        self.assertIn('netplan_online 1', lines)
+        self.assertIn('netplan_interface_info{interface="enp0s31f6",index="2",type="ethernet",'
+                      'backend="networkd",netdef="enp0s31f6",operstate="UP"} 1', lines)
+        self.assertIn('netplan_interface_admin_up{interface="wwan0"} 0', lines)
+        self.assertIn('netplan_interface_oper_up{interface="wlan0"} 1', lines)
+        self.assertIn('netplan_interface_oper_up{interface="wg0"} 0', lines)
+        self.assertIn('netplan_interface_addresses{interface="wlan0",family="ipv4"} 1', lines)
+        self.assertIn('netplan_interface_addresses{interface="wlan0",family="ipv6"} 3', lines)
+        self.assertIn('netplan_interface_default_route{interface="enp0s31f6",family="ipv4"} 1', lines)
+        self.assertIn('netplan_interface_default_route{interface="enp0s31f6",family="ipv6"} 1', lines)
+        self.assertIn('netplan_interface_default_route{interface="wg0",family="ipv4"} 0', lines)
+        self.assertIn('netplan_netdef_info{netdef="NM-b6b7a21d-186e-45e1-b3a6-636da1735563",'
+                      'backend="NetworkManager"} 1', lines)
+        self.assertIn('netplan_netdef_info{netdef="wg0",backend="networkd"} 1', lines)
+        self.assertIn('netplan_status_collection_duration_seconds_bucket{le="0.1"} 0', lines)
+        self.assertIn('netplan_status_collection_duration_seconds_bucket{le="+Inf"} 1', lines)
+        self.assertIn('netplan_status_collection_duration_seconds_count 1', lines)
+
+    def test_openmetrics_single(self):
+        lines = list(metrics.openmetrics(self._state(single=True)))
+        # the online state is unknown and no histogram was given
+        self.assertFalse([line for line in lines if 'netplan_online' in line or 'duration' in line])
+
+    def test_escape(self):
+        self.assertEqual(metrics._sample('m', 1, a='x"y\\z\n'), 'm{a="x\\"y\\\\z\\n"} 1')
+
+    @patch('time.monotonic')
+    def test_exporter(self, monotonic_mock):
+        monotonic_mock.side_effect = [10, 10.2]
+        exporter = metrics.Exporter(self._state())
+        with exporter:
+            self.assertTrue(exporter.lock.locked())
+        self.assertFalse(exporter.lock.locked())
+        self.assertEqual(exporter.histogram.count, 1)
+        self.assertAlmostEqual(exporter.histogram.sum, 0.2)
+        body = exporter.render().decode('utf-8')
+        self.assertTrue(body.endswith('# EOF\n'))
+        self.assertIn('netplan_status_collection_duration_seconds_count 1\n', body)
+
+    def _get(self, path, request):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(path)
+            sock.sendall('GET {} HTTP/1.0\r\n\r\n'.format(request).encode())
+            response = b''
+            while data := sock.recv(4096):
+                response += data
+        return response.decode('utf-8')
+
+    def test_serve_unix(self):
+        path = os.path.join(self.workdir, 'metrics.sock')
+        # a stale socket is replaced
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+            stale.bind(path)
+        server = metrics.make_server(path, metrics.Exporter(self._state()))
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            response = self._get(path, '/metrics')
+            self.assertTrue(response.startswith('HTTP/1.0 200'))
+            self.assertIn('Content-Type: ' + metrics.CONTENT_TYPE, response)
+            self.assertIn('netplan_online 1\n', response)
+            self.assertTrue(self._get(path, '/other').startswith('HTTP/1.0 404'))
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+        self.assertFalse(os.path.exists(path))
+
+    def test_serve_tcp(self):
+        server = metrics.make_server('127.0.0.1:0', metrics.Exporter(self._state()))
+        try:
+            self.assertEqual(server.server_address[0], '127.0.0.1')
+        finally:
+            server.server_close()
+        with self.assertRaises(ValueError):
+            metrics.make_server('localhost:metrics', None)
@@ -0,0 +1,313 @@
+#!/usr/bin/python3
+# Closed-box tests of netplan CLI. These are run during "make check" and don't
+# touch the system configuration at all.
+#
+# Copyright (C) 2023 Canonical, Ltd.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; version 3.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import errno
+import socket
+import struct
+import unittest
+
+from collections import Counter
+from unittest.mock import patch
+
+from netplan_cli.cli import netlink
+
+
+def _msg(nl_type, seq, payload):
+    return netlink.NLMSGHDR.pack(netlink.NLMSGHDR.size + len(payload), nl_type, 0x2, seq, 0) + payload
+
+
+def _done(seq):
+    return _msg(netlink.NLMSG_DONE, seq, struct.pack('=i', 0))
+
+
+def _error(seq, err):
+    return _msg(netlink.NLMSG_ERROR, seq, struct.pack('=i', -err) + b'\0' * netlink.NLMSGHDR.size)
+
+
+def _link(seq, ifindex, ifname, flags, operstate, address, kind=None, permaddr=None):
+    attrs = (netlink._attr(netlink.IFLA_IFNAME, ifname.encode() + b'\0') +
+             netlink._attr(netlink.IFLA_MTU, struct.pack('=I', 1500)) +
+             netlink._attr(netlink.IFLA_OPERSTATE, bytes([operstate])) +
+             netlink._attr(netlink.IFLA_ADDRESS, address))
+    if permaddr:
+        attrs += netlink._attr(netlink.IFLA_PERM_ADDRESS, permaddr)
+    if kind:
+        attrs += netlink._attr(netlink.IFLA_LINKINFO | 0x8000,  # NLA_F_NESTED
+                               netlink._attr(netlink.IFLA_INFO_KIND, kind.encode() + b'\0'))
+    return _msg(netlink.RTM_NEWLINK, seq, netlink.IFINFOMSG.pack(0, 1, ifindex, flags, 0) + attrs)
+
+
+def _addr(seq, ifindex, family, address, prefixlen, scope=0, label=None):
+    attrs = netlink._attr(netlink.IFA_ADDRESS, socket.inet_pton(family, address))
+    if label:
+        attrs += netlink._attr(netlink.IFA_LABEL, label.encode() + b'\0')
+    return _msg(netlink.RTM_NEWADDR, seq, netlink.IFADDRMSG.pack(family, prefixlen, 0, scope, ifindex) + attrs)
+
+
+def _route(seq, family, dst, dst_len, table, protocol, scope, rt_type, oif=None, gateway=None, metric=None,
+           prefsrc=None, flags=0):
+    attrs = netlink._attr(netlink.RTA_TABLE, struct.pack('=I', table))
+    if dst:
+        attrs += netlink._attr(netlink.RTA_DST, socket.inet_pton(family, dst))
+    if oif:
+        attrs += netlink._attr(netlink.RTA_OIF, struct.pack('=I', oif))
+    if gateway:
+        attrs += netlink._attr(netlink.RTA_GATEWAY, socket.inet_pton(family, gateway))
+    if metric is not None:
+        attrs += netlink._attr(netlink.RTA_PRIORITY, struct.pack('=I', metric))
+    if prefsrc:
+        attrs += netlink._attr(netlink.RTA_PREFSRC, socket.inet_pton(family, prefsrc))
+    rtmsg = netlink.RTMSG.pack(family, dst_len, 0, 0, table if table < 256 else 252, protocol, scope, rt_type, flags)
+    return _msg(netlink.RTM_NEWROUTE, seq, rtmsg + attrs)
+
+
+class FakeNetlinkSocket():
+    '''Replies to each request with the messages built by the next responder'''
+
+    def __init__(self, responders):
+        self.responders = list(responders)
+        self.requests = []
+        self.pending = []
+
+    def bind(self, addr):
+        pass
+
+    def setsockopt(self, level, opt, value):
+        pass
+
+    def close(self):
+        pass
+
+    def send(self, data):
+        length, nl_type, flags, seq, _ = netlink.NLMSGHDR.unpack_from(data)
+        self.requests.append((nl_type, flags, bytes(data[netlink.NLMSGHDR.size:length])))
+        # split the reply in multiple datagrams, like the kernel does for large dumps
+        self.pending = [bytes(msg) for msg in self.responders.pop(0)(seq)]
+
+    def setblocking(self, flag):
+        pass
+
+    def recv_into(self, buf):
+        if not self.pending:
+            raise BlockingIOError()
+        data = self.pending.pop(0)
+        if isinstance(data, Exception):
+            raise data
+        buf[:len(data)] = data
+        return len(data)
+
+
+class TestNetlink(unittest.TestCase):
+    '''Test the rtnetlink client'''
+
+    def _fake_socket(self, *responders):
+        sock = FakeNetlinkSocket(responders)
+        patcher = patch('socket.socket', return_value=sock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return sock
+
+    def test_dump_links(self):
+        sock = self._fake_socket(
+            lambda seq: [_link(seq, 1, 'lo', 0x1 | 0x8 | 0x40 | 0x10000, 0, b'\0' * 6) +
+                         _link(seq, 2, 'eth0', 0x1 | 0x2 | 0x1000 | 0x10000, 6, b'\x54\xe1\xad\x5f\x24\xb4'),
+                         _link(seq, 3, 'eth0.100', 0x2 | 0x1000, 2, b'\x54\xe1\xad\x5f\x24\xb4', 'vlan') +
+                         _done(seq)],
+            lambda seq: [_addr(seq, 1, socket.AF_INET, '127.0.0.1', 8, 254, 'lo') +
+                         _addr(seq, 2, socket.AF_INET6, 'fe80::56e1:adff:fe5f:24b4', 64, 253) +
+                         _addr(seq, 9, socket.AF_INET, '10.0.0.1', 8) +
+                         _done(seq)])
+        links = netlink.dump_links()
+        self.assertEqual([r[0] for r in sock.requests], [netlink.RTM_GETLINK, netlink.RTM_GETADDR])
+        self.assertEqual(links, [
+            {'ifindex': 1, 'ifname': 'lo', 'flags': ['LOOPBACK', 'UP', 'LOWER_UP'], 'mtu': 1500,
+             'operstate': 'UNKNOWN', 'address': '00:00:00:00:00:00',
+             'addr_info': [{'family': 'inet', 'local': '127.0.0.1', 'prefixlen': 8, 'scope': 'host', 'label': 'lo'}]},
+            {'ifindex': 2, 'ifname': 'eth0', 'flags': ['BROADCAST', 'MULTICAST', 'UP', 'LOWER_UP'], 'mtu': 1500,
+             'operstate': 'UP', 'address': '54:e1:ad:5f:24:b4',
+             'addr_info': [{'family': 'inet6', 'local': 'fe80::56e1:adff:fe5f:24b4', 'prefixlen': 64, 'scope': 'link'}]},
+            {'ifindex': 3, 'ifname': 'eth0.100', 'flags': ['BROADCAST', 'MULTICAST'], 'mtu': 1500,
+             'operstate': 'DOWN', 'address': '54:e1:ad:5f:24:b4', 'linkinfo': {'info_kind': 'vlan'},
+             'addr_info': []},
+            ])
+
+    def test_dump_links_single(self):
+        sock = self._fake_socket(
+            lambda seq: [_link(seq, 2, 'eth0', 0x1, 6, b'\x54\xe1\xad\x5f\x24\xb4')],
+            lambda seq: [_addr(seq, 2, socket.AF_INET, '192.168.0.2', 24) + _done(seq)])
+        links = netlink.dump_links(2)
+        self.assertEqual([link['ifname'] for link in links], ['eth0'])
+        self.assertEqual(links[0]['addr_info'][0]['local'], '192.168.0.2')
+        # a single link is requested, the addresses are filtered by the kernel
+        self.assertEqual(sock.requests[0][1] & netlink.NLM_F_DUMP, 0)
+        self.assertEqual(netlink.IFINFOMSG.unpack(sock.requests[0][2])[2], 2)
+        self.assertEqual(netlink.IFADDRMSG.unpack(sock.requests[1][2])[4], 2)
+
+    def test_dump_links_by_name(self):
+        sock = self._fake_socket(
+            lambda seq: [_link(seq, 2, 'eth0', 0x1, 6, b'\x54\xe1\xad\x5f\x24\xb4')],
+            lambda seq: [_addr(seq, 2, socket.AF_INET, '192.168.0.2', 24) + _done(seq)])
+        links = netlink.dump_links(ifname='eth0')
+        self.assertEqual([link['ifname'] for link in links], ['eth0'])
+        # the link is looked up by name, its addresses by index
+        self.assertEqual(sock.requests[0][1] & netlink.NLM_F_DUMP, 0)
+        self.assertIn(netlink._attr(netlink.IFLA_IFNAME, b'eth0\0'), sock.requests[0][2])
+        self.assertEqual(netlink.IFADDRMSG.unpack(sock.requests[1][2])[4], 2)
+
+    def test_dump_links_single_missing(self):
+        self._fake_socket(lambda seq: [_error(seq, errno.ENODEV)], lambda seq: [_error(seq, errno.ENODEV)])
+        self.assertEqual(netlink.dump_links(42), [])
+        self.assertEqual(netlink.dump_links(ifname='notaninterface0'), [])
+
+    def test_links_permaddr(self):
+        self._fake_socket(
+            lambda seq: [_link(seq, 2, 'eth0', 0x1, 6, b'\0\0\0\0\0\x01', permaddr=b'\0\x01\x02\x03\x04\x05') +
+                         _link(seq, 3, 'eth1', 0x1, 6, b'\0\0\0\0\0\x02', permaddr=b'\0\0\0\0\0\x02') +
+                         _done(seq)])
+        with netlink.Netlink() as nl:
+            links = nl.links()
+        # like 'ip -j link', the permanent address is only shown if it differs
+        self.assertEqual(links[0]['permaddr'], '00:01:02:03:04:05')
+        self.assertNotIn('permaddr', links[1])
+
+    def test_dump_links_error(self):
+        self._fake_socket(lambda seq: [_error(seq, errno.EPERM)])
+        with self.assertRaises(netlink.NetlinkError) as e:
+            netlink.dump_links()
+        self.assertEqual(e.exception.errno, errno.EPERM)
+
+    def test_dump_routes(self):
+        sock = self._fake_socket(
+            lambda seq: [_link(seq, 2, 'eth0', 0x1, 6, b'\0' * 6) + _done(seq)],
+            lambda seq: [_route(seq, socket.AF_INET, None, 0, 254, 16, 0, 1, oif=2,
+                                gateway='192.168.0.1', metric=100, prefsrc='192.168.0.2') +
+                         _route(seq, socket.AF_INET, '192.168.0.0', 24, 1234, 2, 253, 1, oif=2,
+                                prefsrc='192.168.0.2'),
+                         _route(seq, socket.AF_INET, '192.168.0.1', 32, 255, 2, 254, 2, oif=5) +
+                         _route(seq, socket.AF_INET, '10.0.0.1', 32, 254, 2, 0, 1, oif=2, flags=netlink.RTM_F_CLONED) +
+                         _done(seq)])
+        with patch('socket.if_indextoname', side_effect=OSError):
+            routes = netlink.dump_routes(socket.AF_INET)
+        self.assertEqual([r[0] for r in sock.requests], [netlink.RTM_GETLINK, netlink.RTM_GETROUTE])
+        self.assertEqual(routes, [
+            {'type': 'unicast', 'dst': 'default', 'gateway': '192.168.0.1', 'dev': 'eth0', 'table': 'main',
+             'protocol': 'dhcp', 'scope': 'global', 'prefsrc': '192.168.0.2', 'metric': 100, 'flags': []},
+            {'type': 'unicast', 'dst': '192.168.0.0/24', 'dev': 'eth0', 'table': '1234',
+             'protocol': 'kernel', 'scope': 'link', 'prefsrc': '192.168.0.2', 'flags': []},
+            {'type': 'local', 'dst': '192.168.0.1', 'dev': '5', 'table': 'local',
+             'protocol': 'kernel', 'scope': 'host', 'flags': []},
+            ])
+
+    def test_dump_routes_filtered(self):
+        sock = self._fake_socket(
+            lambda seq: [_link(seq, 2, 'eth0', 0x1, 6, b'\0' * 6)],
+            lambda seq: [_route(seq, socket.AF_INET6, None, 0, 254, 9, 0, 1, oif=2, gateway='fe80::1') +
+                         _route(seq, socket.AF_INET6, 'fe80::', 64, 254, 2, 0, 1, oif=3) +
+                         _route(seq, socket.AF_INET6, '2001:db8::', 64, 1000, 2, 0, 1, oif=2) +
+                         _done(seq)])
+        routes = netlink.dump_routes(socket.AF_INET6, table=254, oif=2)
+        self.assertEqual(routes, [
+            {'type': 'unicast', 'dst': 'default', 'gateway': 'fe80::1', 'dev': 'eth0', 'table': 'main',
+             'protocol': 'ra', 'scope': 'global', 'flags': []}])
+        # the filter is passed on to the kernel
+        self.assertIn(netlink._attr(netlink.RTA_TABLE, struct.pack('=I', 254)), sock.requests[1][2])
+        self.assertIn(netlink._attr(netlink.RTA_OIF, struct.pack('=I', 2)), sock.requests[1][2])
+
+    def test_dump_routes_oif_missing(self):
+        self._fake_socket(lambda seq: [_done(seq)], lambda seq: [_error(seq, errno.ENODEV)])
+        # the output interface has gone away, after the link dump
+        self.assertEqual(netlink.dump_routes(socket.AF_INET, oif=42), [])
+
+    def test_routes_family_missing(self):
+        self._fake_socket(
+            lambda seq: [_route(seq, socket.AF_INET, '10.0.0.0', 8, 1000, 4, 0, 1, oif=2) + _done(seq)],
+            lambda seq: [_error(seq, errno.ENOENT)],
+            lambda seq: [_error(seq, errno.ENOENT)])
+        # table 1000 only has IPv4 routes, so there is no such IPv6 table
+        with netlink.Netlink() as nl:
+            self.assertEqual([r['dst'] for r in nl.routes(socket.AF_INET, 1000, ifnames={2: 'eth0'})], ['10.0.0.0/8'])
+            self.assertEqual(nl.routes(socket.AF_INET6, 1000), [])
+            # without a table filter, this is an error
+            with self.assertRaises(netlink.NetlinkError):
+                nl.routes(socket.AF_INET6)
+
+    def test_dump_routes_hidden(self):
+        self._fake_socket(
+            lambda seq: [_link(seq, 2, 'eth0', 0x1, 6, b'\0' * 6) + _done(seq)],
+            lambda seq: [_route(seq, socket.AF_INET, None, 0, 254, 186, 0, 1, oif=2, gateway='192.168.0.1') +
+                         _route(seq, socket.AF_INET, '10.0.0.0', 8, 254, 186, 0, 1, oif=2, gateway='192.168.0.1') +
+                         _route(seq, socket.AF_INET, '10.1.0.0', 16, 254, 186, 0, 1, oif=2, gateway='192.168.0.1') +
+                         _route(seq, socket.AF_INET, '10.2.0.0', 16, 254, 11, 0, 1, oif=2, gateway='192.168.0.1') +
+                         _route(seq, socket.AF_INET, '192.168.0.0', 24, 254, 2, 253, 1, oif=2) +
+                         _done(seq)])
+        hidden = Counter()
+        with patch('netplan_cli.cli.netlink._parse_attrs', wraps=netlink._parse_attrs) as parse_mock:
+            routes = netlink.dump_routes(socket.AF_INET, hide_protocols=[11, 186], hidden=hidden)
+        # the default route is kept, the others are counted only
+        self.assertEqual([(r['dst'], r['protocol']) for r in routes], [('default', 'bgp'), ('192.168.0.0/24', 'kernel')])
+        self.assertEqual(hidden, {('eth0', 'bgp'): 2, ('eth0', 'zebra'): 1})
+        # the attributes of the hidden routes are not collected (only those of the link and the kept routes)
+        self.assertEqual(parse_mock.call_count, 3)
+
+    def test_dump_routes_hidden_table(self):
+        self._fake_socket(
+            lambda seq: [_link(seq, 2, 'eth0', 0x1, 6, b'\0' * 6) + _done(seq)],
+            lambda seq: [_route(seq, socket.AF_INET, '10.0.0.0', 8, 1000, 186, 0, 1, oif=2, gateway='192.168.0.1') +
+                         _route(seq, socket.AF_INET, '10.1.0.0', 16, 1001, 186, 0, 1, oif=2, gateway='192.168.0.1') +
+                         _route(seq, socket.AF_INET, '10.2.0.0', 16, 1000, 186, 0, 6) +  # blackhole, no interface
+                         _done(seq)])
+        hidden = Counter()
+        self.assertEqual(netlink.dump_routes(socket.AF_INET, table=1000, hide_protocols=[186], hidden=hidden), [])
+        # routes of other tables and without an interface are not counted
+        self.assertEqual(hidden, {('eth0', 'bgp'): 1})
+
+
+class TestMonitor(unittest.TestCase):
+    '''Test the rtnetlink notification listener'''
+
+    def _fake_socket(self, *datagrams):
+        sock = FakeNetlinkSocket([])
+        sock.pending = list(datagrams)
+        patcher = patch('socket.socket', return_value=sock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return sock
+
+    def test_read(self):
+        dellink = _link(0, 5, 'veth0', 0, 2, b'\0' * 6)
+        dellink = dellink[:4] + struct.pack('=H', netlink.RTM_DELLINK) + dellink[6:]
+        self._fake_socket(
+            _link(0, 2, 'eth0', 0x1, 6, b'\0' * 6) + _addr(0, 3, socket.AF_INET, '10.0.0.1', 8),
+            _route(0, socket.AF_INET, None, 0, 254, 16, 0, 1, oif=4, gateway='10.0.0.254') +
+            _route(0, socket.AF_INET, '10.0.0.2', 32, 254, 2, 0, 1, oif=6, flags=netlink.RTM_F_CLONED) +
+            _route(0, socket.AF_INET, '10.1.0.0', 16, 254, 4, 0, 6),  # blackhole, no interface
+            dellink)
+        with netlink.Monitor() as monitor:
+            self.assertEqual(monitor.read(), {2, 3, 4, 5})
+            self.assertEqual(monitor.read(), set())
+
+    def test_read_overrun(self):
+        self._fake_socket(_link(0, 2, 'eth0', 0x1, 6, b'\0' * 6), OSError(errno.ENOBUFS, 'No buffer space available'))
+        with netlink.Monitor() as monitor:
+            self.assertIsNone(monitor.read())
+
+    def test_read_error(self):
+        self._fake_socket(OSError(errno.EBADF, 'Bad file descriptor'))
+        with netlink.Monitor() as monitor:
+            with self.assertRaises(OSError):
+                monitor.read()
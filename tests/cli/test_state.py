@@ -19,6 +19,8 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import copy
+import io
+import json
 import os
 import shutil
 import subprocess
@@ -26,39 +28,68 @@ import tempfile
 import unittest
 import yaml
 
-from unittest.mock import patch, call, mock_open
-from netplan_cli.cli.state import Interface, NetplanConfigState, SystemConfigState
+import netplan
+
+from collections import Counter
+from unittest.mock import MagicMock, patch, call, mock_open
+from netplan_cli.cli.state import (Interface, NetplanConfigState, SystemConfigState,
+                                   OPTIONAL_QUERY_TIMEOUT, REQUIRED_QUERY_TIMEOUT)
 from .test_status import (DNS_ADDRESSES, DNS_IP4, DNS_SEARCH, FAKE_DEV,
                           IPROUTE2, NETWORKD, NMCLI, ROUTE4, ROUTE6)
 
+NMCLI_SSIDS = '''\
+connection.uuid:b6b7a21d-186e-45e1-b3a6-636da1735563
+802-11-wireless.ssid:MY\\:CON
+'''
+
 
 class resolve1_ipc_mock():
     def get_object(self, _foo, _bar):
         return {}  # dbus Object
 
+    def close(self):
+        pass
+
 
 class resolve1_iface_mock():
     def __init__(self, _foo, _bar):
         pass  # dbus Interface
 
-    def GetAll(self, _):
+    def GetAll(self, _, timeout=None):
         return {
             'DNS': DNS_ADDRESSES,
             'Domains': DNS_SEARCH,
             }
 
 
+def popen_mock(*outputs, returncode=0, stderr=''):
+    '''Mock subprocess.Popen, returning the given outputs in consecutive calls'''
+    procs = []
+    for output in outputs:
+        proc = MagicMock()
+        proc.stdout = io.StringIO(output)
+        proc.stderr = io.StringIO(stderr)
+        proc.wait.return_value = returncode
+        proc.returncode = returncode
+        procs.append(MagicMock(**{'__enter__.return_value': proc}))
+    return procs
+
+
 class TestSystemState(unittest.TestCase):
     '''Test netplan state module'''
 
     def setUp(self):
         self.maxDiff = None
+        # use the (mocked) iproute2 data, instead of querying netlink
+        patcher = patch('netplan_cli.cli.netlink.Netlink', side_effect=OSError('unavailable'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
     @patch('subprocess.check_output')
     def test_query_iproute2(self, mock):
         mock.return_value = IPROUTE2
         res = SystemConfigState.query_iproute2()
-        mock.assert_called_with(['ip', '-d', '-j', 'addr'], text=True)
+        mock.assert_called_with(['ip', '-d', '-j', 'addr'], text=True, timeout=REQUIRED_QUERY_TIMEOUT)
         self.assertEqual(len(res), 6)
         self.assertListEqual([itf.get('ifname') for itf in res],
                              ['lo', 'enp0s31f6', 'wlan0', 'wg0', 'wwan0', 'tun0'])
@@ -68,7 +99,7 @@ class TestSystemState(unittest.TestCase):
         mock.side_effect = subprocess.CalledProcessError(1, '', 'ERR')
         with self.assertLogs() as cm:
             res = SystemConfigState.query_iproute2()
-            mock.assert_called_with(['ip', '-d', '-j', 'addr'], text=True)
+            mock.assert_called_with(['ip', '-d', '-j', 'addr'], text=True, timeout=REQUIRED_QUERY_TIMEOUT)
             self.assertIsNone(res)
             self.assertIn('CRITICAL:root:Cannot query iproute2 interface data:', cm.output[0])
 
@@ -76,29 +107,126 @@ class TestSystemState(unittest.TestCase):
     def test_query_networkd(self, mock):
         mock.return_value = NETWORKD
         res = SystemConfigState.query_networkd()
-        mock.assert_called_with(['networkctl', '--json=short'], text=True)
+        mock.assert_called_with(['networkctl', '--json=short'], text=True, timeout=REQUIRED_QUERY_TIMEOUT)
         self.assertEqual(len(res), 6)
         self.assertListEqual([itf.get('Name') for itf in res],
                              ['lo', 'enp0s31f6', 'wlan0', 'wg0', 'wwan0', 'tun0'])
 
+    @patch('subprocess.check_output')
+    def test_query_iproute2_dev(self, mock):
+        mock.return_value = '[]'
+        SystemConfigState.query_iproute2(dev='eth0')
+        mock.assert_called_with(['ip', '-d', '-j', 'addr', 'show', 'dev', 'eth0'], text=True,
+                                timeout=REQUIRED_QUERY_TIMEOUT)
+
+    @patch('subprocess.check_output')
+    @patch('dbus.SystemBus')
+    def test_query_networkd_link(self, bus_mock, mock):
+        nd = SystemConfigState.process_networkd(NETWORKD)
+        link = bus_mock.return_value.get_object.return_value
+        link.Describe.return_value = json.dumps(nd[1])
+        self.assertEqual(SystemConfigState.query_networkd(ifindex=2), [nd[1]])
+        bus_mock.return_value.get_object.assert_called_once_with('org.freedesktop.network1',
+                                                                 '/org/freedesktop/network1/link/_32')
+        link.Describe.assert_called_once_with(dbus_interface='org.freedesktop.network1.Link',
+                                              timeout=REQUIRED_QUERY_TIMEOUT)
+        mock.assert_not_called()
+        # a private connection is used, as this runs in a worker thread
+        bus_mock.assert_called_once_with(private=True)
+        bus_mock.return_value.close.assert_called_once_with()
+        # fall back to networkctl
+        link.Describe.side_effect = Exception('Unknown method')
+        mock.return_value = NETWORKD
+        self.assertEqual(SystemConfigState.query_networkd(ifindex=2), nd)
+
     @patch('subprocess.check_output')
     def test_query_networkd_fail(self, mock):
         mock.side_effect = subprocess.CalledProcessError(1, '', 'ERR')
         with self.assertLogs() as cm:
             res = SystemConfigState.query_networkd()
-            mock.assert_called_with(['networkctl', '--json=short'], text=True)
+            mock.assert_called_with(['networkctl', '--json=short'], text=True, timeout=REQUIRED_QUERY_TIMEOUT)
             self.assertIsNone(res)
             self.assertIn('CRITICAL:root:Cannot query networkd interface data:', cm.output[0])
 
+    @patch('netplan_cli.cli.netlink.dump_links')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_iproute2')
+    def test_query_links(self, iproute2_mock, netlink_mock):
+        netlink_mock.return_value = [FAKE_DEV]
+        self.assertEqual(SystemConfigState.query_links(), [FAKE_DEV])
+        iproute2_mock.assert_not_called()
+        # fall back to iproute2
+        netlink_mock.side_effect = OSError('Address family not supported by protocol')
+        iproute2_mock.return_value = SystemConfigState.process_generic(IPROUTE2)
+        self.assertEqual(SystemConfigState.query_links(), iproute2_mock.return_value)
+
+    @patch('netplan_cli.cli.netlink.Netlink')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_routes')
+    def test_query_route_tables(self, routes_mock, netlink_mock):
+        nl = netlink_mock.return_value.__enter__.return_value
+        nl.links.return_value = [{'ifindex': 2, 'ifname': 'eth0'}]
+        nl.routes.side_effect = [[{'dst': 'default', 'dev': 'eth0'}], [{'dst': '::1', 'dev': 'lo'}]]
+        res4, res6 = SystemConfigState.query_route_tables()
+        self.assertEqual(res4, [{'dst': 'default', 'dev': 'eth0', 'family': 2}])
+        self.assertEqual(res6, [{'dst': '::1', 'dev': 'lo', 'family': 10}])
+        routes_mock.assert_not_called()
+        # one query per table and family, hiding the protocols by number,
+        # on a single socket, with a single link dump
+        netlink_mock.reset_mock()
+        nl.routes.side_effect = None
+        nl.routes.return_value = []
+        hidden = Counter()
+        SystemConfigState.query_route_tables(tables=[254, 1000], hide_protocols=['bgp', 'zebra'], hidden=hidden)
+        netlink_mock.assert_called_once_with()
+        nl.links.assert_called_once_with(None)
+        ifnames = {2: 'eth0'}
+        self.assertEqual(nl.routes.call_args_list, [
+            call(2, 254, None, ifnames, [11, 186], hidden),
+            call(10, 254, None, ifnames, [11, 186], hidden),
+            call(2, 1000, None, ifnames, [11, 186], hidden),
+            call(10, 1000, None, ifnames, [11, 186], hidden),
+            ])
+        # fall back to iproute2
+        netlink_mock.side_effect = OSError('Address family not supported by protocol')
+        routes_mock.return_value = (None, None)
+        self.assertEqual(SystemConfigState.query_route_tables(), (None, None))
+        routes_mock.assert_called_once()
+
     @patch('subprocess.check_output')
     def test_query_nm(self, mock):
-        mock.return_value = NMCLI
+        mock.side_effect = [NMCLI, NMCLI_SSIDS]
         res = SystemConfigState.query_nm()
-        mock.assert_called_with(['nmcli', '-t', '-f',
-                                 'DEVICE,NAME,UUID,FILENAME,TYPE,AUTOCONNECT',
-                                 'con', 'show'], text=True)
+        # the SSIDs of the wifi connections are queried at once
+        self.assertEqual(mock.call_args_list, [
+            call(['nmcli', '-t', '-f', 'DEVICE,NAME,UUID,FILENAME,TYPE,AUTOCONNECT', 'con', 'show'],
+                 text=True, timeout=OPTIONAL_QUERY_TIMEOUT),
+            call(['nmcli', '-t', '-f', 'connection.uuid,802-11-wireless.ssid', 'con', 'show',
+                  'uuid', 'b6b7a21d-186e-45e1-b3a6-636da1735563'], text=True, timeout=OPTIONAL_QUERY_TIMEOUT)])
         self.assertEqual(len(res), 1)
         self.assertListEqual([itf.get('device') for itf in res], ['wlan0'])
+        self.assertEqual(res[0]['ssid'], 'MY:CON')
+
+    @patch('subprocess.check_output')
+    def test_query_nm_ssids_fail(self, mock):
+        mock.side_effect = [NMCLI, subprocess.CalledProcessError(1, '', 'ERR')]
+        with self.assertLogs(level='DEBUG') as cm:
+            res = SystemConfigState.query_nm()
+            self.assertIn('DEBUG:root:Cannot query NetworkManager SSIDs:', cm.output[0])
+        # the SSID is queried per interface then
+        self.assertEqual([itf.get('device') for itf in res], ['wlan0'])
+        self.assertNotIn('ssid', res[0])
+
+    def test_process_nm_ssids(self):
+        output = 'connection.uuid:1\n802-11-wireless.ssid:a\\\\b\nconnection.uuid:2\n802-11-wireless.ssid:\n'
+        self.assertEqual(SystemConfigState.process_nm_ssids(output), {'1': 'a\\b', '2': ''})
+
+    @patch('subprocess.check_output')
+    def test_query_nm_device(self, mock):
+        mock.return_value = NMCLI
+        self.assertEqual(SystemConfigState.query_nm(device='enp0s31f6'), [])
+        mock.assert_called_with(['nmcli', '-t', '-f',
+                                 'DEVICE,NAME,UUID,FILENAME,TYPE,AUTOCONNECT',
+                                 'con', 'show', '--active'], text=True, timeout=OPTIONAL_QUERY_TIMEOUT)
+        self.assertEqual([con['name'] for con in SystemConfigState.query_nm(device='wlan0')], ['MYCON'])
 
     @patch('subprocess.check_output')
     def test_query_nm_fail(self, mock):
@@ -107,17 +235,30 @@ class TestSystemState(unittest.TestCase):
             res = SystemConfigState.query_nm()
             mock.assert_called_with(['nmcli', '-t', '-f',
                                      'DEVICE,NAME,UUID,FILENAME,TYPE,AUTOCONNECT',
-                                     'con', 'show'], text=True)
+                                     'con', 'show'], text=True, timeout=OPTIONAL_QUERY_TIMEOUT)
             self.assertIsNone(res)
             self.assertIn('DEBUG:root:Cannot query NetworkManager interface data:', cm.output[0])
 
     @patch('subprocess.check_output')
+    def test_query_nm_timeout(self, mock):
+        mock.side_effect = subprocess.TimeoutExpired('nmcli', 1)
+        with self.assertLogs(level='DEBUG') as cm:
+            res = SystemConfigState.query_nm(timeout=1)
+            mock.assert_called_with(['nmcli', '-t', '-f',
+                                     'DEVICE,NAME,UUID,FILENAME,TYPE,AUTOCONNECT',
+                                     'con', 'show'], text=True, timeout=1)
+            self.assertIsNone(res)
+            self.assertIn('DEBUG:root:Cannot query NetworkManager interface data:', cm.output[0])
+
+    @patch('subprocess.Popen')
     def test_query_routes(self, mock):
-        mock.side_effect = [ROUTE4, ROUTE6]
+        mock.side_effect = popen_mock(ROUTE4, ROUTE6)
         res4, res6 = SystemConfigState.query_routes()
         mock.assert_has_calls([
-            call(['ip', '-d', '-j', '-4', 'route', 'show', 'table', 'all'], text=True),
-            call(['ip', '-d', '-j', '-6', 'route', 'show', 'table', 'all'], text=True),
+            call(['ip', '-d', '-j', '-4', 'route', 'show', 'table', 'all'], stdout=subprocess.PIPE,
+                 stderr=subprocess.PIPE, text=True),
+            call(['ip', '-d', '-j', '-6', 'route', 'show', 'table', 'all'], stdout=subprocess.PIPE,
+                 stderr=subprocess.PIPE, text=True),
             ])
         self.assertEqual(len(res4), 7)
         self.assertListEqual([route.get('dev') for route in res4],
@@ -127,12 +268,60 @@ class TestSystemState(unittest.TestCase):
                              ['lo', 'enp0s31f6', 'wlan0', 'enp0s31f6', 'wlan0',
                               'tun0', 'enp0s31f6', 'wlan0', 'enp0s31f6', 'wlan0'])
 
-    @patch('subprocess.check_output')
+    @patch('subprocess.Popen')
+    def test_query_routes_filtered(self, mock):
+        mock.side_effect = popen_mock(ROUTE4, ROUTE6, '[{"dst":"10.0.0.0/8","dev":"eth0","protocol":"static"}]', '[]')
+        hidden = Counter()
+        res4, res6 = SystemConfigState.query_routes(tables=[254, 1234], hide_protocols=['dhcp', 'ra'], hidden=hidden)
+        mock.assert_has_calls([
+            call(['ip', '-d', '-j', '-4', 'route', 'show', 'table', '254'], stdout=subprocess.PIPE,
+                 stderr=subprocess.PIPE, text=True),
+            call(['ip', '-d', '-j', '-6', 'route', 'show', 'table', '254'], stdout=subprocess.PIPE,
+                 stderr=subprocess.PIPE, text=True),
+            call(['ip', '-d', '-j', '-4', 'route', 'show', 'table', '1234'], stdout=subprocess.PIPE,
+                 stderr=subprocess.PIPE, text=True),
+            call(['ip', '-d', '-j', '-6', 'route', 'show', 'table', '1234'], stdout=subprocess.PIPE,
+                 stderr=subprocess.PIPE, text=True),
+            ])
+        # default routes are kept
+        self.assertEqual([(route['dst'], route['protocol']) for route in res4 if route['protocol'] == 'dhcp'],
+                         [('default', 'dhcp'), ('default', 'dhcp')])
+        self.assertEqual(len(res4), 7)
+        self.assertEqual(len(res6), 6)
+        # iproute2 omits the table, if only a single one is shown
+        self.assertEqual(res4[-1], {'dst': '10.0.0.0/8', 'dev': 'eth0', 'protocol': 'static', 'table': '1234',
+                                    'family': 2})
+        self.assertEqual(hidden, {('enp0s31f6', 'dhcp'): 1, ('enp0s31f6', 'ra'): 2, ('wlan0', 'ra'): 2})
+
+    @patch('subprocess.Popen')
+    def test_query_routes_dev(self, mock):
+        mock.side_effect = popen_mock('[{"dst":"default","gateway":"10.0.0.1","protocol":"static"}]', '[]')
+        res4, res6 = SystemConfigState.query_routes(tables=[254], dev='eth0')
+        mock.assert_has_calls([
+            call(['ip', '-d', '-j', '-4', 'route', 'show', 'table', '254', 'dev', 'eth0'], stdout=subprocess.PIPE,
+                 stderr=subprocess.PIPE, text=True)])
+        # iproute2 omits the device, if only a single one is shown
+        self.assertEqual(res4, [{'dst': 'default', 'gateway': '10.0.0.1', 'protocol': 'static', 'table': 'main',
+                                 'dev': 'eth0', 'family': 2}])
+        self.assertEqual(res6, [])
+
+    @patch('subprocess.Popen')
+    def test_query_routes_family_missing(self, mock):
+        # table 1000 only has IPv4 routes, so there is no such IPv6 table
+        mock.side_effect = (popen_mock('[{"dst":"10.0.0.0/8","dev":"eth0","protocol":"static"}]') +
+                            popen_mock('', returncode=2, stderr='Error: ipv6: FIB table does not exist.\n'))
+        res4, res6 = SystemConfigState.query_routes(tables=[1000])
+        self.assertEqual(res4, [{'dst': '10.0.0.0/8', 'dev': 'eth0', 'protocol': 'static', 'table': '1000',
+                                 'family': 2}])
+        self.assertEqual(res6, [])
+
+    @patch('subprocess.Popen')
     def test_query_routes_fail(self, mock):
-        mock.side_effect = subprocess.CalledProcessError(1, '', 'ERR')
+        mock.side_effect = popen_mock('', returncode=1)
         with self.assertLogs(level='DEBUG') as cm:
             res4, res6 = SystemConfigState.query_routes()
-            mock.assert_called_with(['ip', '-d', '-j', '-4', 'route', 'show', 'table', 'all'], text=True)
+            mock.assert_called_with(['ip', '-d', '-j', '-4', 'route', 'show', 'table', 'all'], stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE, text=True)
             self.assertIsNone(res4)
             self.assertIsNone(res6)
             self.assertIn('DEBUG:root:Cannot query iproute2 route data:', cm.output[0])
@@ -149,6 +338,7 @@ class TestSystemState(unittest.TestCase):
         self.assertEqual(len(search), 2)
         self.assertListEqual([s[1] for s in search],
                              ['search.domain', 'search.domain'])
+        mock_ipc.assert_called_once_with(private=True)
 
     @patch('dbus.SystemBus')
     def test_query_resolved_fail(self, mock):
@@ -236,6 +426,234 @@ search search.domain  another.one
         networkd_mock.return_value = state.process_networkd(NETWORKD)
         self.assertIn('fakedev0', [iface.name for iface in state.interface_list])
 
+    @patch('netplan_cli.cli.utils.systemctl_is_active')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_networkctl_status')
+    @patch('netplan_cli.cli.state.Interface.query_networkctl')
+    @patch('netplan_cli.cli.state.Interface.query_nm_ssid')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_iproute2')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_networkd')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_nm')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_routes')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_resolved')
+    @patch('netplan_cli.cli.state.SystemConfigState.resolvconf_json')
+    def test_system_state_config_data_indexed(self, resolvconf_mock, rd_mock, routes_mock, nm_mock,
+                                              networkd_mock, iproute2_mock, ssid_mock, networkctl_mock,
+                                              networkctl_status_mock, is_active_mock):
+        is_active_mock.return_value = True
+        networkctl_mock.return_value = ''
+        networkctl_status_mock.return_value = {}
+        ssid_mock.return_value = 'MYCON'
+        iproute2 = SystemConfigState.process_generic(IPROUTE2) + [FAKE_DEV]
+        nd = SystemConfigState.process_networkd(NETWORKD)
+        nm = SystemConfigState.process_nm(NMCLI)
+        routes = (SystemConfigState.process_generic(ROUTE4), SystemConfigState.process_generic(ROUTE6))
+        dns = (DNS_ADDRESSES, DNS_SEARCH)
+        iproute2_mock.return_value = iproute2
+        networkd_mock.return_value = nd
+        nm_mock.return_value = nm
+        routes_mock.return_value = routes
+        rd_mock.return_value = dns
+        resolvconf_mock.return_value = {'addresses': [], 'search': [], 'mode': None}
+        state = SystemConfigState(all=True)
+        state.get_data()
+        # 'networkctl status' is queried once, for the networkd and wifi interfaces
+        networkctl_status_mock.assert_called_once_with(['enp0s31f6', 'wlan0', 'wg0', 'tun0'])
+        networkctl_mock.assert_not_called()
+        # each interface gets the same data, as when scanning all of it
+        self.assertEqual([itf.json() for itf in state.interface_list],
+                         [Interface(itf, nd, nm, dns, routes).json() for itf in iproute2])
+        self.assertEqual(state.get_data()['wlan0']['dns_search'], ['search.domain'])
+        self.assertNotIn('routes', state.get_data()['fakedev0'])
+
+    @patch('netplan_cli.cli.utils.systemctl')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_netlink_routes')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_netlink_links')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_iproute2')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_networkd')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_nm')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_routes')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_resolved')
+    @patch('netplan_cli.cli.state.SystemConfigState.resolvconf_json')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_online_state')
+    def test_system_state_update(self, online_mock, resolvconf_mock, rd_mock, routes_mock, nm_mock,
+                                 networkd_mock, iproute2_mock, links_mock, netlink_routes_mock, systemctl_mock):
+        systemctl_mock.return_value = None
+        links_mock.return_value = None
+        netlink_routes_mock.return_value = None
+        iproute2_mock.return_value = [FAKE_DEV]
+        networkd_mock.return_value = SystemConfigState.process_networkd(NETWORKD)
+        nm_mock.return_value = []
+        routes_mock.return_value = (None, None)
+        rd_mock.return_value = (None, None)
+        resolvconf_mock.return_value = {'addresses': [], 'search': [], 'mode': None}
+        online_mock.return_value = False
+        state = SystemConfigState(all=True)
+        self.assertEqual(state.get_data()['fakedev0']['operstate'], 'DOWN')
+
+        # only the changed interface is queried again
+        dev = copy.deepcopy(FAKE_DEV)
+        dev['operstate'] = 'UP'
+        links_mock.return_value = [dev]
+        netlink_routes_mock.return_value = ([], [])
+        changes = state.update([FAKE_DEV['ifindex']])
+        links_mock.assert_called_with(FAKE_DEV['ifindex'])
+        self.assertEqual(netlink_routes_mock.call_args[0], (FAKE_DEV['ifindex'],))
+        self.assertEqual(list(changes), ['fakedev0'])
+        self.assertEqual(changes['fakedev0']['operstate'], 'UP')
+
+        # nothing changed
+        self.assertEqual(state.update([FAKE_DEV['ifindex']]), {})
+
+        # the global state is refreshed regardless
+        online_mock.return_value = True
+        self.assertEqual(list(state.update([])), ['netplan-global-state'])
+
+        # the interface is gone
+        links_mock.return_value = []
+        self.assertEqual(state.update([FAKE_DEV['ifindex']]), {'fakedev0': None})
+        self.assertEqual(state.interface_list, [])
+
+        # full refresh, falling back to iproute2
+        links_mock.return_value = None
+        self.assertEqual(list(state.update()), ['fakedev0'])
+        self.assertEqual(state.get_data()['fakedev0']['operstate'], 'DOWN')
+
+    @patch('netplan_cli.cli.utils.systemctl_is_active')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_netplan_route_tables')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_links')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_networkd')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_nm')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_route_tables')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_resolved')
+    @patch('netplan_cli.cli.state.SystemConfigState.resolvconf_json')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_online_state')
+    def test_system_state_single_interface(self, online_mock, resolvconf_mock, rd_mock, routes_mock, nm_mock,
+                                           networkd_mock, links_mock, tables_mock, is_active_mock):
+        is_active_mock.return_value = True
+        tables_mock.return_value = set()
+        links_mock.return_value = [FAKE_DEV]
+        networkd_mock.return_value = SystemConfigState.process_networkd(NETWORKD)
+        nm_mock.return_value = []
+        routes_mock.return_value = ([], [])
+        rd_mock.return_value = (None, None)
+        resolvconf_mock.return_value = {'addresses': [], 'search': [], 'mode': None}
+        state = SystemConfigState('fakedev0')
+        links_mock.assert_called_once_with('fakedev0')
+        networkd_mock.assert_called_once_with(ifindex=42)
+        nm_mock.assert_called_once_with(device='fakedev0')
+        self.assertEqual((routes_mock.call_args[1]['oif'], routes_mock.call_args[1]['dev']), (42, 'fakedev0'))
+        online_mock.assert_not_called()
+        self.assertEqual(list(state.get_data()), ['netplan-global-state', 'fakedev0'])
+        self.assertNotIn('online', state.get_data()['netplan-global-state'])
+
+        # changes of other interfaces are ignored
+        self.assertEqual(state.update([2]), {})
+        links_mock.assert_called_once()
+        # changes of the requested interface query it again
+        links_mock.return_value = []
+        self.assertEqual(state.update([42]), {'fakedev0': None})
+        links_mock.assert_called_with('fakedev0')
+
+    @patch('netplan_cli.cli.utils.systemctl_is_active')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_netplan_route_tables')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_links')
+    def test_system_state_single_interface_missing(self, links_mock, tables_mock, is_active_mock):
+        is_active_mock.return_value = True
+        tables_mock.return_value = set()
+        links_mock.return_value = []
+        with self.assertLogs() as cm, self.assertRaises(SystemExit):
+            SystemConfigState('notaninterface0')
+        self.assertIn('Could not find interface notaninterface0', cm.output[0])
+
+    def test_process_generic_stream(self):
+        stream = io.StringIO(ROUTE6)
+        self.assertEqual(list(SystemConfigState.process_generic_stream(stream, chunk_size=7)),
+                         SystemConfigState.process_generic(ROUTE6))
+        self.assertEqual(list(SystemConfigState.process_generic_stream(io.StringIO('[ ]\n'))), [])
+        with self.assertRaises(ValueError):
+            list(SystemConfigState.process_generic_stream(io.StringIO('[{"dst": "default"'), chunk_size=4))
+
+    def test_query_netplan_route_tables(self):
+        with tempfile.TemporaryDirectory(prefix='netplan_') as rootdir:
+            os.makedirs(os.path.join(rootdir, 'etc', 'netplan'))
+            with open(os.path.join(rootdir, 'etc', 'netplan', '50-tables.yaml'), 'w') as f:
+                f.write('''network:
+  renderer: networkd
+  ethernets:
+    eth0:
+      routes:
+        - {to: 10.0.0.0/8, via: 10.0.0.1, table: 1000}
+        - {to: default, via: 10.0.0.1}
+      routing-policy:
+        - {from: 10.0.0.0/8, table: 1001}
+      dhcp4-overrides: {route-table: 1002}
+      dhcp6-overrides: {route-table: 1003}
+    eth1:
+      routes:
+        - {to: 10.1.0.0/16, via: 10.1.0.1, table: 1000}
+    eth2:
+      dhcp4: true
+  vrfs:
+    vrf0:
+      table: 1004
+      interfaces: [eth2]''')
+            self.assertEqual(SystemConfigState.query_netplan_route_tables(rootdir),
+                             {1000, 1001, 1002, 1003, 1004})
+            # no temporary directory is left behind
+            self.assertEqual(os.listdir(rootdir), ['etc'])
+
+    @patch('netplan.Parser.load_yaml_hierarchy')
+    def test_query_netplan_route_tables_unreadable(self, load_mock):
+        load_mock.side_effect = netplan.NetplanFileException('Permission denied', 1, 13)
+        with self.assertLogs(level='WARNING') as cm:
+            self.assertEqual(SystemConfigState.query_netplan_route_tables(), set())
+        self.assertIn('Cannot read the netplan configuration', cm.output[0])
+        self.assertIn('Permission denied', cm.output[0])
+
+    @patch('netplan_cli.cli.utils.systemctl_is_active')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_netplan_route_tables')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_iproute2')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_networkd')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_nm')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_route_tables')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_resolved')
+    @patch('netplan_cli.cli.state.SystemConfigState.resolvconf_json')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_online_state')
+    def test_system_state_route_tables(self, online_mock, resolvconf_mock, rd_mock, routes_mock, nm_mock,
+                                       networkd_mock, iproute2_mock, tables_mock, is_active_mock):
+        is_active_mock.return_value = True
+        iproute2_mock.return_value = [FAKE_DEV]
+        networkd_mock.return_value = SystemConfigState.process_networkd(NETWORKD)
+        nm_mock.return_value = []
+        rd_mock.return_value = (None, None)
+        resolvconf_mock.return_value = {'addresses': [], 'search': [], 'mode': None}
+        online_mock.return_value = False
+        tables_mock.return_value = {1000, 100}
+
+        def routes(tables, hide_protocols, hidden, oif, dev):
+            hidden[('fakedev0', 'bgp')] += 1000000
+            return (None, None)
+        routes_mock.side_effect = routes
+        state = SystemConfigState(all=True)
+        routes_mock.assert_called_once_with(tables=[100, 254, 1000], hide_protocols=['bgp', 'zebra'],
+                                            hidden=Counter({('fakedev0', 'bgp'): 1000000}), oif=None, dev=None)
+        self.assertEqual(state.get_data()['fakedev0']['hidden_routes'], {'bgp': 1000000})
+
+        # verbose output shows everything
+        routes_mock.reset_mock()
+        routes_mock.side_effect = None
+        routes_mock.return_value = (None, None)
+        state = SystemConfigState(all=True, verbose=True)
+        routes_mock.assert_called_once_with(tables=None, hide_protocols=[], hidden=Counter(), oif=None, dev=None)
+        self.assertNotIn('hidden_routes', state.get_data()['fakedev0'])
+
+    def test_index_by(self):
+        data = [{'dev': 'eth0', 'dst': 'a'}, {'dev': 'eth1', 'dst': 'b'}, {'dev': 'eth0', 'dst': 'c'}]
+        index = SystemConfigState.index_by(data, lambda x: x['dev'])
+        self.assertEqual(index['eth0'], [data[0], data[2]])
+        self.assertEqual(index['eth1'], [data[1]])
+        self.assertEqual(SystemConfigState.index_by(None, lambda x: x['dev']), {})
+
 
 class TestNetplanState(unittest.TestCase):
     '''Test netplan state NetplanConfigState class'''
@@ -281,7 +699,7 @@ class TestInterface(unittest.TestCase):
         res = itf.query_nm_ssid(con)
         mock.assert_called_with(['nmcli', '--get-values', '802-11-wireless.ssid',
                                  'con', 'show', 'id', con],
-                                text=True)
+                                text=True, timeout=None)
         self.assertEqual(res, 'MYSSID')
 
     @patch('subprocess.check_output')
@@ -293,7 +711,7 @@ class TestInterface(unittest.TestCase):
             res = itf.query_nm_ssid(con)
             mock.assert_called_with(['nmcli', '--get-values', '802-11-wireless.ssid',
                                      'con', 'show', 'id', con],
-                                    text=True)
+                                    text=True, timeout=None)
             self.assertIsNone(res)
             self.assertIn('WARNING:root:Cannot query NetworkManager SSID for {}:'.format(con), cm.output[0])
 
@@ -303,7 +721,7 @@ class TestInterface(unittest.TestCase):
         dev = 'fakedev0'
         itf = Interface(FAKE_DEV, [])
         res = itf.query_networkctl(dev)
-        mock.assert_called_with(['networkctl', 'status', '--', dev], text=True)
+        mock.assert_called_with(['networkctl', 'status', '--', dev], text=True, timeout=OPTIONAL_QUERY_TIMEOUT)
         self.assertEqual(res, mock.return_value)
 
     @patch('subprocess.check_output')
@@ -313,10 +731,55 @@ class TestInterface(unittest.TestCase):
         itf = Interface(FAKE_DEV, [])
         with self.assertLogs() as cm:
             res = itf.query_networkctl(dev)
-            mock.assert_called_with(['networkctl', 'status', '--', dev], text=True)
+            mock.assert_called_with(['networkctl', 'status', '--', dev], text=True, timeout=OPTIONAL_QUERY_TIMEOUT)
             self.assertIsNone(res)
             self.assertIn('WARNING:root:Cannot query networkctl for {}:'.format(dev), cm.output[0])
 
+    @patch('subprocess.check_output')
+    def test_query_networkctl_status(self, mock):
+        mock.return_value = '''\
+● 2: enp0s31f6
+                     Link File: /usr/lib/systemd/network/99-default.link
+             Activation Policy: manual
+
+● 5: wlan0
+             WiFi access point: MYCON (b4:fb:e4:75:c6:21)
+'''
+        res = SystemConfigState.query_networkctl_status(['enp0s31f6', 'wlan0'])
+        mock.assert_called_with(['networkctl', 'status', '--', 'enp0s31f6', 'wlan0'], text=True,
+                                timeout=OPTIONAL_QUERY_TIMEOUT)
+        self.assertEqual(list(res), ['enp0s31f6', 'wlan0'])
+        self.assertIn('Activation Policy: manual', res['enp0s31f6'])
+        self.assertNotIn('WiFi access point', res['enp0s31f6'])
+        self.assertIn('WiFi access point: MYCON', res['wlan0'])
+
+    @patch('subprocess.check_output')
+    def test_query_networkctl_status_fail(self, mock):
+        mock.side_effect = subprocess.CalledProcessError(1, '', 'ERR')
+        self.assertIsNone(SystemConfigState.query_networkctl_status(['fakedev0']))
+        self.assertEqual(SystemConfigState.query_networkctl_status([]), {})
+
+    @patch('subprocess.check_output')
+    def test_query_networkctl_status_timeout(self, mock):
+        mock.side_effect = subprocess.TimeoutExpired(['networkctl'], OPTIONAL_QUERY_TIMEOUT)
+        # the interfaces do not fall back to querying their own status
+        self.assertEqual(SystemConfigState.query_networkctl_status(['fakedev0']), {})
+        mock.assert_called_once()
+
+    @patch('netplan_cli.cli.state.Interface.query_networkctl')
+    def test_json_nd_fields(self, networkctl_mock):
+        nd = SystemConfigState.process_networkd(NETWORKD)
+        for link in nd:
+            link['ActivationPolicy'] = 'manual' if link['Name'] == 'enp0s31f6' else 'up'
+            if link['Type'] == 'wlan':
+                link['SSID'] = 'MYCON'
+        itfs = dict((itf['ifname'], Interface(itf, nd)) for itf in yaml.safe_load(IPROUTE2))
+        self.assertFalse(any(itf.needs_networkctl_status for itf in itfs.values()))
+        self.assertEqual(itfs['enp0s31f6'].activation_mode, 'manual')
+        self.assertIsNone(itfs['wg0'].activation_mode)
+        self.assertEqual(itfs['wlan0'].ssid, 'MYCON')
+        networkctl_mock.assert_not_called()
+
     @patch('netplan_cli.cli.state.Interface.query_nm_ssid')
     @patch('netplan_cli.cli.state.Interface.query_networkctl')
     def test_json_nm_wlan0(self, networkctl_mock, nm_ssid_mock):
@@ -351,6 +814,43 @@ class TestInterface(unittest.TestCase):
         self.assertEqual(len(json.get('dns_search')), 1)
         self.assertEqual(len(json.get('routes')), 6)
 
+    @patch('netplan_cli.cli.state.Interface.query_nm_ssid')
+    @patch('netplan_cli.cli.state.Interface.query_networkctl')
+    def test_properties_cached(self, networkctl_mock, nm_ssid_mock):
+        nm_ssid_mock.return_value = 'MYCON'
+        networkctl_mock.return_value = 'WiFi access point: MYCON (b4:fb:e4:75:c6:21)'
+        data = next((itf for itf in yaml.safe_load(IPROUTE2) if itf['ifindex'] == 5), {})
+        nd = SystemConfigState.process_networkd(NETWORKD)
+        nm = SystemConfigState.process_nm(NMCLI)
+        itf = Interface(data, nd, nm)
+        # nothing is queried, before it is needed
+        nm_ssid_mock.assert_not_called()
+        networkctl_mock.assert_not_called()
+        self.assertEqual(itf.json(), itf.json())
+        # ... and only once
+        nm_ssid_mock.assert_called_once_with('MYCON')
+        networkctl_mock.assert_called_once_with('wlan0')
+        self.assertEqual(itf.netdef_id, 'NM-b6b7a21d-186e-45e1-b3a6-636da1735563')
+        nm_ssid_mock.assert_called_once()
+        # unknown types are reported once
+        itf = Interface(FAKE_DEV, [])
+        with self.assertLogs(level='WARNING') as cm:
+            itf.json()
+            itf.json()
+        self.assertEqual(cm.output, ['WARNING:root:Unknown device type: None'])
+        # the records are compact
+        self.assertFalse(hasattr(itf, '__dict__'))
+
+    @patch('netplan_cli.cli.state.Interface.query_nm_ssid')
+    def test_netdef_id_nm_ssid(self, nm_ssid_mock):
+        data = next((itf for itf in yaml.safe_load(IPROUTE2) if itf['ifindex'] == 5), {})
+        nm = SystemConfigState.process_nm(NMCLI)
+        nm[0]['ssid'] = 'MYCON'
+        itf = Interface(data, SystemConfigState.process_networkd(NETWORKD), nm)
+        self.assertEqual(itf.netdef_id, 'NM-b6b7a21d-186e-45e1-b3a6-636da1735563')
+        # the SSID was queried along with the connections already
+        nm_ssid_mock.assert_not_called()
+
     @patch('netplan_cli.cli.state.Interface.query_networkctl')
     def test_json_nd_enp0s31f6(self, networkctl_mock):
         # networkctl mock output reduced to relevant lines
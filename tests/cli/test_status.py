@@ -18,12 +18,13 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import io
+import threading
 import unittest
 import yaml
 
 from contextlib import redirect_stdout
-from unittest.mock import patch
-from netplan_cli.cli.commands.status import NetplanStatus
+from unittest.mock import MagicMock, patch
+from netplan_cli.cli.commands.status import NetplanStatus, StatusWatcher, dbus_path_ifindex
 from netplan_cli.cli.state import Interface, SystemConfigState
 from tests.test_utils import call_cli
 
@@ -96,6 +97,10 @@ class TestStatus(unittest.TestCase):
 
     def setUp(self):
         self.maxDiff = None
+        # use the (mocked) iproute2 data, instead of querying netlink
+        patcher = patch('netplan_cli.cli.netlink.Netlink', side_effect=OSError('unavailable'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
     def _call(self, args):
         args.insert(0, 'status')
@@ -244,6 +249,25 @@ class TestStatus(unittest.TestCase):
                    default via fe80::cece:1eff:fe3d:c737 metric 100 table 1234 (ra)
   Activation Mode: manual\n\n''')
 
+    @patch('netplan_cli.cli.commands.status.RICH_OUTPUT', False)
+    def test_plain_print_hidden_routes(self):
+        dev = dict(FAKE_DEV, flags=['UP'], operstate='UP')
+        routes = ([{'dst': 'default', 'gateway': '10.0.0.1', 'dev': 'fakedev0', 'table': 'main', 'protocol': 'bgp'}],
+                  None)
+        itf = Interface(dev, [], [], (None, None), routes, {'bgp': 999999, 'zebra': 1})
+        ifname, obj = itf.json()
+        self.assertEqual(obj['hidden_routes'], {'bgp': 999999, 'zebra': 1})
+        f = io.StringIO()
+        with redirect_stdout(f):
+            status = NetplanStatus()
+            status.verbose = False
+            status.pretty_print({'netplan-global-state': {}, ifname: obj}, 1)
+            out = f.getvalue()
+        self.assertIn('''\
+           Routes: default via 10.0.0.1 (bgp)
+                   1000000 more (bgp: 999999, zebra: 1), use "--verbose" to show
+''', out)
+
     @patch('netplan_cli.cli.utils.systemctl')
     @patch('netplan_cli.cli.state.SystemConfigState.query_iproute2')
     @patch('netplan_cli.cli.state.SystemConfigState.query_networkd')
@@ -290,21 +314,22 @@ Online state: offline
     def test_call_cli_ifname(self, online_mock, resolvconf_mock, rd_mock, routes_mock, nm_mock, networkd_mock, iproute2_mock,
                              systemctl_mock):
         systemctl_mock.return_value = None
-        iproute2_mock.return_value = [FAKE_DEV, self._get_itf('wlan0')]
+        iproute2_mock.return_value = [FAKE_DEV]
         nm_mock.return_value = []
         routes_mock.return_value = (None, None)
         rd_mock.return_value = (None, None)
         resolvconf_mock.return_value = {'addresses': [], 'search': [], 'mode': None}
         online_mock.return_value = False
-        state = SystemConfigState()
-        networkd_mock.return_value = state.process_networkd(NETWORKD)
+        networkd_mock.return_value = SystemConfigState.process_networkd(NETWORKD)
         out = self._call([FAKE_DEV['ifname']])
+        # only the requested interface is queried, the online state is unknown
         self.assertEqual(out.strip(), '''\
-Online state: offline
-
-● 42: fakedev0 other DOWN (unmanaged)
-
-1 inactive interfaces hidden. Use "--all" to show all.''')
+● 42: fakedev0 other DOWN (unmanaged)''')
+        iproute2_mock.assert_called_once_with(dev=FAKE_DEV['ifname'])
+        networkd_mock.assert_called_once_with(ifindex=FAKE_DEV['ifindex'])
+        nm_mock.assert_called_once_with(device=FAKE_DEV['ifname'])
+        self.assertEqual(routes_mock.call_args[1]['dev'], FAKE_DEV['ifname'])
+        online_mock.assert_not_called()
 
     @patch('netplan_cli.cli.utils.systemctl')
     @patch('netplan_cli.cli.state.SystemConfigState.query_iproute2')
@@ -421,3 +446,165 @@ netplan-global-state:
             self._call([])
         self.assertEqual(1, e.exception.code)
         self.assertIn('systemd-networkd.service is masked', cm.output[0])
+
+    @patch('netplan_cli.cli.netlink.Monitor')
+    @patch('netplan_cli.cli.utils.systemctl')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_iproute2')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_networkd')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_nm')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_routes')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_resolved')
+    @patch('netplan_cli.cli.state.SystemConfigState.resolvconf_json')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_online_state')
+    def test_call_cli_watch_json(self, online_mock, resolvconf_mock, rd_mock, routes_mock, nm_mock, networkd_mock,
+                                 iproute2_mock, systemctl_mock, monitor_mock):
+        systemctl_mock.return_value = None
+        iproute2_mock.return_value = [FAKE_DEV]
+        nm_mock.return_value = []
+        routes_mock.return_value = (None, None)
+        rd_mock.return_value = (None, None)
+        resolvconf_mock.return_value = {'addresses': [], 'search': [], 'mode': None}
+        online_mock.return_value = False
+        networkd_mock.return_value = SystemConfigState.process_networkd(NETWORKD)
+
+        def run(watcher):
+            watcher.callback({'fakedev0': None})
+            raise KeyboardInterrupt()
+
+        with patch.object(StatusWatcher, 'run', autospec=True, side_effect=run):
+            out = self._call(['-a', '--format=json', '--watch'])
+        # the whole state, followed by a line per change
+        self.assertEqual(out, '''{\
+"netplan-global-state": {"online": false, "nameservers": {"addresses": [], "search": [], "mode": null}}, \
+"fakedev0": {"index": 42, "adminstate": "DOWN", "operstate": "DOWN"}}
+{"fakedev0": null}\n''')
+        monitor_mock.return_value.close.assert_called_once()
+
+    @patch('netplan_cli.cli.utils.systemctl')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_iproute2')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_networkd')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_nm')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_routes')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_resolved')
+    @patch('netplan_cli.cli.state.SystemConfigState.resolvconf_json')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_online_state')
+    def test_call_cli_openmetrics(self, online_mock, resolvconf_mock, rd_mock, routes_mock, nm_mock, networkd_mock,
+                                  iproute2_mock, systemctl_mock):
+        systemctl_mock.return_value = None
+        iproute2_mock.return_value = [FAKE_DEV]
+        nm_mock.return_value = []
+        routes_mock.return_value = (None, None)
+        rd_mock.return_value = (None, None)
+        online_mock.return_value = False
+        networkd_mock.return_value = SystemConfigState.process_networkd(NETWORKD)
+        out = self._call(['-a', '--format=openmetrics'])
+        self.assertIn('netplan_online 0\n', out)
+        self.assertIn('netplan_interface_oper_up{interface="fakedev0"} 0\n', out)
+        self.assertIn('netplan_status_collection_duration_seconds_count 1\n', out)
+        self.assertTrue(out.endswith('# EOF\n'))
+        # the nameservers are not part of the metrics
+        resolvconf_mock.assert_not_called()
+
+    @patch('netplan_cli.cli.metrics.make_server')
+    @patch('netplan_cli.cli.netlink.Monitor')
+    @patch('netplan_cli.cli.utils.systemctl')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_iproute2')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_networkd')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_nm')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_routes')
+    @patch('netplan_cli.cli.state.SystemConfigState.query_resolved')
+    @patch('netplan_cli.cli.state.SystemConfigState.update')
+    def test_call_cli_serve_metrics(self, update_mock, rd_mock, routes_mock, nm_mock, networkd_mock,
+                                    iproute2_mock, systemctl_mock, monitor_mock, server_mock):
+        systemctl_mock.return_value = None
+        iproute2_mock.return_value = [FAKE_DEV]
+        nm_mock.return_value = []
+        routes_mock.return_value = (None, None)
+        rd_mock.return_value = (None, None)
+        networkd_mock.return_value = SystemConfigState.process_networkd(NETWORKD)
+        update_mock.return_value = {}
+        server = server_mock.return_value
+        flushed = threading.Event()
+
+        def run(watcher):
+            watcher.changed = True
+            watcher.flush()
+            flushed.set()
+
+        def serve_forever():
+            flushed.wait(10)
+            raise KeyboardInterrupt()
+
+        server.serve_forever.side_effect = serve_forever
+        with patch.object(StatusWatcher, 'run', autospec=True, side_effect=run):
+            self._call(['--serve-metrics', '/run/netplan/metrics.sock'])
+        exporter = server_mock.call_args[0][1]
+        self.assertEqual(server_mock.call_args[0][0], '/run/netplan/metrics.sock')
+        # the state is kept warm, both collections are observed
+        update_mock.assert_called_once_with(set())
+        self.assertEqual(exporter.histogram.count, 2)
+        server.server_close.assert_called_once()
+        monitor_mock.return_value.close.assert_called_once()
+
+    @patch('netplan_cli.cli.metrics.make_server')
+    @patch('netplan_cli.cli.state.SystemConfigState.__init__', return_value=None)
+    def test_fail_cli_serve_metrics(self, init_mock, server_mock):
+        server_mock.side_effect = OSError('Address already in use')
+        with self.assertRaises(SystemExit):
+            self._call(['--serve-metrics', '9000'])
+
+    def test_dbus_path_ifindex(self):
+        self.assertEqual(dbus_path_ifindex('/org/freedesktop/network1/link/_32'), 2)
+        self.assertEqual(dbus_path_ifindex('/org/freedesktop/resolve1/link/_3142'), 142)
+        self.assertIsNone(dbus_path_ifindex('/org/freedesktop/resolve1'))
+        self.assertIsNone(dbus_path_ifindex(None))
+
+    @patch('netplan_cli.cli.netlink.Monitor')
+    def test_watcher_flush(self, monitor_mock):
+        state = MagicMock()
+        state.update.return_value = {'eth0': {}}
+        callback = MagicMock()
+        watcher = StatusWatcher(state, callback)
+        # nothing happened
+        watcher.flush()
+        state.update.assert_not_called()
+
+        monitor_mock.return_value.read.return_value = {2}
+        watcher.on_netlink()
+        watcher.on_properties_changed('org.freedesktop.resolve1.Link', {}, [],
+                                      path='/org/freedesktop/resolve1/link/_35')
+        watcher.flush()
+        state.update.assert_called_once_with({2, 5})
+        callback.assert_called_once_with({'eth0': {}})
+
+        # lost notifications lead to a full refresh
+        monitor_mock.return_value.read.return_value = None
+        watcher.on_netlink()
+        watcher.on_properties_changed('org.freedesktop.network1.Link', {}, [],
+                                      path='/org/freedesktop/network1/link/_32')
+        watcher.flush()
+        state.update.assert_called_with(None)
+
+        # global changes refresh the global state
+        state.update.return_value = {}
+        watcher.on_properties_changed('org.freedesktop.resolve1.Manager', {}, [], path='/org/freedesktop/resolve1')
+        watcher.flush()
+        state.update.assert_called_with(set())
+        self.assertEqual(callback.call_count, 2)
+
+    @patch('time.monotonic')
+    @patch('select.select')
+    @patch('netplan_cli.cli.netlink.Monitor')
+    def test_watcher_run_select(self, monitor_mock, select_mock, monotonic_mock):
+        state = MagicMock()
+        state.update.return_value = {'eth0': {}}
+        callback = MagicMock()
+        monitor_mock.return_value.read.side_effect = [{2}, {3}]
+        select_mock.return_value = ([monitor_mock.return_value], [], [])
+        monotonic_mock.side_effect = [0, 1, 61]
+        watcher = StatusWatcher(state, callback, delay=60)
+        watcher.run_select(iterations=1)
+        # both notifications are handled at once
+        self.assertEqual(select_mock.call_count, 2)
+        state.update.assert_called_once_with({2, 3})
+        callback.assert_called_once_with({'eth0': {}})
@@ -17,17 +17,22 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import io
+import json
 import os
 import shutil
+import socket
 import sys
 import unittest
 import subprocess
 import tempfile
 
 from unittest.mock import patch
+from netplan_cli.cli import profiling, utils
 from netplan_cli.cli.commands.apply import NetplanApply
 from netplan_cli.cli.commands.try_command import NetplanTry
 from netplan_cli.cli.core import Netplan
+from netplan_cli.configmanager import ConfigManager
 
 
 class TestCLI(unittest.TestCase):
@@ -95,6 +100,263 @@ class TestCLI(unittest.TestCase):
             self.assertEqual(ctx.output, ['WARNING:root:Cannot clear virtual links: no network interfaces provided.'])
         mock.assert_not_called()
 
+    def _parse_config(self, yaml):
+        with open(os.path.join(self.tmproot, 'etc/netplan/a.yaml'), 'w') as f:
+            f.write(yaml)
+        config_manager = ConfigManager(self.tmproot)
+        config_manager.parse()
+        return config_manager
+
+    @patch('netplan_cli.cli.utils.get_interface_driver_name')
+    @patch('netplan_cli.cli.utils.get_interface_macaddress')
+    def test_networkd_changed_links(self, gim, gidn):
+        gidn.return_value = 'foo'
+        gim.side_effect = lambda x: '00:01:02:03:04:05' if x == 'eth1' else '00:00:00:00:00:00'
+        config_manager = self._parse_config('''network:
+  ethernets:
+    eth0: {}
+    nic:
+      match:
+        macaddress: "00:01:02:03:04:05"
+    renamed:
+      match:
+        name: "ens3"
+      set-name: "lan0"
+  vlans:
+    eth0.100:
+      id: 100
+      link: eth0
+    eth0.101:
+      id: 101
+      link: eth0''')
+        devices = ['lo', 'eth0', 'eth1', 'lan0', 'eth0.100', 'eth0.101']
+        res = NetplanApply.networkd_changed_links({'nic', 'renamed', 'eth0.100'}, config_manager, devices)
+        self.assertEqual(res, {'eth1', 'lan0', 'eth0.100'})
+
+    def test_networkd_changed_links_dropped(self):
+        config_manager = self._parse_config('''network:
+  ethernets:
+    eth0: {}''')
+        # dropped virtual link which still exists
+        res = NetplanApply.networkd_changed_links({'br0'}, config_manager, ['eth0', 'br0'])
+        self.assertEqual(res, {'br0'})
+        # dropped netdef which cannot be mapped to a link anymore
+        res = NetplanApply.networkd_changed_links({'eth0', 'nic'}, config_manager, ['eth0', 'eth1'])
+        self.assertIsNone(res)
+
+    @patch('netplan_cli.cli.utils.generated_files_digests')
+    def test_apply_stamp(self, digests):
+        stamp = os.path.join(self.tmproot, 'run', 'netplan', 'netplan-apply.json')
+        digests.return_value = {'/run/systemd/network/10-netplan-eth0.network': 'abc'}
+        with patch('netplan_cli.cli.commands.apply.APPLY_STAMP', stamp):
+            self.assertFalse(NetplanApply.is_applied('config-digest'))
+            NetplanApply.write_apply_stamp('config-digest', digests.return_value)
+            self.assertTrue(NetplanApply.is_applied('config-digest'))
+            self.assertFalse(NetplanApply.is_applied('other-digest'))
+            # generated files were modified behind our back
+            digests.return_value = {'/run/systemd/network/10-netplan-eth0.network': 'def'}
+            self.assertFalse(NetplanApply.is_applied('config-digest'))
+            NetplanApply.clear_apply_stamp()
+            self.assertFalse(os.path.exists(stamp))
+            NetplanApply.clear_apply_stamp()
+
+    def _write_generated(self, files):
+        for path, content in files.items():
+            path = os.path.join(self.tmproot, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write(content)
+        return utils.generated_files_digests(self.tmproot)
+
+    def test_applied_digests_pregenerated(self):
+        stamp = os.path.join(self.tmproot, 'run', 'netplan', 'netplan-apply.json')
+        eth0 = os.path.join(self.tmproot, 'run/systemd/network/10-netplan-eth0.network')
+        nm_eth1 = os.path.join(self.tmproot, 'run/NetworkManager/system-connections/netplan-eth1.nmconnection')
+        with patch('netplan_cli.cli.commands.apply.APPLY_STAMP', stamp):
+            applied = self._write_generated({'run/systemd/network/10-netplan-eth0.network': '[Network]\nDHCP=no\n',
+                                             nm_eth1: '[connection]\n'})
+            NetplanApply.write_apply_stamp('config-digest', applied)
+            # the new configuration was generated already, e.g. by 'netplan generate'
+            os.remove(nm_eth1)
+            pre = self._write_generated({eth0: '[Network]\nDHCP=yes\n'})
+            # so the generator run of 'netplan apply' does not change anything
+            new = dict(pre)
+            old = NetplanApply.applied_digests(NetplanApply.read_apply_stamp(), pre, new)
+            self.assertEqual(utils.generated_files_changes(old, new), {
+                'networkd': {'eth0': {eth0}}, 'NetworkManager': {'eth1': {nm_eth1}}, 'OpenVSwitch': {}})
+            # if the last apply is unknown, everything is considered as changed
+            NetplanApply.clear_apply_stamp()
+            old = NetplanApply.applied_digests(NetplanApply.read_apply_stamp(), applied, new)
+            self.assertEqual(utils.generated_files_changes(old, new), {
+                'networkd': {'eth0': {eth0}}, 'NetworkManager': {'eth1': {nm_eth1}}, 'OpenVSwitch': {}})
+            old = NetplanApply.applied_digests(None, pre, new)
+            self.assertEqual(utils.generated_files_changes(old, new), {
+                'networkd': {'eth0': {eth0}}, 'NetworkManager': {}, 'OpenVSwitch': {}})
+
+    @patch('netplan_cli.cli.utils.get_interface_driver_name')
+    @patch('netplan_cli.cli.utils.get_interface_macaddress')
+    def test_networkd_changed_links_pregenerated(self, gim, gidn):
+        gidn.return_value = 'foo'
+        gim.return_value = '00:00:00:00:00:00'
+        config_manager = self._parse_config('''network:
+  ethernets:
+    eth0:
+      dhcp4: true
+    eth1: {}''')
+        eth0 = os.path.join(self.tmproot, 'run/systemd/network/10-netplan-eth0.network')
+        eth1 = os.path.join(self.tmproot, 'run/systemd/network/10-netplan-eth1.network')
+        applied = self._write_generated({eth0: '[Network]\nDHCP=no\n', eth1: '[Network]\n'})
+        # the files were re-generated by the systemd generator, on daemon-reload
+        new = self._write_generated({eth0: '[Network]\nDHCP=ipv4\n'})
+        old = NetplanApply.applied_digests({'config': 'config-digest', 'generated': applied}, new, new)
+        changed_ids = set(utils.generated_files_changes(old, new)['networkd'])
+        res = NetplanApply.networkd_changed_links(changed_ids, config_manager, ['lo', 'eth0', 'eth1'])
+        self.assertEqual(res, {'eth0'})
+
+    def test_udev_changes_pregenerated(self):
+        link = os.path.join(self.tmproot, 'run/systemd/network/10-netplan-eth0.link')
+        rules = os.path.join(self.tmproot, 'run/udev/rules.d/99-netplan-eth1.rules')
+        applied = self._write_generated({link: '[Link]\nName=lan0\n', rules: 'SUBSYSTEM=="net"\n'})
+        # the .link file was re-generated already, by the systemd generator
+        new = self._write_generated({link: '[Link]\nName=lan1\n'})
+        old = NetplanApply.applied_digests({'config': 'config-digest', 'generated': applied}, new, new)
+        self.assertEqual(utils.generated_udev_changes(old, new), {'eth0'})
+        self.assertEqual(utils.generated_udev_changes(new, new), set())
+
+    def test_read_apply_stamp_invalid(self):
+        stamp = os.path.join(self.tmproot, 'netplan-apply.json')
+        with patch('netplan_cli.cli.commands.apply.APPLY_STAMP', stamp):
+            for content in ['{', '[]', '{"config": "config-digest"}']:
+                with open(stamp, 'w') as f:
+                    f.write(content)
+                self.assertIsNone(NetplanApply.read_apply_stamp())
+                self.assertFalse(NetplanApply.is_applied('config-digest'))
+
+    @patch('subprocess.call')
+    def test_generate(self, call):
+        with open(os.path.join(self.tmproot, 'etc/netplan/a.yaml'), 'w') as f:
+            f.write('''network:
+  ethernets:
+    eth0:
+      dhcp4: true''')
+        # the in-process generator is used, even if the test environment
+        # points NETPLAN_GENERATE_PATH to the generator binary, or asks for
+        # running it through valgrind
+        with patch.dict(os.environ, {'NETPLAN_GENERATE_PATH': '/non-existing', 'NETPLAN_PROFILE': '1'}):
+            self.assertTrue(NetplanApply.generate(ConfigManager(self.tmproot)))
+        self.assertTrue(os.path.isfile(os.path.join(self.tmproot, 'run/systemd/network/10-netplan-eth0.network')))
+        call.assert_called_once_with(['udevadm', 'control', '--reload'], stderr=subprocess.DEVNULL)
+
+    @patch('subprocess.call')
+    def test_generate_invalid(self, call):
+        with open(os.path.join(self.tmproot, 'etc/netplan/a.yaml'), 'w') as f:
+            f.write('''network:
+  ethernets:
+    eth0:
+      dhcp4: invalid''')
+        with self.assertLogs(level='ERROR'):
+            self.assertFalse(NetplanApply.generate(ConfigManager(self.tmproot)))
+        call.assert_not_called()
+
+    @patch('subprocess.call')
+    def test_generate_subprocess(self, call):
+        call.return_value = 0
+        env = {'NETPLAN_GENERATE_SUBPROCESS': '1', 'NETPLAN_GENERATE_PATH': '/path/to/generate'}
+        with patch.dict(os.environ, env):
+            self.assertTrue(NetplanApply.generate(ConfigManager(self.tmproot)))
+            call.return_value = 1
+            self.assertFalse(NetplanApply.generate(ConfigManager('/')))
+        self.assertEqual(call.call_args_list[0][0][0], ['/path/to/generate', '--root-dir', self.tmproot])
+        self.assertEqual(call.call_args_list[1][0][0], ['/path/to/generate'])
+
+    @patch('subprocess.check_call')
+    def test_udev_test_links(self, check_call):
+        def _check_call(cmd, **kwargs):
+            if cmd[-1] == '/sys/class/net/eth1':
+                raise subprocess.CalledProcessError(1, cmd)
+        check_call.side_effect = _check_call
+        NetplanApply.udev_test_links(['eth0', 'eth1', 'eth2'], max_jobs=2)
+        calls = sorted(tuple(c[0][0]) for c in check_call.call_args_list)
+        self.assertEqual(calls, [
+            ('udevadm', 'test', '/sys/class/net/eth0'),
+            ('udevadm', 'test', '/sys/class/net/eth2'),
+            ('udevadm', 'test-builtin', 'net_setup_link', '/sys/class/net/eth0'),
+            ('udevadm', 'test-builtin', 'net_setup_link', '/sys/class/net/eth1'),
+            ('udevadm', 'test-builtin', 'net_setup_link', '/sys/class/net/eth2')])
+
+    @patch('subprocess.check_call')
+    def test_udev_test_links_none(self, check_call):
+        NetplanApply.udev_test_links([])
+        check_call.assert_not_called()
+
+    @patch('netplan_cli.cli.profiling.journal_send')
+    def test_profiler(self, journal):
+        out = io.StringIO()
+        with patch('sys.stdout', out):
+            with self.assertRaises(subprocess.CalledProcessError):
+                with profiling.Profiler('apply', 'json') as profiler:
+                    profiler.start('generate')
+                    subprocess.check_call(['true'])
+                    subprocess.check_call(['true'])
+                    profiler.start('udev-trigger')
+                    subprocess.check_call(['sh', '-c', 'exit 3'])
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['command'], 'apply')
+        self.assertEqual(report['subprocesses'], 3)
+        self.assertEqual([p['phase'] for p in report['phases']], ['generate', 'udev-trigger'])
+        self.assertEqual(report['phases'][0]['subprocesses'], 2)
+        self.assertEqual(report['phases'][0]['exit-status'], 0)
+        self.assertNotIn('error', report['phases'][0])
+        self.assertEqual(report['phases'][1]['subprocesses'], 1)
+        self.assertEqual(report['phases'][1]['exit-status'], 3)
+        self.assertIn('error', report['phases'][1])
+        self.assertEqual(journal.call_count, 2)
+        fields = journal.call_args[0][0]
+        self.assertEqual(fields['NETPLAN_PHASE'], 'udev-trigger')
+        self.assertEqual(fields['NETPLAN_EXIT_STATUS'], 3)
+        # no subprocesses are accounted outside of a profiler
+        subprocess.check_call(['true'])
+        self.assertEqual(profiler.phases[1].subprocesses, 1)
+
+    def test_profiler_summary(self):
+        out = io.StringIO()
+        with patch('sys.stdout', out):
+            with self.assertRaises(SystemExit):
+                with profiling.Profiler('apply', 'text') as profiler:
+                    profiler.start('generate')
+                    profiler.start('sriov')
+                    sys.exit(os.EX_CONFIG)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[1].startswith('generate '))
+        self.assertTrue(lines[1].endswith(' 0'))
+        self.assertTrue(lines[2].startswith('sriov '))
+        self.assertTrue(lines[2].endswith(' {}'.format(os.EX_CONFIG)))
+        self.assertTrue(lines[3].startswith('total '))
+        self.assertEqual(profiler.phases[1].exit_status, os.EX_CONFIG)
+
+    @patch('netplan_cli.cli.profiling._audit_hook_installed', False)
+    @patch('sys.addaudithook')
+    def test_profiler_silent(self, addaudithook):
+        out = io.StringIO()
+        with patch('sys.stdout', out), patch('netplan_cli.cli.profiling.journal_send') as journal:
+            with profiling.Profiler('apply') as profiler:
+                profiler.start('generate')
+        self.assertEqual(out.getvalue(), '')
+        journal.assert_not_called()
+        # no audit hook is installed, if nothing gets reported
+        addaudithook.assert_not_called()
+        self.assertEqual(len(profiler.phases), 1)
+
+    def test_journal_send(self):
+        path = os.path.join(self.tmproot, 'journal.socket')
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.bind(path)
+            profiling.journal_send({'MESSAGE': 'multi\nline', 'NETPLAN_PHASE': 'generate'}, path)
+            self.assertEqual(sock.recv(4096), b'MESSAGE=multi line\nNETPLAN_PHASE=generate\n')
+        # does not fail, if the journal is not available
+        profiling.journal_send({'MESSAGE': 'test'}, os.path.join(self.tmproot, 'nonexistent'))
+
     def test_netplan_try_ready_stamp(self):
         stamp_file = os.path.join(self.tmproot, 'run', 'netplan', 'netplan-try.ready')
         cmd = NetplanTry()
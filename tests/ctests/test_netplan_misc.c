@@ -85,6 +85,27 @@ test_netplan_get_id_from_nm_filepath_buffer_is_the_exact_size(__unused void **st
     assert_int_equal(bytes_copied, 8); // size of some-id + null byte
 }
 
+void
+test_netplan_get_id_from_nm_filepath_size_query(__unused void **state)
+{
+
+    const char* filename = "/run/NetworkManager/system-connections/netplan-some-id-SOME-SSID.nmconnection";
+
+    ssize_t size = netplan_get_id_from_nm_filepath(filename, "SOME-SSID", NULL, 0);
+
+    assert_int_equal(size, 8); // size of some-id + null byte
+}
+
+void
+test_netplan_copy_string_size_query(__unused void **state)
+{
+    char buffer[8];
+
+    assert_int_equal(netplan_copy_string("some-id", NULL, 0), 8);
+    assert_int_equal(netplan_copy_string("some-id", buffer, sizeof(buffer)), 8);
+    assert_string_equal(buffer, "some-id");
+}
+
 void
 test_netplan_get_id_from_nm_filepath_filename_is_malformed(__unused void **state)
 {
@@ -348,6 +369,59 @@ test_normalize_ip_address(__unused void** state)
     assert_string_equal(normalize_ip_address("0.0.0.0/0", AF_INET), "0.0.0.0/0");
 }
 
+void
+test_netplan_netdefs_match_interfaces(__unused void** state)
+{
+    const char* yaml =
+        "network:\n"
+        "  ethernets:\n"
+        "    eth0: {}\n"
+        "    glob:\n"
+        "      match:\n"
+        "        name: en*\n"
+        "    drivers:\n"
+        "      match:\n"
+        "        driver: [foo, b*]\n"
+        "    mac:\n"
+        "      match:\n"
+        "        name: ens4\n"
+        "        macaddress: AA:BB:CC:DD:EE:FF\n";
+    const char* names[] = {"eth0", "ens3", "ens4"};
+    const char* macs[] = {"00:11:22:33:44:55", "aa:bb:cc:dd:ee:ff", "aa:bb:cc:dd:ee:ff"};
+    const char* drivers[] = {"bar", NULL, "foo"};
+    uint8_t matches[12];
+    uint8_t expected[12] = {1, 0, 0,
+                            0, 1, 1,
+                            1, 0, 1,
+                            0, 0, 1};
+
+    NetplanState* np_state = load_string_to_netplan_state(yaml);
+    const NetplanNetDefinition* netdefs[] = {
+        netplan_state_get_netdef(np_state, "eth0"),
+        netplan_state_get_netdef(np_state, "glob"),
+        netplan_state_get_netdef(np_state, "drivers"),
+        netplan_state_get_netdef(np_state, "mac"),
+    };
+
+    size_t count = _netplan_netdefs_match_interfaces(netdefs, 4, names, macs, drivers, 3, matches);
+
+    assert_int_equal(count, 6);
+    assert_memory_equal(matches, expected, sizeof(expected));
+    for (size_t i = 0; i < 4; i++) {
+        for (size_t j = 0; j < 3; j++)
+            assert_int_equal(matches[i * 3 + j],
+                             netplan_netdef_match_interface(netdefs[i], names[j], macs[j], drivers[j]));
+    }
+
+    netplan_state_clear(&np_state);
+}
+
+void
+test_netplan_version(__unused void** state)
+{
+    assert_string_equal(_netplan_version(), NETPLAN_VERSION);
+}
+
 int
 setup(__unused void** state)
 {
@@ -370,6 +444,8 @@ main()
            cmocka_unit_test(test_netplan_get_id_from_nm_filepath_with_ssid),
            cmocka_unit_test(test_netplan_get_id_from_nm_filepath_buffer_is_too_small),
            cmocka_unit_test(test_netplan_get_id_from_nm_filepath_buffer_is_the_exact_size),
+           cmocka_unit_test(test_netplan_get_id_from_nm_filepath_size_query),
+           cmocka_unit_test(test_netplan_copy_string_size_query),
            cmocka_unit_test(test_netplan_get_id_from_nm_filepath_filename_is_malformed),
            cmocka_unit_test(test_netplan_netdef_get_output_filename_nm_with_ssid),
            cmocka_unit_test(test_netplan_netdef_get_output_filename_nm_without_ssid),
@@ -380,6 +456,8 @@ main()
            cmocka_unit_test(test_util_is_route_rule_present),
            cmocka_unit_test(test_util_is_string_in_array),
            cmocka_unit_test(test_normalize_ip_address),
+           cmocka_unit_test(test_netplan_netdefs_match_interfaces),
+           cmocka_unit_test(test_netplan_version),
        };
 
        return cmocka_run_group_tests(tests, setup, tear_down);
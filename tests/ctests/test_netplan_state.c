@@ -75,6 +75,47 @@ test_netplan_state_iterator_null_has_next(__unused void** state)
     assert_false(netplan_state_iterator_has_next(NULL));
 }
 
+void
+test_netplan_state_dump_json(__unused void** state)
+{
+    NetplanState* np_state = load_fixture_to_netplan_state("bond.yaml");
+    g_autoptr(GError) error = NULL;
+    char buf[1024] = { 0 };
+    int fd = memfd_create("netplan_state.json", 0);
+
+    assert_true(_netplan_state_dump_json(np_state, fd, &error));
+    assert_null(error);
+    lseek(fd, 0, SEEK_SET);
+    assert_true(read(fd, buf, sizeof(buf) - 1) > 0);
+    close(fd);
+
+    assert_true(g_str_has_prefix(buf, "{\"network\":{\"version\":2,\"renderer\":\"networkd\","));
+    assert_non_null(strstr(buf, "\"ethernets\":{\"eth0\":{"));
+    assert_non_null(strstr(buf, "\"bonds\":{\"bond0\":{"));
+    assert_non_null(strstr(buf, "\"dhcp4\":true"));
+    assert_non_null(strstr(buf, "\"interfaces\":[\"eth0\"]"));
+    assert_true(g_str_has_suffix(buf, "}}"));
+
+    netplan_state_clear(&np_state);
+}
+
+void
+test_netplan_state_dump_json_empty(__unused void** state)
+{
+    NetplanState* np_state = netplan_state_new();
+    g_autoptr(GError) error = NULL;
+    char buf[16] = { 0 };
+    int fd = memfd_create("netplan_state.json", 0);
+
+    assert_true(_netplan_state_dump_json(np_state, fd, &error));
+    lseek(fd, 0, SEEK_SET);
+    assert_int_equal(read(fd, buf, sizeof(buf) - 1), 2);
+    close(fd);
+    assert_string_equal(buf, "{}");
+
+    netplan_state_clear(&np_state);
+}
+
 
 int
 setup(__unused void** state)
@@ -98,6 +139,8 @@ main()
         cmocka_unit_test(test_netplan_state_iterator_empty),
         cmocka_unit_test(test_netplan_state_iterator_null),
         cmocka_unit_test(test_netplan_state_iterator_null_has_next),
+        cmocka_unit_test(test_netplan_state_dump_json),
+        cmocka_unit_test(test_netplan_state_dump_json_empty),
     };
 
     return cmocka_run_group_tests(tests, setup, tear_down);
@@ -16,6 +16,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import json
 import os
 import subprocess
 
@@ -116,6 +117,105 @@ class TestConfigArgs(TestBase):
         # can be /proc/foor/run/systemd/{network,system}
         self.assertIn('cannot create directory /proc/foo/run/systemd/', err)
 
+    def _generate_manifest(self, yaml):
+        conf = os.path.join(self.confdir, 'a.yaml')
+        os.makedirs(self.confdir, exist_ok=True)
+        with open(conf, 'w') as f:
+            f.write(yaml)
+        out = subprocess.check_output([exe_generate, '--root-dir', self.workdir.name, '--manifest', '-'], text=True)
+        return json.loads(out)
+
+    def test_incremental_manifest(self):
+        eth0_network = os.path.join(self.workdir.name, 'run/systemd/network/10-netplan-eth0.network')
+        eth1_network = os.path.join(self.workdir.name, 'run/systemd/network/10-netplan-eth1.network')
+        manifest = self._generate_manifest('''network:
+  version: 2
+  ethernets:
+    eth0:
+      dhcp4: true
+    eth1:
+      dhcp4: true''')
+        self.assertEqual(manifest['global']['added'], ['/run/systemd/system/netplan-ovs-cleanup.service'])
+        self.assertEqual(manifest['netdefs']['eth0'],
+                         {'added': ['/run/systemd/network/10-netplan-eth0.network'], 'changed': [], 'removed': []})
+        self.assertEqual(manifest['netdefs']['eth1'],
+                         {'added': ['/run/systemd/network/10-netplan-eth1.network'], 'changed': [], 'removed': []})
+        eth0_mtime = os.stat(eth0_network).st_mtime_ns
+
+        # only eth1 changes, eth0 is left untouched
+        manifest = self._generate_manifest('''network:
+  version: 2
+  ethernets:
+    eth0:
+      dhcp4: true
+    eth1:
+      dhcp6: true''')
+        self.assertEqual(manifest, {
+            'global': {'added': [], 'changed': [], 'removed': []},
+            'netdefs': {'eth1': {'added': [], 'changed': ['/run/systemd/network/10-netplan-eth1.network'], 'removed': []}}})
+        self.assertEqual(os.stat(eth0_network).st_mtime_ns, eth0_mtime)
+        with open(eth1_network) as f:
+            self.assertIn('DHCP=ipv6', f.read())
+
+        # eth1 is dropped
+        manifest = self._generate_manifest('''network:
+  version: 2
+  ethernets:
+    eth0:
+      dhcp4: true''')
+        self.assertEqual(manifest['netdefs'],
+                         {'eth1': {'added': [], 'changed': [], 'removed': ['/run/systemd/network/10-netplan-eth1.network']}})
+        self.assertFalse(os.path.exists(eth1_network))
+        self.assertEqual(os.stat(eth0_network).st_mtime_ns, eth0_mtime)
+
+    def test_incremental_symlinks(self):
+        yaml = '''network:
+  version: 2
+  openvswitch:
+    ports: [[patch0-1, patch1-0]]
+  bridges:
+    ovs0:
+      interfaces: [patch0-1]'''
+        self._generate_manifest(yaml)
+        link = os.path.join(self.workdir.name, 'run/systemd/system/systemd-networkd.service.wants/netplan-ovs-ovs0.service')
+        self.assertTrue(os.path.islink(link))
+        manifest = self._generate_manifest(yaml)
+        self.assertEqual(manifest, {'global': {'added': [], 'changed': [], 'removed': []}, 'netdefs': {}})
+        self.assertTrue(os.path.islink(link))
+
+    def test_incremental_manifest_file(self):
+        conf = os.path.join(self.confdir, 'a.yaml')
+        os.makedirs(self.confdir)
+        with open(conf, 'w') as f:
+            f.write('''network:
+  version: 2
+  renderer: NetworkManager
+  ethernets:
+    eth0:
+      dhcp4: true''')
+        manifest_path = os.path.join(self.workdir.name, 'manifest.json')
+        subprocess.check_call([exe_generate, '--root-dir', self.workdir.name, '--manifest', manifest_path])
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        self.assertEqual(manifest['netdefs']['eth0']['added'],
+                         ['/run/NetworkManager/system-connections/netplan-eth0.nmconnection'])
+        self.assertIn('/run/NetworkManager/conf.d/10-globally-managed-devices.conf', manifest['global']['added'])
+
+    def test_incremental_manifest_write_error(self):
+        conf = os.path.join(self.confdir, 'a.yaml')
+        os.makedirs(self.confdir)
+        with open(conf, 'w') as f:
+            f.write('''network:
+  version: 2
+  ethernets:
+    eth0:
+      dhcp4: true''')
+        # the buffered write only fails when flushing, i.e. on fclose()
+        p = subprocess.run([exe_generate, '--root-dir', self.workdir.name, '--manifest', '/dev/full'],
+                           stderr=subprocess.PIPE, text=True)
+        self.assertNotEqual(p.returncode, 0)
+        self.assertIn('Cannot write manifest /dev/full: No space left on device', p.stderr)
+
     def test_systemd_generator(self):
         conf = os.path.join(self.confdir, 'a.yaml')
         os.makedirs(os.path.dirname(conf))
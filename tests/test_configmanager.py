@@ -21,7 +21,8 @@ import shutil
 import tempfile
 import unittest
 
-from netplan_cli.configmanager import ConfigManager, ConfigurationError
+from netplan_cli.configmanager import (ConfigManager, ConfigurationError, RACY_MTIME_NS,
+                                       _parsed_states, clear_parsed_states, yaml_hierarchy)
 
 
 class TestConfigManager(unittest.TestCase):
@@ -254,6 +255,54 @@ class TestConfigManager(unittest.TestCase):
         self.assertIn('ethtest', state.ethernets)
         self.assertIn('bond6',   state.bonds)
 
+    def test_parse_cached(self):
+        state = self.configmanager.parse()
+        self.assertIs(self.configmanager.parse(), state)
+        # the cache is shared between ConfigManagers
+        self.assertIs(ConfigManager(prefix=self.workdir.name).parse(), state)
+        # but not between different sets of files
+        other = self.configmanager.parse(extra_config=[os.path.join(self.workdir.name, "newfile.yaml")])
+        self.assertIsNot(other, state)
+        self.assertIn('ethtest', other.ethernets)
+        clear_parsed_states()
+        self.assertIsNot(self.configmanager.parse(), other)
+
+    def test_parse_cache_invalidated(self):
+        path = os.path.join(self.workdir.name, "etc/netplan/test.yaml")
+        state = self.configmanager.parse()
+        # rewrite a file with the same size, within the mtime granularity
+        with open(path, 'r+') as f:
+            content = f.read()
+            f.seek(0)
+            f.write(content.replace('eth0', 'ethX'))
+        stat = os.stat(path)
+        for cached_key, _, _ in _parsed_states.values():
+            for cached_path, mtime, _, _ in cached_key:
+                if cached_path == path:
+                    os.utime(path, ns=(stat.st_atime_ns, mtime))
+        new_state = self.configmanager.parse()
+        self.assertIsNot(new_state, state)
+        self.assertIn('ethX', new_state.ethernets)
+        self.assertNotIn('eth0', new_state.ethernets)
+        # files which are old enough are identified by their attributes only
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns - 10 * RACY_MTIME_NS))
+        new_state = self.configmanager.parse()
+        self.assertIs(self.configmanager.parse(), new_state)
+        os.remove(path)
+        self.assertNotIn('ethX', self.configmanager.parse().ethernets)
+
+    def test_yaml_hierarchy(self):
+        for path in ['lib/netplan/a.yaml', 'lib/netplan/c.yaml', 'etc/netplan/c.yaml',
+                     'etc/netplan/b.yaml', 'run/netplan/b.yaml', 'run/netplan/d.yml']:
+            path = os.path.join(self.workdir.name, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write('network: {}\n')
+        hierarchy = yaml_hierarchy(self.workdir.name)
+        self.assertEqual([os.path.relpath(p, self.workdir.name) for p in hierarchy],
+                         ['lib/netplan/a.yaml', 'run/netplan/b.yaml', 'etc/netplan/c.yaml',
+                          'etc/netplan/test.yaml', 'etc/netplan/test2.yaml'])
+
     def test_add(self):
         self.configmanager.add({os.path.join(self.workdir.name, "newfile.yaml"):
                                 os.path.join(self.workdir.name, "etc/netplan/newfile.yaml")})
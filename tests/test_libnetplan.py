@@ -18,6 +18,8 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import ctypes
+import glob
+import json
 import os
 import shutil
 import tempfile
@@ -479,6 +481,65 @@ class TestState(TestBase):
       dhcp4: false''')
         self.assertEqual(1, len(state))
 
+    def test_netdefs_by_type(self):
+        state = state_from_yaml(self.confdir, '''network:
+  ethernets:
+    eth0:
+      dhcp4: false
+    eth1:
+      dhcp4: false
+  bridges:
+    br0:
+      interfaces: [eth1]''')
+        self.assertSetEqual(set(state.netdefs), {'eth0', 'eth1', 'br0'})
+        self.assertSetEqual(set(state.ethernets), {'eth0', 'eth1'})
+        self.assertSetEqual(set(state.bridges), {'br0'})
+        self.assertEqual(len(state.bonds), 0)
+        # indexed once and shared, read-only
+        self.assertIs(state.ethernets, state.ethernets)
+        self.assertIs(state.ethernets['eth0'], state.netdefs['eth0'])
+        with self.assertRaises(TypeError):
+            state.ethernets['eth2'] = state.netdefs['br0']
+
+    def test_netdefs_by_type_import(self):
+        state = netplan.State()
+        self.assertEqual(len(state.ethernets), 0)
+        parser = netplan.Parser()
+        with tempfile.NamedTemporaryFile(suffix='.yaml') as f:
+            f.write(b'''network:
+  ethernets:
+    eth0:
+      dhcp4: false''')
+            f.flush()
+            parser.load_yaml(f.name)
+        state.import_parser_results(parser)
+        # the index is dropped, when the state changes
+        self.assertSetEqual(set(state.ethernets), {'eth0'})
+
+    def test_to_dict(self):
+        state = state_from_yaml(self.confdir, '''network:
+  renderer: networkd
+  ethernets:
+    eth0:
+      dhcp4: true
+      addresses: [10.0.0.1/24]
+      mtu: 9000
+  vlans:
+    vlan10:
+      id: 10
+      link: eth0
+      macaddress: "00:11:22:33:44:55"''')
+        data = state.to_dict()
+        out = io.StringIO()
+        state._dump_yaml(out)
+        self.assertEqual(data, yaml.safe_load(out.getvalue()))
+        self.assertEqual(data['network']['ethernets']['eth0']['mtu'], 9000)
+        self.assertIs(data['network']['ethernets']['eth0']['dhcp4'], True)
+        self.assertEqual(data['network']['vlans']['vlan10']['macaddress'], '00:11:22:33:44:55')
+
+    def test_to_dict_empty_state(self):
+        self.assertEqual(netplan.State().to_dict(), {})
+
     def test_bad_state(self):
         state = netplan.State()
         parser = netplan.Parser()
@@ -520,6 +581,35 @@ class TestState(TestBase):
             f.flush()
             self.assertEqual(0, f.seek(0, io.SEEK_END))
 
+    def test_dump_yaml_bytes(self):
+        state = state_from_yaml(self.confdir, '''network:
+  ethernets:
+    eth0:
+      dhcp4: false
+  bridges:
+    br0:
+      dhcp4: true''')
+        data = state.dump_yaml_bytes()
+        self.assertIsInstance(data, memoryview)
+        self.assertTrue(data.readonly)
+        out = io.StringIO()
+        state._dump_yaml(out)
+        self.assertEqual(out.getvalue(), str(data, 'utf-8'))
+        self.assertEqual({'eth0': {'dhcp4': False}},
+                         yaml.safe_load(bytes(state.dump_yaml_bytes(['network', 'ethernets']))))
+
+    def test_dump_yaml_bytes_empty_state(self):
+        self.assertEqual(b'', netplan.State().dump_yaml_bytes())
+
+    def test_dump_yaml_binary_file(self):
+        state = state_from_yaml(self.confdir, '''network:
+  ethernets:
+    eth0:
+      dhcp4: false''')
+        out = io.BytesIO()
+        state._dump_yaml(out)
+        self.assertEqual(bytes(state.dump_yaml_bytes()), out.getvalue())
+
     def test_write_yaml_file_unremovable_target(self):
         state = state_from_yaml(self.confdir, '''network:
   ethernets:
@@ -560,6 +650,63 @@ class TestState(TestBase):
             state._write_yaml_file('test.yml', self.workdir.name)
         self.assertIn('No such file or directory', str(context.exception))
 
+    def test_generate(self):
+        state = state_from_yaml(self.confdir, '''network:
+  ethernets:
+    eth0:
+      dhcp4: true
+    eth1:
+      renderer: NetworkManager
+      dhcp4: true''')
+        stale = os.path.join(self.workdir.name, 'run/systemd/network/10-netplan-stale.network')
+        os.makedirs(os.path.dirname(stale))
+        open(stale, 'w').close()
+        state.generate(self.workdir.name)
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue(os.path.isfile(os.path.join(self.workdir.name, 'run/systemd/network/10-netplan-eth0.network')))
+        self.assertTrue(os.path.isfile(os.path.join(
+            self.workdir.name, 'run/NetworkManager/system-connections/netplan-eth1.nmconnection')))
+        self.assertTrue(os.path.isfile(os.path.join(
+            self.workdir.name, 'run/NetworkManager/conf.d/10-globally-managed-devices.conf')))
+
+    def test_generate_incremental(self):
+        state = state_from_yaml(self.confdir, '''network:
+  ethernets:
+    eth0:
+      dhcp4: true''')
+        manifest = os.path.join(self.workdir.name, 'manifest.json')
+        state.generate(self.workdir.name, manifest=manifest)
+        with open(manifest) as f:
+            self.assertIn('/run/systemd/network/10-netplan-eth0.network', json.load(f)['netdefs']['eth0']['added'])
+        state.generate(self.workdir.name, incremental=True, manifest=manifest)
+        with open(manifest) as f:
+            self.assertEqual(json.load(f)['netdefs'], {})
+
+    def test_generate_error(self):
+        state = state_from_yaml(self.confdir, '''network:
+  modems:
+    mobilephone:
+      auto-config: true''')
+        with self.assertRaises(netplan.NetplanException) as context:
+            state.generate(self.workdir.name)
+        self.assertIn('networkd backend does not support GSM/CDMA modem configuration', str(context.exception))
+        self.assertEqual([], glob.glob(os.path.join(self.workdir.name, 'run/systemd/network/*')))
+
+    def test_generate_write_error(self):
+        state = state_from_yaml(self.confdir, '''network:
+  ethernets:
+    eth0:
+      dhcp4: true''')
+        # a file where the run/ directory should be
+        open(os.path.join(self.workdir.name, 'run'), 'w').close()
+        # the error is raised, instead of exiting the interpreter
+        with self.assertRaises(netplan.NetplanFileException) as context:
+            state.generate(self.workdir.name)
+        self.assertIn('cannot create directory {}/run/systemd/'.format(self.workdir.name), str(context.exception))
+        # and the next generation does not fail due to a stale error
+        os.remove(os.path.join(self.workdir.name, 'run'))
+        state.generate(self.workdir.name)
+
 
 class TestNetDefinition(TestBase):
     def test_type(self):
@@ -570,6 +717,20 @@ class TestNetDefinition(TestBase):
 
         self.assertEqual(state['eth0'].type, 'ethernets')
 
+    def test_to_dict(self):
+        state = state_from_yaml(self.confdir, '''network:
+  ethernets:
+    eth0:
+      dhcp4: true
+    eth1: {}''')
+        ethernets = state.to_dict()['network']['ethernets']
+        self.assertEqual(state['eth0'].to_dict(), ethernets['eth0'])
+        self.assertEqual(state['eth1'].to_dict(), ethernets['eth1'])
+        self.assertIs(state['eth0'].to_dict()['dhcp4'], True)
+        # the netdefs get their own copy
+        state['eth0'].to_dict()['dhcp4'] = False
+        self.assertIs(state['eth0'].to_dict()['dhcp4'], True)
+
     def test_backend(self):
         state = state_from_yaml(self.confdir, '''network:
   renderer: networkd
@@ -599,14 +760,44 @@ class TestNetDefinition(TestBase):
     eth1:
       dhcp4: false''')
 
-        # netplan.State __getitem__ doesn't cache the netdefs,
-        # so fetching it twice should create two separate Python objects
-        # pointing to the same C struct.
         self.assertEqual(state['eth0'], state['eth0'])
         self.assertNotEqual(state['eth0'], state['eth1'])
         # Test against a weird singleton to ensure consistency against other types
         self.assertNotEqual(state['eth0'], True)
 
+    def test_interned(self):
+        state = state_from_yaml(self.confdir, '''network:
+  ethernets:
+    eth0:
+      dhcp4: false
+  vlans:
+    vlan1:
+      id: 1
+      link: eth0''')
+
+        eth0 = state['eth0']
+        self.assertIs(eth0, state['eth0'])
+        self.assertIs(eth0, state.ethernets['eth0'])
+        self.assertIs(eth0, state['vlan1'].links['vlan'])
+        self.assertEqual(set([eth0, state['vlan1']]), set(state.netdefs.values()))
+        self.assertEqual(2, len(set([eth0, state['eth0'], state['vlan1']])))
+
+    def test_read_only(self):
+        state = state_from_yaml(self.confdir, '''network:
+  ethernets:
+    eth0:
+      dhcp4: false''')
+
+        netdef = state['eth0']
+        with self.assertRaises(AttributeError):
+            netdef.id = 'eth1'
+        with self.assertRaises(AttributeError):
+            netdef.foo = 'bar'
+        self.assertEqual('eth0', netdef.id)
+        # the links are a copy, which can be changed by the caller
+        netdef.links['bond'] = None
+        self.assertEqual({}, netdef.links)
+
     def test_filepath(self):
         state = state_from_yaml(self.confdir, '''network:
   ethernets:
@@ -615,6 +806,16 @@ class TestNetDefinition(TestBase):
         netdef = state['eth0']
         self.assertEqual(os.path.join(self.confdir, "a.yaml"), netdef.filepath)
 
+    def test_long_string(self):
+        # longer than the buffer strings are first read into
+        long_id = 'eth' * 2000
+        state = state_from_yaml(self.confdir, '''network:
+  ethernets:
+    %s:
+      match:
+        name: eth0''' % long_id)
+        self.assertEqual(long_id, state[long_id].id)
+
     def test_filepath_for_ovs_ports(self):
         state = state_from_yaml(self.confdir, '''network:
   version: 2
@@ -711,6 +912,32 @@ class TestNetDefinition(TestBase):
         self.assertTrue(state['mac-match']._match_interface(iface_mac="11:22:33:AA:BB:FF"))
         self.assertFalse(state['mac-match']._match_interface(iface_mac="11:22:33:AA:BB:CC"))
 
+    def test_match_interfaces(self):
+        state = state_from_yaml(self.confdir, '''network:
+  ethernets:
+    eth0: {}
+    name-match:
+      match:
+        name: "en*"
+    driver-match:
+      match:
+        driver: ["foo", "b*"]
+    mac-match:
+      match:
+        name: ens4
+        macaddress: 11:22:33:AA:BB:FF''')
+        interfaces = [('eth0', '00:11:22:33:44:55', 'bar'),
+                      ('ens3', '11:22:33:aa:bb:ff', None),
+                      ('ens4', '11:22:33:aa:bb:ff', 'foo')]
+        self.assertDictEqual(state.match_interfaces(interfaces), {
+            'eth0': ['eth0'],
+            'name-match': ['ens3', 'ens4'],
+            'driver-match': ['eth0', 'ens4'],
+            'mac-match': ['ens4'],
+        })
+        self.assertDictEqual(state.match_interfaces([]), {
+            'eth0': [], 'name-match': [], 'driver-match': [], 'mac-match': []})
+
     def test_match_without_match_block(self):
         state = state_from_yaml(self.confdir, '''network:
   ethernets:
@@ -848,6 +1075,9 @@ class TestNetDefinition(TestBase):
 
 
 class TestFreeFunctions(TestBase):
+    def test_get_version(self):
+        self.assertRegex(netplan._get_version(), r'^\d+\.\d+')
+
     def test_create_yaml_patch_dict(self):
         with tempfile.TemporaryFile() as patchfile:
             payload = {'ethernets': {
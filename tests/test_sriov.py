@@ -24,7 +24,6 @@ from subprocess import CalledProcessError
 from collections import defaultdict
 from unittest.mock import patch, mock_open, call
 
-import netplan
 import netplan_cli.cli.sriov as sriov
 
 from netplan_cli.configmanager import ConfigManager, ConfigurationError
@@ -519,7 +518,7 @@ class TestSRIOV(unittest.TestCase):
         gim.return_value = '00:01:02:03:04:05'
 
         # call method under test
-        sriov.apply_sriov_config(self.configmanager, rootdir=self.workdir.name)
+        sriov.apply_sriov_config(self.configmanager)
 
         # make sure config_manager.parse() has been called
         self.assertTrue(self.configmanager.np_state)
@@ -578,8 +577,8 @@ class TestSRIOV(unittest.TestCase):
         gim.return_value = '00:01:02:03:04:05'
 
         # call method under test
-        with self.assertRaises(netplan.NetplanValidationException) as e:
-            sriov.apply_sriov_config(self.configmanager, rootdir=self.workdir.name)
+        with self.assertRaises(ConfigurationError) as e:
+            sriov.apply_sriov_config(self.configmanager)
 
         self.assertIn('vf1.15: missing \'id\' property', str(e.exception))
         self.assertEqual(apply_vlan.call_count, 0)
@@ -598,7 +597,7 @@ class TestSRIOV(unittest.TestCase):
 ''', file=fd)
         # call method under test
         with self.assertLogs() as logs:
-            sriov.apply_sriov_config(self.configmanager, rootdir=self.workdir.name)
+            sriov.apply_sriov_config(self.configmanager)
             self.assertIn('SR-IOV vlan defined for vf1.15 but link enp1 is '
                           'either not a VF or has no matches',
                           logs.output[0])
@@ -652,7 +651,7 @@ class TestSRIOV(unittest.TestCase):
 
         # call method under test
         with self.assertRaises(ConfigurationError) as e:
-            sriov.apply_sriov_config(self.configmanager, rootdir=self.workdir.name)
+            sriov.apply_sriov_config(self.configmanager)
 
         self.assertIn('interface enp2s16f1 for netplan device customvf1 (vf1.16) already has an SR-IOV vlan defined',
                       str(e.exception))
@@ -698,7 +697,7 @@ class TestSRIOV(unittest.TestCase):
 
         # call method under test
         with self.assertRaises(ConfigurationError) as e:
-            sriov.apply_sriov_config(self.configmanager, rootdir=self.workdir.name)
+            sriov.apply_sriov_config(self.configmanager)
 
         self.assertIn('matched more than one interface for a VF device: customvf1',
                       str(e.exception))
@@ -812,7 +811,7 @@ MODALIAS=pci:v00008086d0000156Fsv000017AAsd00002245bc02sc00i00
 
         # test success case
         with patch('builtins.open', driver_mock_open):
-            sriov.apply_sriov_config(self.configmanager, rootdir=self.workdir.name)
+            sriov.apply_sriov_config(self.configmanager)
         self.assertEqual(len(writes), handle.call_count)
         self.assertEqual(handle.call_args_list, [call(elem[0], 'wt') for elem in writes])
         self.assertEqual(len(writes), handle().write.call_count)
@@ -21,6 +21,7 @@ import sys
 import unittest
 import tempfile
 import glob
+import hashlib
 import netifaces
 import netplan
 
@@ -185,9 +186,11 @@ class TestUtils(unittest.TestCase):
         iface = utils.find_matching_iface(DEVICES, state['netplan-id'])
         self.assertEqual(iface, None)
 
+    @patch('netplan_cli.cli.utils._read_sysfs_attr')
+    @patch('netplan_cli.cli.utils._get_permanent_macaddresses')
     @patch('netplan_cli.cli.utils.get_interface_driver_name')
     @patch('netplan_cli.cli.utils.get_interface_macaddress')
-    def test_find_matching_iface(self, gim, gidn):
+    def test_find_matching_iface(self, gim, gidn, gpm, rsa):
         # we mock-out get_interface_macaddress to return useful values for the test
         gidn.side_effect = lambda x: 'foo' if x == 'ens4' else 'bar'
         gim.side_effect = lambda x: '00:01:02:03:04:05' if x == 'eth1' else '00:00:00:00:00:00'
@@ -201,6 +204,9 @@ class TestUtils(unittest.TestCase):
 
         iface = utils.find_matching_iface(DEVICES, state['netplan-id'])
         self.assertEqual(iface, 'eth1')
+        # a plain list of names only queries what the match needs
+        rsa.assert_not_called()
+        gpm.assert_not_called()
 
     @patch('netplan_cli.cli.utils.get_interface_driver_name')
     @patch('netplan_cli.cli.utils.get_interface_macaddress')
@@ -235,6 +241,88 @@ class TestUtils(unittest.TestCase):
         iface = utils.find_matching_iface(DEVICES, state['netplan-id'])
         self.assertEqual(iface, 'ens4')
 
+    @patch('netplan_cli.cli.utils._read_sysfs_attr')
+    @patch('netplan_cli.cli.utils._get_permanent_macaddresses')
+    @patch('netplan_cli.cli.utils.get_interface_driver_name')
+    @patch('netplan_cli.cli.utils.get_interface_macaddress')
+    def test_find_matching_iface_inventory(self, gim, gidn, gpm, rsa):
+        rsa.return_value = None
+        gidn.side_effect = lambda x: 'foo' if x == 'ens4' else 'bar'
+        gim.side_effect = lambda x: '00:01:02:03:04:05' if x == 'eth1' else '00:00:00:00:00:00'
+
+        state = self.load_conf('''network:
+  ethernets:
+    id0:
+      match:
+        name: "e*"
+        macaddress: "00:01:02:03:04:05"
+    id1:
+      match:
+        driver: "f*"''')
+
+        inventory = utils.InterfaceInventory(DEVICES)
+        self.assertEqual(utils.find_matching_iface(inventory, state['id0']), 'eth1')
+        self.assertEqual(utils.find_matching_iface(inventory, state['id1']), 'ens4')
+        # the interface properties were queried only once
+        self.assertEqual(gidn.call_count, len(DEVICES))
+        self.assertEqual(gim.call_count, len(DEVICES))
+        # the permanent MAC addresses are not needed for matching
+        gpm.assert_not_called()
+
+    @patch('netifaces.interfaces')
+    @patch('netplan_cli.cli.netlink.Netlink')
+    @patch('netplan_cli.cli.utils._read_sysfs_attr')
+    @patch('netplan_cli.cli.utils.get_interface_driver_name')
+    @patch('netplan_cli.cli.utils.get_interface_macaddress')
+    def test_interface_inventory(self, gim, gidn, rsa, nl, nif):
+        nl.return_value.__enter__.return_value.links.return_value = [
+            {'ifindex': 2, 'ifname': 'eth0', 'address': '00:00:00:00:00:01', 'permaddr': '00:01:02:03:04:05'},
+            {'ifindex': 3, 'ifname': 'eth1', 'address': '00:00:00:00:00:02'}]
+        nif.return_value = ['eth0', 'eth1']
+        gidn.side_effect = lambda x: 'mlx5_core'
+        gim.side_effect = lambda x: '00:00:00:00:00:01' if x == 'eth0' else '00:00:00:00:00:02'
+        sysfs = {
+            ('eth0', 'ifindex'): '2',
+            ('eth0', 'operstate'): 'up',
+            ('eth0', 'device/uevent'): 'DRIVER=mlx5_core\nPCI_SLOT_NAME=0000:00:1f.6\n',
+            ('eth1', 'ifindex'): '3',
+            ('eth1', 'operstate'): 'down',
+        }
+        rsa.side_effect = lambda iface, attr: sysfs.get((iface, attr))
+
+        inventory = utils.InterfaceInventory()
+        # the permanent MAC addresses are only read on demand
+        nl.assert_not_called()
+        self.assertEqual(inventory.names, ['eth0', 'eth1'])
+        self.assertEqual(len(inventory), 2)
+        self.assertIn('eth1', inventory)
+        self.assertNotIn('eth2', inventory)
+        eth0 = inventory['eth0']
+        self.assertEqual(eth0.ifindex, 2)
+        self.assertEqual(eth0.macaddress, '00:00:00:00:00:01')
+        self.assertEqual(eth0.permanent_macaddress, '00:01:02:03:04:05')
+        nl.assert_called_once_with()
+        self.assertEqual(eth0.driver, 'mlx5_core')
+        self.assertEqual(eth0.pci_slot, '0000:00:1f.6')
+        self.assertEqual(eth0.operstate, 'up')
+        eth1 = inventory['eth1']
+        self.assertEqual(eth1.permanent_macaddress, '00:00:00:00:00:02')
+        nl.assert_called_once_with()
+        self.assertIsNone(eth1.pci_slot)
+        self.assertIs(inventory.by_ifindex(3), eth1)
+        self.assertIs(inventory.by_pci_slot('0000:00:1f.6'), eth0)
+        self.assertEqual(inventory.by_macaddress('00:00:00:00:00:02'), [eth1])
+        self.assertEqual(inventory.by_driver('mlx5_core'), [eth0, eth1])
+        self.assertIsNone(inventory.get('eth2'))
+
+        # new links only show up after a refresh
+        nif.return_value = ['eth0', 'eth1', 'eth2']
+        self.assertNotIn('eth2', inventory)
+        inventory.refresh()
+        self.assertIn('eth2', inventory)
+        self.assertIsNone(inventory['eth2'].ifindex)
+        self.assertEqual(inventory.by_driver('mlx5_core'), [inventory['eth0'], inventory['eth1'], inventory['eth2']])
+
     @patch('netifaces.ifaddresses')
     def test_interface_macaddress(self, ifaddr):
         ifaddr.side_effect = lambda _: {netifaces.AF_LINK: [{'addr': '00:01:02:03:04:05'}]}
@@ -371,3 +459,147 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(self.mock_cmd.calls(), [
             ['ip', 'addr', 'flush', 'eth42']
         ])
+
+    def _write_generated_file(self, path, content):
+        path = os.path.join(self.workdir.name, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def test_generated_files_digests(self):
+        self._write_generated_file('run/systemd/network/10-netplan-eth0.network', '[Match]\nName=eth0\n')
+        self._write_generated_file('run/systemd/network/99-other.network', '[Match]\nName=eth1\n')
+        self._write_generated_file('run/systemd/system/netplan-ovs-br0.service', '[Unit]\n')
+        self._write_generated_file('run/udev/rules.d/99-netplan-eth0.rules', 'SUBSYSTEM=="net"\n')
+        self._write_generated_file('run/udev/rules.d/60-other.rules', 'SUBSYSTEM=="net"\n')
+        digests = utils.generated_files_digests(self.workdir.name)
+        self.assertEqual(sorted(os.path.relpath(p, self.workdir.name) for p in digests), [
+            'run/systemd/network/10-netplan-eth0.network',
+            'run/systemd/system/netplan-ovs-br0.service',
+            'run/udev/rules.d/99-netplan-eth0.rules'])
+        self.assertEqual(digests[os.path.join(self.workdir.name, 'run/systemd/network/10-netplan-eth0.network')],
+                         hashlib.sha256(b'[Match]\nName=eth0\n').hexdigest())
+
+    def test_generated_file_owner(self):
+        self.assertEqual(utils.generated_file_owner('/run/systemd/network/10-netplan-eth0.100.netdev'),
+                         ('networkd', 'eth0.100'))
+        self.assertEqual(utils.generated_file_owner('/run/systemd/network/10-netplan-eth0.link'),
+                         ('networkd', 'eth0'))
+        self.assertEqual(utils.generated_file_owner('/run/systemd/system/netplan-wpa-wl\\x2d0.service'),
+                         ('networkd', 'wl-0'))
+        self.assertEqual(utils.generated_file_owner('/run/systemd/system/netplan-ovs-br0.service'),
+                         ('OpenVSwitch', 'br0'))
+        self.assertEqual(utils.generated_file_owner('/run/systemd/system/netplan-ovs-cleanup.service'),
+                         (None, None))
+        self.assertEqual(utils.generated_file_owner('/run/systemd/system/netplan-regdom.service'),
+                         (None, None))
+        self.assertEqual(utils.generated_file_owner('/run/NetworkManager/system-connections/netplan-eth0.nmconnection'),
+                         ('NetworkManager', 'eth0'))
+        self.assertEqual(utils.generated_file_owner('/run/NetworkManager/conf.d/netplan.conf'),
+                         ('NetworkManager', None))
+        self.assertEqual(utils.generated_file_owner('/run/netplan/wpa-wl-0.conf'),
+                         ('networkd', 'wl-0'))
+
+    def test_generated_file_owner_nm_wifi(self):
+        self._write_generated_file('run/NetworkManager/system-connections/netplan-wl-0-my%20wifi.nmconnection',
+                                   '[connection]\nid=netplan-wl-0-my wifi\n[wifi]\nssid=my wifi\n')
+        path = os.path.join(self.workdir.name, 'run/NetworkManager/system-connections/netplan-wl-0-my%20wifi.nmconnection')
+        self.assertEqual(utils.generated_file_owner(path), ('NetworkManager', 'wl-0'))
+
+    def test_generated_files_changes(self):
+        old = {'/run/systemd/network/10-netplan-eth0.network': 'a',
+               '/run/systemd/network/10-netplan-eth1.network': 'b',
+               '/run/systemd/system/netplan-ovs-br0.service': 'c',
+               '/run/NetworkManager/system-connections/netplan-eth2.nmconnection': 'd'}
+        new = {'/run/systemd/network/10-netplan-eth0.network': 'a',
+               '/run/systemd/network/10-netplan-eth1.network': 'x',
+               '/run/systemd/network/10-netplan-eth1.link': 'y',
+               '/run/systemd/system/netplan-ovs-br0.service': 'c',
+               '/run/systemd/system/netplan-ovs-cleanup.service': 'z'}
+        changes = utils.generated_files_changes(old, new)
+        self.assertEqual(changes, {
+            'networkd': {'eth1': {'/run/systemd/network/10-netplan-eth1.network',
+                                  '/run/systemd/network/10-netplan-eth1.link'}},
+            'NetworkManager': {'eth2': {'/run/NetworkManager/system-connections/netplan-eth2.nmconnection'}},
+            'OpenVSwitch': {}})
+
+    def test_generated_files_changes_psk(self):
+        wpa_conf = 'ctrl_interface=/run/wpa_supplicant\n\nnetwork={{\n  ssid="home"\n  psk="{}"\n}}\n'
+        self._write_generated_file('run/systemd/network/10-netplan-wl0.network', '[Match]\nName=wl0\n')
+        self._write_generated_file('run/systemd/system/netplan-wpa-wl0.service', '[Unit]\n')
+        self._write_generated_file('run/netplan/wpa-wl0.conf', wpa_conf.format('password1'))
+        old = utils.generated_files_digests(self.workdir.name)
+        # only the wpa_supplicant configuration changes with the credentials
+        self._write_generated_file('run/netplan/wpa-wl0.conf', wpa_conf.format('password2'))
+        new = utils.generated_files_digests(self.workdir.name)
+        changes = utils.generated_files_changes(old, new)
+        self.assertEqual(changes, {
+            'networkd': {'wl0': {os.path.join(self.workdir.name, 'run/netplan/wpa-wl0.conf')}},
+            'NetworkManager': {},
+            'OpenVSwitch': {}})
+
+    def test_generated_files_changes_nm_global(self):
+        self._write_generated_file('run/NetworkManager/conf.d/netplan.conf', '[keyfile]\n')
+        old = utils.generated_files_digests(self.workdir.name)
+        self._write_generated_file('run/NetworkManager/conf.d/netplan.conf', '[keyfile]\nunmanaged-devices+=eth0\n')
+        new = utils.generated_files_digests(self.workdir.name)
+        changes = utils.generated_files_changes(old, new)
+        self.assertEqual(list(changes['NetworkManager']), [None])
+
+    def test_generated_files_changes_unchanged(self):
+        digests = {'/run/systemd/network/10-netplan-eth0.network': 'a'}
+        changes = utils.generated_files_changes(digests, dict(digests))
+        self.assertEqual(changes, {'networkd': {}, 'NetworkManager': {}, 'OpenVSwitch': {}})
+
+    def test_generated_udev_changes(self):
+        old = {'/run/systemd/network/10-netplan-eth0.network': 'a',
+               '/run/systemd/network/10-netplan-eth0.link': 'b',
+               '/run/systemd/network/10-netplan-eth1.link': 'c',
+               '/run/udev/rules.d/99-netplan-eth2.rules': 'd',
+               '/run/udev/rules.d/90-netplan.rules': 'e'}
+        new = {'/run/systemd/network/10-netplan-eth0.network': 'x',
+               '/run/systemd/network/10-netplan-eth0.link': 'b',
+               '/run/systemd/network/10-netplan-eth1.link': 'y',
+               '/run/udev/rules.d/99-netplan-eth3.rules': 'z',
+               '/run/udev/rules.d/90-netplan.rules': 'e'}
+        self.assertEqual(utils.generated_udev_changes(old, new), {'eth1', 'eth2', 'eth3'})
+        self.assertEqual(utils.generated_udev_changes(new, dict(new)), set())
+
+    def test_generated_udev_changes_global(self):
+        old = {'/run/systemd/network/10-netplan-eth1.link': 'a'}
+        new = {'/run/systemd/network/10-netplan-eth1.link': 'b',
+               '/run/udev/rules.d/99-sriov-netplan-setup.rules': 'c'}
+        self.assertIsNone(utils.generated_udev_changes(old, new))
+
+    @patch('socket.if_nametoindex')
+    def test_interface_indexes(self, nametoindex):
+        def _index(iface):
+            if iface == 'eth1':
+                raise OSError('No such device')
+            return {'lo': 1, 'eth0': 2}[iface]
+        nametoindex.side_effect = _index
+        self.assertEqual(utils.interface_indexes(['lo', 'eth0', 'eth1']), {'1', '2'})
+
+    @patch('netplan_cli.cli.utils.netplan_version')
+    def test_config_digest(self, netplan_version):
+        netplan_version.return_value = '0.107'
+        self._write_generated_file('etc/netplan/a.yaml', 'network: {}\n')
+        digest = utils.config_digest(self.workdir.name)
+        self.assertEqual(digest, utils.config_digest(self.workdir.name))
+        # file modes are part of the digest
+        os.chmod(os.path.join(self.workdir.name, 'etc/netplan/a.yaml'), 0o600)
+        self.assertNotEqual(digest, utils.config_digest(self.workdir.name))
+        digest = utils.config_digest(self.workdir.name)
+        # so is the version of libnetplan, which generates the configuration
+        netplan_version.return_value = '0.108'
+        self.assertNotEqual(digest, utils.config_digest(self.workdir.name))
+        digest = utils.config_digest(self.workdir.name)
+        # and shadowing files
+        self._write_generated_file('run/netplan/a.yaml', 'network: {}\n')
+        self.assertNotEqual(digest, utils.config_digest(self.workdir.name))
+
+    @patch('netplan_cli.cli.utils.netplan_version')
+    def test_config_digest_unreadable(self, netplan_version):
+        netplan_version.return_value = '0.107'
+        os.symlink('non-existing', os.path.join(self.workdir.name, 'etc/netplan/a.yaml'))
+        self.assertIsNone(utils.config_digest(self.workdir.name))
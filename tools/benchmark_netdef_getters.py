@@ -0,0 +1,54 @@
+# A simple microbenchmark of the NetDefinition property getters
+# How to use:
+#   From the Netplan source directory, run:
+#     PYTHONPATH=. python3 tools/benchmark_netdef_getters.py [number of netdefs]
+
+import sys
+import tempfile
+import timeit
+
+import netplan
+
+count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+yaml = tempfile.TemporaryFile('w+')
+yaml.write('network:\n  ethernets:\n')
+for i in range(count):
+    yaml.write('''    eth{0}:
+      match:
+        macaddress: "00:11:22:33:{1:02x}:{2:02x}"
+      set-name: "lan{0}"
+      macaddress: "00:aa:bb:cc:{1:02x}:{2:02x}"
+      addresses: ["10.{1}.{2}.1/24", "fd00::{0:x}/64"]
+      nameservers:
+        addresses: ["10.{1}.{2}.53"]
+        search: ["lan{0}.example.com"]
+      routes:
+        - to: default
+          via: "10.{1}.{2}.254"
+'''.format(i, i // 256, i % 256))
+yaml.seek(0)
+
+parser = netplan.Parser()
+state = netplan.State()
+try:
+    parser.load_yaml(yaml)
+    state.import_parser_results(parser)
+except Exception as e:
+    print(e)
+    sys.exit(1)
+
+netdefs = list(state.netdefs.values())
+getters = sorted(name for name, value in vars(netplan.NetDefinition).items() if isinstance(value, property))
+
+print('{:<35} {:>12}'.format('property', 'usec/netdef'))
+for name in getters:
+    getter = getattr(netplan.NetDefinition, name).fget
+    # measure the uncached getters, as the memoized ones would only read the
+    # cache of the NetDefinition from the second repetition on
+    getter = getattr(getter, '__wrapped__', getter)
+    # iterators are consumed, to account for reading their items as well
+    duration = min(timeit.repeat(lambda: [list(v) if hasattr(v, '__next__') else v
+                                          for v in map(getter, netdefs)],
+                                 number=1, repeat=5))
+    print('{:<35} {:>12.2f}'.format(name, duration * 1e6 / len(netdefs)))